@@ -0,0 +1,356 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from utils.ball_tracker import BallTracker, Streak
+from utils.game import add_session_arguments, check_session_arguments, create_session
+from utils.stereo import MultiCameraDetector, load_calibration, parse_plane, track_multiview
+from utils.synthetic import MultiViewScene, SyntheticScene, write_multiview, write_video
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark tracking speed and accuracy on synthetic ball trajectories")
+    parser.add_argument("--resolutions", default="640x480,1280x720,1920x1080",
+                        help="Comma-separated WIDTHxHEIGHT frame sizes")
+    parser.add_argument("--radii", default="12", help="Comma-separated ball radii in pixels")
+    parser.add_argument("--noise", default="0,8", help="Comma-separated pixel noise standard deviations")
+    parser.add_argument("--occlusion", default="0,0.05",
+                        help="Comma-separated per-frame probabilities of an occlusion gap")
+    parser.add_argument("--distractors", default="0,3",
+                        help="Comma-separated numbers of static ball-colored blobs")
+    parser.add_argument("--frames", type=int, default=300, help="Frames per scenario")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Play the throws this many times faster (fast shots)")
+    parser.add_argument("--motion-blur", type=float, default=0.0,
+                        help="Fraction of the frame interval the simulated shutter is open (streaks)")
+    parser.add_argument("--fps", type=float, default=30.0, help="Frame rate the scenes are captured at")
+    parser.add_argument("--drop-rate", type=float, default=0.0,
+                        help="Fraction of frames randomly dropped before tracking, as by a loaded machine")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the scenes")
+    parser.add_argument("--startup", action="store_true",
+                        help="Only measure main.py's startup: import time and time to the first tracked frame")
+    parser.add_argument("--startup-runs", type=int, default=5, help="Number of main.py launches to time")
+    parser.add_argument("--stereo", type=int, default=0,
+                        help="Only benchmark 3D tracking with this many synthetic cameras, serially and in parallel")
+    parser.add_argument("--stereo-offset", type=float, default=0.013,
+                        help="Capture time offset in seconds between consecutive synthetic cameras")
+    parser.add_argument("--stereo-sync", action="store_true",
+                        help="Estimate the camera time offsets instead of using the calibrated ones")
+    parser.add_argument("--stereo-dir", default=None,
+                        help="Keep the rendered multi-view videos and calibration in this directory")
+    parser.add_argument("-o", "--output", default="benchmark_results.json",
+                        help="JSON file to write the results to ('-' for stdout)")
+    add_session_arguments(parser)
+    args = parser.parse_args()
+    check_session_arguments(parser, args)
+    return args
+
+def summarize(values):
+    """
+    Return mean/p50/p95/max of a list of numbers, or None if it is empty.
+    """
+    if not values:
+        return None
+    values = np.asarray(values, dtype=np.float64)
+    return {
+        "mean": float(values.mean()),
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "max": float(values.max()),
+        "count": int(values.size),
+    }
+
+def time_stages(frames, args):
+    """
+    Time the individual detection stages on each frame in isolation.
+    Returns {stage: [milliseconds per frame]}.
+    """
+    session = create_session(args, frames[0].shape[1], frames[0].shape[0])
+    tracker = session.ball_tracker
+    kalman = BallTracker().kalman
+    kalman.statePost = np.zeros((4, 1), np.float32)
+    timings = {"segmentation": [], "contour_search": [], "kalman": []}
+    
+    if tracker.motion is not None:
+        timings["motion"] = []
+    
+    for frame in frames:
+        if tracker.motion is not None:
+            start = time.perf_counter()
+            tracker._update_motion(frame)
+            timings["motion"].append((time.perf_counter() - start) * 1e3)
+        start = time.perf_counter()
+        _, blurred_mask = tracker._segment(frame)
+        segmented = time.perf_counter()
+        ball_pos = tracker._find_ball(blurred_mask)
+        searched = time.perf_counter()
+        timings["segmentation"].append((segmented - start) * 1e3)
+        timings["contour_search"].append((searched - segmented) * 1e3)
+        
+        if ball_pos is not None:
+            x, y = ball_pos.end if isinstance(ball_pos, Streak) else ball_pos[:2]
+            measurement = np.array([[x], [y]], np.float32)
+            start = time.perf_counter()
+            kalman.predict()
+            kalman.correct(measurement)
+            timings["kalman"].append((time.perf_counter() - start) * 1e3)
+    return timings
+
+def run_scenario(scene, frames, truths, args):
+    """
+    Run the tracker and predictor over pre-rendered frames, timing each stage and
+    scoring detections and intercept predictions against ground truth.
+    """
+    height, width = frames[0].shape[:2]
+    session = create_session(args, width, height)
+    tracker = session.ball_tracker
+    predictor = session.trajectory_predictor
+    _, _, paddle_y = session.stick_figure.get_paddle_bounds()
+    
+    timings = {"detect_total": [], "fit": [], "intersection": []}
+    detection_errors = []
+    intercept_errors = []
+    intercept_time_errors = []
+    visible = detected = false_detections = 0
+    
+    # Dropped frames are skipped, but the others keep their capture timestamps
+    rng = np.random.default_rng(args.seed)
+    dropped = rng.random(len(frames)) < args.drop_rate
+    
+    for frame, truth, drop in zip(frames, truths, dropped):
+        if drop:
+            continue
+        start = time.perf_counter()
+        ball_pos = tracker.detect_ball(frame, truth["frame"] / args.fps)
+        timings["detect_total"].append((time.perf_counter() - start) * 1e3)
+        
+        # detect_ball also returns Kalman predictions; only score real measurements
+        measured = ball_pos is not None and tracker.misses == 0
+        if truth["visible"]:
+            visible += 1
+            if measured:
+                detected += 1
+                detection_errors.append(float(np.hypot(ball_pos[0] - truth["x"], ball_pos[1] - truth["y"])))
+        elif measured:
+            false_detections += 1
+        
+        positions = tracker.get_positions()
+        if ball_pos is None or len(positions) < 5:
+            continue
+        
+        start = time.perf_counter()
+        fitted = predictor.fit_trajectory(positions)
+        timings["fit"].append((time.perf_counter() - start) * 1e3)
+        if not fitted:
+            continue
+        
+        start = time.perf_counter()
+        intersection = predictor.predict_intersection(paddle_y)
+        timings["intersection"].append((time.perf_counter() - start) * 1e3)
+        
+        # Compare with where the current throw really crosses the paddle line
+        crossing = None
+        if intersection and truth["visible"]:
+            crossing = scene.crossing(paddle_y, truth["throw"])
+        if crossing is not None:
+            true_x, true_frame = crossing
+            predicted_x, time_to_intersection = intersection
+            intercept_errors.append(abs(predicted_x - true_x))
+            intercept_time_errors.append(abs(time_to_intersection - (true_frame - truth["frame"]) * 1000 / args.fps))
+    
+    timings.update(time_stages(frames, args))
+    return {
+        "timings_ms": {stage: summarize(values) for stage, values in timings.items()},
+        "accuracy": {
+            "visible_frames": visible,
+            "detection_rate": detected / visible if visible else None,
+            "false_detections": false_detections,
+            "detection_error_px": summarize(detection_errors),
+            "intercept_error_px": summarize(intercept_errors),
+            "intercept_time_error_ms": summarize(intercept_time_errors),
+        },
+    }
+
+def time_startup(args):
+    """
+    Launch main.py (headless, on a synthetic recording at the first resolution) and
+    time, from the launch, the import of main.py alone and the first tracked frame.
+    Returns {measure: summary in milliseconds}.
+    """
+    main_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    width, height = (int(v) for v in args.resolutions.split(",")[0].split("x"))
+    timings = {"import": [], "first_frame": []}
+    with tempfile.TemporaryDirectory() as directory:
+        video = os.path.join(directory, "startup.avi")
+        write_video(video, SyntheticScene(width, height, seed=args.seed), 30, args.fps)
+        for _ in range(args.startup_runs):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", "import main"], cwd=os.path.dirname(main_py), check=True)
+            timings["import"].append((time.perf_counter() - start) * 1e3)
+            
+            start = time.perf_counter()
+            process = subprocess.Popen([sys.executable, main_py, "--headless", "--max-frames", "1",
+                                        "--source", video], stdout=subprocess.PIPE, text=True)
+            for line in process.stdout:
+                if line.startswith("Video dimensions"):
+                    timings["first_frame"].append((time.perf_counter() - start) * 1e3)
+            process.wait()
+    return {name: summarize(values) for name, values in timings.items()}
+
+def run_stereo(args):
+    """
+    Render a synthetic multi-camera scene (at the first resolution) to videos and
+    track the ball in 3D from them, once with all cameras' detection on one process
+    and once with a process per camera. Scores the 3D points and the predicted
+    crossings of the y=0 plane against the ground truth.
+    Returns {mode: results}.
+    """
+    width, height = (int(v) for v in args.resolutions.split(",")[0].split("x"))
+    noise = float(args.noise.split(",")[0])
+    offsets = [k * args.stereo_offset for k in range(args.stereo)]
+    scene = MultiViewScene(args.stereo, width, height, noise=noise, fps=args.fps, time_offsets=offsets,
+                           seed=args.seed)
+    axis, level = plane = parse_plane("y=0")
+    
+    with tempfile.TemporaryDirectory() as directory:
+        paths, calibration_path = write_multiview(args.stereo_dir or directory, scene, args.frames)
+        results = {}
+        for mode in ("serial", "parallel"):
+            calibrations = load_calibration(calibration_path)
+            if args.stereo_sync:
+                for calibration in calibrations:
+                    calibration.time_offset = 0.0
+            detector = MultiCameraDetector(paths, args, parallel=mode == "parallel")
+            start = time.perf_counter()
+            records = list(track_multiview(detector, calibrations, plane, history=args.history,
+                                           sync_search=0.05 if args.stereo_sync else 0.0))
+            elapsed = time.perf_counter() - start
+            
+            point_errors = []
+            crossing_errors = []
+            crossing_time_errors = []
+            for record in records:
+                point = np.array([record["x"], record["y"], record["z"]])
+                point_errors.append(float(np.linalg.norm(point - scene.position_at(record["time"]))))
+                crossing = scene.crossing(axis, level, record["time"])
+                if record["time_to_intersection_ms"] is not None and crossing is not None:
+                    predicted = np.array([record["predicted_x"], record["predicted_y"], record["predicted_z"]])
+                    crossing_errors.append(float(np.linalg.norm(predicted - crossing[0])))
+                    crossing_time_errors.append(abs(record["time_to_intersection_ms"]
+                                                    - (crossing[1] - record["time"]) * 1000))
+            
+            frames = sum(detector.frames)
+            results[mode] = {
+                "frames": frames,
+                "seconds": elapsed,
+                "fps": frames / elapsed if elapsed > 0 else 0.0,
+                "samples": len(records),
+                "time_offsets_ms": [c.time_offset * 1000 for c in calibrations],
+                "reprojection_error_px": summarize([r["error_px"] for r in records]),
+                "point_error": summarize(point_errors),
+                "crossing_error": summarize(crossing_errors),
+                "crossing_time_error_ms": summarize(crossing_time_errors),
+            }
+    return results
+
+def environment():
+    """
+    Describe the code version and libraries the results were measured with.
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+def main():
+    args = parse_args()
+    if args.startup:
+        startup = time_startup(args)
+        print(f"Startup: import {startup['import']['p50']:.0f} ms, "
+              f"first frame {startup['first_frame']['p50']:.0f} ms (p50 of {args.startup_runs} runs)",
+              file=sys.stderr)
+        options = {k: v for k, v in vars(args).items() if k != "output"}
+        write_results({"environment": environment(), "options": options, "startup": startup}, args.output)
+        return
+    
+    if args.stereo:
+        stereo = run_stereo(args)
+        for mode, result in stereo.items():
+            error = result["point_error"]
+            print(f"{args.stereo} cameras, {mode}: {result['fps']:.1f} FPS, {result['samples']} 3D samples, "
+                  f"point error p50 {error['p50'] if error else float('nan'):.4f}", file=sys.stderr)
+        options = {k: v for k, v in vars(args).items() if k != "output"}
+        write_results({"environment": environment(), "options": options, "stereo": stereo}, args.output)
+        return
+    
+    resolutions = [tuple(int(v) for v in r.split("x")) for r in args.resolutions.split(",")]
+    grid = itertools.product(
+        resolutions,
+        [int(v) for v in args.radii.split(",")],
+        [float(v) for v in args.noise.split(",")],
+        [float(v) for v in args.occlusion.split(",")],
+        [int(v) for v in args.distractors.split(",")],
+    )
+    
+    scenarios = []
+    for (width, height), radius, noise, occlusion, distractors in grid:
+        params = {
+            "width": width, "height": height, "ball_radius": radius, "noise": noise,
+            "occlusion_rate": occlusion, "distractors": distractors, "frames": args.frames,
+        }
+        scene = SyntheticScene(width, height, ball_radius=radius, noise=noise, occlusion_rate=occlusion,
+                               distractors=distractors, speed=args.speed, motion_blur=args.motion_blur,
+                               table=args.table,
+                               restitution=args.restitution, seed=args.seed)
+        
+        # Render everything up front so rendering cost is not measured
+        frames, truths = zip(*scene.frames(args.frames))
+        
+        result = run_scenario(scene, frames, truths, args)
+        scenarios.append({"params": params, **result})
+        
+        detect = result["timings_ms"]["detect_total"]
+        accuracy = result["accuracy"]
+        error = accuracy["detection_error_px"]
+        print(f"{width}x{height} r={radius} noise={noise} occlusion={occlusion} distractors={distractors}: "
+              f"detect {detect['mean']:.2f} ms, detection rate {accuracy['detection_rate']:.2f}, "
+              f"error {error['mean'] if error else float('nan'):.2f} px", file=sys.stderr)
+    
+    results = {
+        "environment": environment(),
+        "options": {k: v for k, v in vars(args).items() if k != "output"},
+        "scenarios": scenarios,
+    }
+    write_results(results, args.output)
+
+def write_results(results, output):
+    """
+    Write the results as JSON to the output file, or stdout for "-".
+    """
+    if output == "-":
+        json.dump(results, sys.stdout, indent=2)
+    else:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {output}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
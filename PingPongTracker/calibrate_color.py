@@ -1,19 +1,33 @@
+import argparse
 import cv2
 import numpy as np
+from utils.ball_tracker import BallTracker
+from utils.buffers import BufferPool
+from utils.frame_source import add_capture_arguments, open_capture
 
 def main():
     """
     A simple utility to help calibrate HSV color ranges for ping pong ball detection.
     This will display the original image alongside the HSV-filtered image.
     """
-    # Initialize video capture from webcam
-    cap = cv2.VideoCapture(0)
+    parser = argparse.ArgumentParser(description="HSV color calibration")
+    add_capture_arguments(parser)
+    args = parser.parse_args()
+    
+    # Initialize video capture from the webcam (or a recording)
+    cap = open_capture(args)
     
     # Check if camera opened successfully
     if not cap.isOpened():
         print("Error: Could not open video capture device.")
         return
     
+    # Only used for its color segmentation, so the mask matches what the tracker sees.
+    # All per-frame images are written into preallocated buffers.
+    buffers = BufferPool()
+    ball_tracker = BallTracker(buffers=buffers)
+    frame = None
+    
     # Create window with trackbars
     cv2.namedWindow("Trackbars")
     
@@ -29,16 +43,14 @@ def main():
     
     while True:
         # Read a frame from the camera
-        success, frame = cap.read()
+        success, frame = cap.read(frame)
         if not success:
             print("Error: Could not read frame.")
             break
         
-        # Flip the frame horizontally for a more intuitive view
-        frame = cv2.flip(frame, 1)
-        
-        # Convert to HSV color space
-        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+        # Flip the frame horizontally (in place) for a more intuitive view
+        frame = cv2.flip(frame, 1, dst=frame)
+        shape = frame.shape[:2]
         
         # Get trackbar positions
         l_h = cv2.getTrackbarPos("L-H", "Trackbars")
@@ -50,26 +62,31 @@ def main():
         min_radius = cv2.getTrackbarPos("Min Radius", "Trackbars")
         min_circularity = cv2.getTrackbarPos("Min Circularity", "Trackbars") / 100.0
         
-        # Create lower and upper HSV bounds
-        lower_bound = np.array([l_h, l_s, l_v])
-        upper_bound = np.array([u_h, u_s, u_v])
+        # Update the HSV bounds; the tracker only rebuilds them when they change
+        if (l_h, l_s, l_v) != ball_tracker.lower_color:
+            ball_tracker.lower_color = (l_h, l_s, l_v)
+        if (u_h, u_s, u_v) != ball_tracker.upper_color:
+            ball_tracker.upper_color = (u_h, u_s, u_v)
         
         # Create a mask
-        mask = cv2.inRange(hsv, lower_bound, upper_bound)
+        mask = ball_tracker.color_mask(frame)
         
         # Apply morphological operations to remove noise
-        mask_processed = cv2.erode(mask, None, iterations=1)
-        mask_processed = cv2.dilate(mask_processed, None, iterations=2)
+        mask_processed = cv2.erode(mask, None, dst=buffers.get("eroded", shape), iterations=1)
+        mask_processed = cv2.dilate(mask_processed, None, dst=buffers.get("dilated", shape), iterations=2)
         
         # Apply Gaussian blur for smoother contours
-        blurred_mask = cv2.GaussianBlur(mask_processed, (5, 5), 0)
+        blurred_mask = cv2.GaussianBlur(mask_processed, (5, 5), 0, dst=buffers.get("blurred", shape))
         
         # Find contours in the mask
-        contours, _ = cv2.findContours(blurred_mask.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        contours, _ = cv2.findContours(blurred_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
         
-        # Apply the mask to the original image
-        result = cv2.bitwise_and(frame, frame, mask=mask)
-        detection_result = frame.copy()
+        # Apply the mask to the original image (masked-out pixels keep the old contents, so clear first)
+        result = buffers.get("result", frame.shape)
+        result.fill(0)
+        cv2.bitwise_and(frame, frame, dst=result, mask=mask)
+        detection_result = buffers.get("detection_result", frame.shape)
+        np.copyto(detection_result, frame)
         
         # Draw detected balls based on circularity and radius thresholds
         if contours:
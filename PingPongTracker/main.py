@@ -1,132 +1,221 @@
+import argparse
 import cv2
 import numpy as np
 import time
-from utils.ball_tracker import BallTracker
-from utils.trajectory import TrajectoryPredictor
-from utils.stick_figure import StickFigure
+from concurrent.futures import ThreadPoolExecutor
+from utils.frame_source import DEFAULT_FPS, add_capture_arguments, open_capture
+from utils.game import add_session_arguments, check_session_arguments, create_session
+from utils.pipeline import FramePipeline
 
-def main():
-    # Initialize video capture from webcam
-    cap = cv2.VideoCapture(0)
+def parse_args():
+    parser = argparse.ArgumentParser(description="Ping Pong Ball Tracker")
+    add_capture_arguments(parser)
+    add_session_arguments(parser)
+    parser.add_argument("--pipelined", action="store_true",
+                        help="Run capture, detection and rendering on separate threads")
+    parser.add_argument("--queue-size", type=int, default=1,
+                        help="Maximum number of frames waiting between pipeline stages")
+    parser.add_argument("--no-drop-stale", dest="drop_stale", action="store_false",
+                        help="Block the producer instead of dropping old frames when a queue is full")
+    parser.add_argument("--stats-interval", type=float, default=2.0,
+                        help="Seconds between pipeline FPS/queue reports (0 to disable)")
+    parser.add_argument("--profile-overlay", action="store_true",
+                        help="Draw the per-stage percentiles on the video (implies --profile)")
+    parser.add_argument("--serve", action="store_true",
+                        help="Publish per-frame results to TCP and WebSocket clients")
+    parser.add_argument("--serve-host", default="127.0.0.1",
+                        help="Address the result server listens on")
+    parser.add_argument("--serve-port", type=int, default=8765,
+                        help="TCP port for JSON-lines results")
+    parser.add_argument("--http-port", type=int, default=8766,
+                        help="HTTP port for WebSocket results (/ws) and MJPEG video (/mjpeg)")
+    parser.add_argument("--mjpeg", action="store_true",
+                        help="Also stream the annotated video as MJPEG (implies --serve)")
+    parser.add_argument("--headless", action="store_true",
+                        help="Do not open a window; stop with Ctrl+C")
+    parser.add_argument("--record", default=None,
+                        help="Record the session to this directory, for replay.py")
+    parser.add_argument("--record-video", action="store_true",
+                        help="Also record the raw frames as MJPG video (with --record)")
+    parser.add_argument("--max-frames", type=int, default=None,
+                        help="Stop after this many frames")
+    args = parser.parse_args()
+    check_session_arguments(parser, args)
+    args.profile = args.profile or args.profile_overlay
+    args.serve = args.serve or args.mjpeg
+    return args
+
+def show(frame, result, session, args, server=None, frame_index=0, timestamp=None):
+    """
+    Draw the game state (and the profile overlay if enabled), publish it to the
+    server's clients, display the frame and poll the keyboard. Returns False when
+    ESC was pressed.
+    """
+    profiler = session.profiler
     
-    # Check if camera opened successfully
-    if not cap.isOpened():
-        print("Error: Could not open video capture device.")
-        return
+    # Draw the ball, stick figure, prediction point and score
+    with profiler.stage("draw"):
+        frame = session.draw(frame, result)
+        if args.profile_overlay:
+            frame = profiler.draw_overlay(frame)
     
-    # Get screen dimensions
-    success, frame = cap.read()
-    if not success:
-        print("Error: Could not read from video capture device.")
-        return
+    if server is not None:
+        with profiler.stage("publish"):
+            server.publish(frame_index, result, frame, timestamp)
+    if args.headless:
+        return True
     
+    # Display the frame and exit on ESC key
+    with profiler.stage("display"):
+        cv2.imshow("Ping Pong Ball Tracker", frame)
+        key = cv2.waitKey(1)
+    return key != 27
+
+def first_frame(frame):
+    """
+    Report the frame size once the first frame has been tracked.
+    """
     height, width = frame.shape[:2]
-    print(f"Video dimensions: {width}x{height}")
-    
-    # Initialize components
-    ball_tracker = BallTracker()
-    trajectory_predictor = TrajectoryPredictor()
-    stick_figure = StickFigure(width, height)
-    
-    # Game state variables
-    score = 0
-    misses = 0
-    ball_caught = False
-    prediction_point = None
-    
+    print(f"Video dimensions: {width}x{height}", flush=True)
+
+def run_serial(cap, session, args, server=None, recorder=None):
+    profiler = session.profiler
+    buffers = session.ball_tracker.buffers
+    frame = None
+    last_report = time.perf_counter()
+    frame_index = 0
     while True:
-        # Read a frame from the camera
-        success, frame = cap.read()
+        # Read a frame from the camera, into the previous frame's array when reusing buffers
+        with profiler.stage("capture"):
+            success, frame = cap.read(frame if buffers is not None else None)
+        timestamp = cap.timestamp
         if not success:
             print("Error: Could not read frame.")
             break
         
-        # Flip the frame horizontally for a more intuitive view
-        frame = cv2.flip(frame, 1)
+        # Flip the frame horizontally (in place) for a more intuitive view
+        with profiler.stage("flip"):
+            frame = cv2.flip(frame, 1, dst=frame)
         
-        # Detect the ball
-        ball_pos = ball_tracker.detect_ball(frame)
+        # Detect the ball, predict its trajectory and update the score
+        result = session.update(frame, timestamp)
+        if recorder is not None:
+            with profiler.stage("record"):
+                recorder.record(result, session, timestamp, frame)
         
-        # Draw the ball on the frame
-        if ball_pos:
-            frame = ball_tracker.draw_ball(frame, ball_pos)
-            
-            # Get ball positions for trajectory prediction
-            positions = ball_tracker.get_positions()
-            
-            # Get current ball x-position for stick figure
-            current_x = ball_pos[0]
-            
-            # If we have enough positions, try to predict the trajectory
-            if len(positions) >= 5:
-                if trajectory_predictor.fit_trajectory(positions):
-                    # Get the paddle y-level
-                    _, _, paddle_y = stick_figure.get_paddle_bounds()
-                    
-                    # Predict where the ball will intersect with the paddle y-level
-                    intersection = trajectory_predictor.predict_intersection(paddle_y)
-                    
-                    if intersection:
-                        predicted_x, time_to_intersection = intersection
-                        prediction_point = (predicted_x, paddle_y)
-                        
-                        # Only use prediction if it's a reasonable time away
-                        # and not too far from current position
-                        if time_to_intersection < 15 and abs(predicted_x - current_x) < width/2:
-                            # Move stick figure to predicted position
-                            stick_figure.move_to(predicted_x)
-                        else:
-                            # If prediction is too far in the future, just follow the ball
-                            stick_figure.move_to(current_x)
-                        
-                        # Check if ball is near the paddle level
-                        if ball_pos[1] >= paddle_y - 10 and ball_pos[1] <= paddle_y + 10:
-                            # Get paddle bounds
-                            paddle_left, paddle_right, _ = stick_figure.get_paddle_bounds()
-                            
-                            # Check if ball is within paddle horizontal bounds
-                            if paddle_left <= ball_pos[0] <= paddle_right:
-                                if not ball_caught:
-                                    score += 1
-                                    ball_caught = True
-                            else:
-                                if not ball_caught:
-                                    misses += 1
-                                    ball_caught = True
-                    else:
-                        # If no valid intersection is predicted, follow the current ball position
-                        stick_figure.move_to(current_x)
-                else:
-                    # If trajectory prediction fails, just follow the ball
-                    stick_figure.move_to(current_x)
-            else:
-                # Not enough positions for prediction, just follow the ball
-                stick_figure.move_to(current_x)
-        else:
-            # Reset ball_caught when no ball is detected
-            ball_caught = False
+        keep_going = show(frame, result, session, args, server, frame_index, timestamp)
+        profiler.end_frame()
+        if frame_index == 0:
+            first_frame(frame)
+        frame_index += 1
+        if frame_index == args.max_frames:
+            break
         
-        # Draw the stick figure
-        frame = stick_figure.draw(frame)
+        # Periodically print the per-stage percentiles
+        now = time.perf_counter()
+        if profiler.enabled and now - last_report >= args.profile_interval:
+            print(profiler.report())
+            if hasattr(cap, "latency"):
+                print(cap.latency.report())
+            last_report = now
         
-        # Draw prediction point
-        if prediction_point and isinstance(prediction_point, tuple) and len(prediction_point) == 2 and isinstance(prediction_point[0], int) and isinstance(prediction_point[1], int):
-            cv2.circle(frame, prediction_point, 5, (0, 255, 255), -1)
+        if not keep_going:
+            break
+
+def run_pipelined(cap, session, args, server=None, recorder=None):
+    on_result = None
+    if recorder is not None:
+        def on_result(frame, result, timestamp):
+            recorder.record(result, session, timestamp, frame)
+    pipeline = FramePipeline(cap, session, queue_size=args.queue_size, drop_stale=args.drop_stale,
+                             on_result=on_result)
+    profiler = session.profiler
+    last_report = time.perf_counter()
+    last_profile_report = last_report
+    frame_index = 0
+    
+    def render(frame, result, timestamp):
+        nonlocal last_report, last_profile_report, frame_index
+        keep_going = show(frame, result, session, args, server, frame_index, timestamp)
+        profiler.end_frame()
+        if frame_index == 0:
+            first_frame(frame)
+        frame_index += 1
+        if frame_index == args.max_frames:
+            return False
         
-        # Draw score
-        cv2.putText(frame, f"Score: {score}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-        cv2.putText(frame, f"Misses: {misses}", (10, 70), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+        # Periodically report per-stage FPS and queue depth
+        now = time.perf_counter()
+        if args.stats_interval > 0 and now - last_report >= args.stats_interval:
+            print(pipeline.report())
+            last_report = now
+        if profiler.enabled and now - last_profile_report >= args.profile_interval:
+            print(profiler.report())
+            if hasattr(cap, "latency"):
+                print(cap.latency.report())
+            last_profile_report = now
         
-        # Display the frame
-        cv2.imshow("Ping Pong Ball Tracker", frame)
+        return keep_going
+    
+    pipeline.run(render)
+
+def main():
+    args = parse_args()
+    
+    # Initialize video capture from the webcam (or a recording). Opening a camera can
+    # take seconds, so it is done on another thread while the components are set up.
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        opening = executor.submit(open_capture, args)
         
-        # Exit on ESC key
-        if cv2.waitKey(1) == 27:
-            break
+        # Initialize components; they are sized from the first frame
+        session = create_session(args)
+        cap = opening.result()
     
-    # Release resources
-    cap.release()
-    cv2.destroyAllWindows()
+    # Check if camera opened successfully
+    if not cap.isOpened():
+        print("Error: Could not open video capture device.")
+        return
+    if hasattr(cap, "settings"):
+        print(f"Camera mode: {cap.settings()}")
+    
+    # Publish results to local clients from a background event loop
+    server = None
+    if args.serve:
+        # Imported here so asyncio is only loaded when serving
+        from utils.server import ResultServer
+        server = ResultServer(args.serve_host, args.serve_port, args.http_port, mjpeg=args.mjpeg)
+        server.start()
+        print(f"Serving results on tcp://{args.serve_host}:{server.port} "
+              f"and ws://{args.serve_host}:{server.http_port}/ws")
+        if args.mjpeg:
+            print(f"MJPEG video on http://{args.serve_host}:{server.http_port}/mjpeg")
+    
+    # Record everything needed to replay the session
+    recorder = None
+    if args.record:
+        from utils.session_log import SessionRecorder
+        recorder = SessionRecorder(args.record, options=vars(args), video=args.record_video,
+                                   fps=cap.fps or DEFAULT_FPS)
+        print(f"Recording the session to {args.record}")
+    
+    try:
+        if args.pipelined:
+            run_pipelined(cap, session, args, server, recorder)
+        else:
+            run_serial(cap, session, args, server, recorder)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Release resources
+        if server is not None:
+            server.stop()
+        if recorder is not None:
+            recorder.close()
+        if hasattr(cap, "latency"):
+            print(cap.latency.report())
+        cap.release()
+        if not args.headless:
+            cv2.destroyAllWindows()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,73 @@
+import argparse
+import sys
+
+from utils.batch import TrackWriter, process_source
+from utils.frame_source import open_source
+from utils.game import add_session_arguments, check_session_arguments, create_session
+from utils.sharding import process_sharded
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Track the ball in a recorded video or image directory without a GUI")
+    parser.add_argument("source", help="Video file or directory of frame images")
+    parser.add_argument("-o", "--output", default="-",
+                        help="Output file for per-frame tracks (.jsonl or .csv, '-' for stdout)")
+    parser.add_argument("--flip", action="store_true",
+                        help="Mirror frames horizontally, as main.py does for the webcam")
+    parser.add_argument("--max-frames", type=int, default=None,
+                        help="Stop after this many frames")
+    parser.add_argument("--progress-interval", type=float, default=5.0,
+                        help="Seconds between progress reports on stderr (0 to disable)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Process the recording in overlapping segments on this many processes")
+    parser.add_argument("--segments", type=int, default=None,
+                        help="Number of segments to split the recording into (default: one per worker)")
+    parser.add_argument("--overlap", type=int, default=60,
+                        help="Frames of warm-up overlap between segments when using --workers")
+    add_session_arguments(parser)
+    args = parser.parse_args()
+    check_session_arguments(parser, args)
+    return args
+
+def main():
+    args = parse_args()
+    
+    source = open_source(args.source)
+    if not source.isOpened():
+        print(f"Error: Could not open {args.source}", file=sys.stderr)
+        return 1
+    
+    # Get frame dimensions from the first frame
+    success, frame = source.read()
+    if not success:
+        print(f"Error: Could not read from {args.source}", file=sys.stderr)
+        return 1
+    height, width = frame.shape[:2]
+    
+    source.release()
+    
+    if args.workers > 1:
+        records, stats = process_sharded(args.source, args, width, height, args.workers,
+                                         overlap=args.overlap, segments=args.segments, flip=args.flip,
+                                         max_frames=args.max_frames)
+        with TrackWriter(args.output) as writer:
+            for record in records:
+                writer.write(record)
+    else:
+        # Reopen so the first frame is processed too
+        source = open_source(args.source)
+        session = create_session(args, width, height)
+        with TrackWriter(args.output) as writer:
+            stats = process_source(source, session, writer, flip=args.flip, max_frames=args.max_frames,
+                                   progress_interval=args.progress_interval)
+        source.release()
+        if session.profiler.enabled:
+            print(session.profiler.report(), file=sys.stderr)
+    
+    print(f"Processed {stats['frames']} frames in {stats['seconds']:.2f}s "
+          f"({stats['fps']:.1f} FPS), score {stats['score']}, misses {stats['misses']}",
+          file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from utils.batch import TrackWriter, result_to_record
+from utils.game import add_session_arguments, check_session_arguments, create_session
+from utils.session_log import EVENTS, ReplayTracker, SessionLog, replay
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Replay the trajectory prediction and game logic of a recorded session")
+    parser.add_argument("log", help="Session directory written by main.py --record")
+    parser.add_argument("-o", "--output", default=None,
+                        help="Output file for the replayed per-frame tracks (.jsonl or .csv, '-' for stdout)")
+    add_session_arguments(parser)
+    
+    # The session's own options are the defaults, so a plain replay reproduces it
+    known, _ = parser.parse_known_args(argv)
+    log = SessionLog(known.log)
+    options = {key: value for key, value in log.meta["options"].items() if hasattr(known, key)}
+    parser.set_defaults(**options)
+    args = parser.parse_args(argv)
+    check_session_arguments(parser, args)
+    return args, log
+
+def main():
+    args, log = parse_args()
+    meta = log.meta
+    
+    session = create_session(args, meta["width"], meta["height"])
+    session.ball_tracker = ReplayTracker(log, max_positions=args.history)
+    recorded = log.frames
+    figure_x = np.empty(len(log))
+    events = np.empty(len(log), np.int8)
+    
+    writer = TrackWriter(args.output) if args.output else None
+    start = time.perf_counter()
+    for frame_index, result in replay(log, session):
+        figure_x[frame_index] = result.figure_x
+        events[frame_index] = EVENTS.index(result.event)
+        if writer is not None:
+            writer.write(result_to_record(frame_index, result))
+    seconds = time.perf_counter() - start
+    if writer is not None:
+        writer.close()
+    
+    # Compare with what happened during the recorded session
+    moved = np.count_nonzero(np.abs(figure_x - recorded["figure_x"]) > 0.5)
+    changed = np.count_nonzero(events != recorded["event"])
+    recorded_score = int(recorded["score"][-1]) if len(log) else 0
+    recorded_misses = int(recorded["misses"][-1]) if len(log) else 0
+    duration = float(recorded["timestamp"][-1] - recorded["timestamp"][0]) if len(log) > 1 else 0.0
+    print(f"Replayed {len(log)} frames ({duration:.1f}s of play) in {seconds:.2f}s "
+          f"({len(log) / max(seconds, 1e-9):.0f} FPS)", file=sys.stderr)
+    print(f"Score {session.score} (recorded {recorded_score}), misses {session.misses} "
+          f"(recorded {recorded_misses}); stick figure differs on {moved} frames, "
+          f"events on {changed} frames", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
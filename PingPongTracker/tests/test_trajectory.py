@@ -0,0 +1,54 @@
+import numpy as np
+
+from utils.history import PositionHistory
+from utils.trajectory import TrajectoryPredictor
+
+
+def jittered_history(n=10, fps=30.0, jitter=0.02, seed=0):
+    """
+    Return a PositionHistory of a ball on a parabola sampled at fps, with each
+    timestamp off by up to jitter frame intervals.
+    """
+    rng = np.random.default_rng(seed)
+    step = 1.0 / fps
+    times = np.arange(n) * step + rng.uniform(-jitter, jitter, n) * step
+    positions = PositionHistory(n)
+    for t in times:
+        positions.append(100 + 200 * t, 50 + 30 * t + 490 * t * t, 10, t)
+    return positions
+
+
+def test_jittered_timestamps_use_cached_pseudo_inverse(monkeypatch):
+    positions = jittered_history()
+    predictor = TrajectoryPredictor()
+    
+    def lstsq(*args, **kwargs):
+        raise AssertionError("the uncached lstsq path was taken")
+    
+    monkeypatch.setattr(np.linalg, "lstsq", lstsq)
+    assert predictor.fit_trajectory(positions)
+    assert list(predictor._pinv_cache) == [len(positions)]
+    
+    # Fitting in nominal steps predicts within a pixel of the exact fit against the
+    # timestamps, a quarter second ahead
+    monkeypatch.undo()
+    times = positions.times()
+    exact = np.linalg.lstsq(np.vander(times - times[-1], 3), positions.xy(), rcond=None)[0]
+    ahead = np.linspace(0, 0.25, 8)
+    np.testing.assert_allclose(np.polyval(predictor.x_params, ahead), np.polyval(exact[:, 0], ahead), atol=1.0)
+    np.testing.assert_allclose(np.polyval(predictor.y_params, ahead), np.polyval(exact[:, 1], ahead), atol=1.0)
+
+
+def test_dropped_frame_is_solved_directly():
+    positions = jittered_history(n=11, jitter=0.0)
+    times = positions.times().copy()
+    xy = positions.xy().copy()
+    # Drop the sixth frame
+    gapped = PositionHistory(10)
+    for k in [i for i in range(11) if i != 5]:
+        gapped.append(xy[k, 0], xy[k, 1], 10, times[k])
+    
+    predictor = TrajectoryPredictor()
+    assert predictor.fit_trajectory(gapped)
+    assert not predictor._pinv_cache
+    np.testing.assert_allclose(predictor.y_params[0], 490, rtol=1e-6)
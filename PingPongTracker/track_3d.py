@@ -0,0 +1,73 @@
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from utils.batch import TrackWriter
+from utils.game import add_session_arguments, check_session_arguments
+from utils.stereo import (FUSED_FIELDS, MultiCameraDetector, load_calibration, parse_plane,
+                          track_multiview)
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Track the ball in 3D by triangulating its detections in several cameras")
+    parser.add_argument("sources", nargs="+",
+                        help="One camera index, video file or image directory per camera, in calibration order")
+    parser.add_argument("--calibration", required=True,
+                        help="JSON file with the cameras' intrinsics, poses and time offsets")
+    parser.add_argument("-o", "--output", default="-",
+                        help="Output file for the 3D samples (.jsonl or .csv, '-' for stdout)")
+    parser.add_argument("--plane", type=parse_plane, default="y=0",
+                        help="Plane to predict the ball's crossing of, as AXIS=LEVEL in world units")
+    parser.add_argument("--max-gap", type=float, default=0.1,
+                        help="Only interpolate a camera's detections across gaps up to this many seconds")
+    parser.add_argument("--max-jump", type=float, default=0.5,
+                        help="Restart the 3D trajectory when the ball jumps further than this (world units)")
+    parser.add_argument("--sync-search", type=float, default=0.0,
+                        help="Estimate the cameras' time offsets within this many seconds of the calibrated "
+                             "ones (recordings only)")
+    parser.add_argument("--sync-step", type=float, default=0.002,
+                        help="Resolution in seconds of the time offset search")
+    parser.add_argument("--serial", action="store_true",
+                        help="Run all cameras' detection in this process instead of one process per camera")
+    parser.add_argument("--batch", type=int, default=8,
+                        help="Frames of detections a camera worker sends at once (1 for live cameras)")
+    parser.add_argument("--flip", action="store_true", help="Mirror frames horizontally")
+    parser.add_argument("--max-frames", type=int, default=None, help="Stop each camera after this many frames")
+    add_session_arguments(parser)
+    args = parser.parse_args()
+    check_session_arguments(parser, args)
+    return args
+
+def main():
+    args = parse_args()
+    calibrations = load_calibration(args.calibration)
+    if len(calibrations) != len(args.sources):
+        print(f"Error: {len(args.sources)} sources but {len(calibrations)} calibrated cameras", file=sys.stderr)
+        return 1
+    
+    detector = MultiCameraDetector(args.sources, args, flip=args.flip, max_frames=args.max_frames,
+                                   batch=args.batch, parallel=not args.serial)
+    errors = []
+    start = time.perf_counter()
+    with TrackWriter(args.output, FUSED_FIELDS) as writer:
+        for record in track_multiview(detector, calibrations, args.plane, history=args.history,
+                                      max_gap=args.max_gap, max_jump=args.max_jump,
+                                      sync_search=args.sync_search, sync_step=args.sync_step):
+            writer.write(record)
+            errors.append(record["error_px"])
+    elapsed = time.perf_counter() - start
+    
+    if args.sync_search > 0:
+        offsets = ", ".join(f"{c.time_offset * 1000:.1f}" for c in calibrations)
+        print(f"Estimated time offsets (ms): {offsets}", file=sys.stderr)
+    frames = sum(detector.frames)
+    print(f"Processed {frames} frames from {len(args.sources)} cameras in {elapsed:.2f}s "
+          f"({frames / elapsed if elapsed > 0 else 0.0:.1f} FPS), {len(errors)} 3D samples, "
+          f"median reprojection error {np.median(errors) if errors else float('nan'):.2f} px",
+          file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from utils.game import add_session_arguments, check_session_arguments
+from utils.synthetic import SyntheticScene
+from utils.tuning import (GRID_OPTIONS, SEARCH_SPACE, SharedFrames, best_trial, decode_shared, grid_trials,
+                          load_labels, option_flags, pareto_front, random_trials, run_trials)
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Search the detection options for the best accuracy/cost trade-off on labelled recordings")
+    parser.add_argument("recordings", nargs="*", help="Video files or image directories to tune on")
+    parser.add_argument("--labels", action="append", default=[],
+                        help="True ball positions of each recording, in order (JSONL or CSV with frame, x, y)")
+    parser.add_argument("--synthetic", type=int, default=0,
+                        help="Also tune on a synthetic recording of this many frames, with noise and distractors")
+    parser.add_argument("--search", choices=("grid", "random"), default="grid",
+                        help="Try every combination of the searched options, or random ones")
+    parser.add_argument("--options", default=None,
+                        help="Comma-separated options to search (default: "
+                             f"{','.join(GRID_OPTIONS)} for grid, all for random: {','.join(SEARCH_SPACE)})")
+    parser.add_argument("--trials", type=int, default=100, help="Number of random search trials")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Trials evaluated in parallel")
+    parser.add_argument("--max-frames", type=int, default=None, help="Only tune on the first frames of each recording")
+    parser.add_argument("--match-distance", type=float, default=10.0,
+                        help="Detections further than this many pixels from the labelled ball are false positives")
+    parser.add_argument("--cost-weight", type=float, default=0.05,
+                        help="F1 score traded for each millisecond of detection CPU time per frame")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the random search and synthetic scene")
+    parser.add_argument("-o", "--output", default="tuning_results.json",
+                        help="JSON file to write all trial results to ('-' for stdout)")
+    add_session_arguments(parser)
+    args = parser.parse_args()
+    check_session_arguments(parser, args)
+    return args
+
+def load_recordings(args):
+    """
+    Decode the recordings (and render the synthetic one) into shared memory once.
+    Returns a list of (SharedFrames, count, fps, visible, xy).
+    """
+    recordings = []
+    for path, labels in zip(args.recordings, args.labels):
+        shared, count, fps = decode_shared(path, args.max_frames)
+        recordings.append((shared, count, fps, *load_labels(labels, count)))
+    if args.synthetic:
+        scene = SyntheticScene(noise=8, occlusion_rate=0.05, distractors=3, seed=args.seed)
+        shared = SharedFrames((args.synthetic, scene.height, scene.width, 3))
+        visible = []
+        xy = []
+        for i, (frame, truth) in enumerate(scene.frames(args.synthetic)):
+            shared.frames[i] = frame
+            visible.append(truth["visible"])
+            xy.append((truth["x"], truth["y"]))
+        recordings.append((shared, args.synthetic, 30.0, np.array(visible), np.array(xy)))
+    return recordings
+
+def main():
+    args = parse_args()
+    if len(args.labels) != len(args.recordings):
+        print("Error: give one --labels file per recording", file=sys.stderr)
+        return 1
+    if not args.recordings and not args.synthetic:
+        print("Error: nothing to tune on; give recordings or --synthetic", file=sys.stderr)
+        return 1
+    
+    options = args.options.split(",") if args.options else None
+    unknown = set(options or ()) - set(SEARCH_SPACE)
+    if unknown:
+        print(f"Error: cannot search {', '.join(sorted(unknown))}", file=sys.stderr)
+        return 1
+    
+    # The current options are the baseline every trial is compared with
+    base = {option: getattr(args, option) for option in SEARCH_SPACE}
+    if args.search == "grid":
+        trials = grid_trials(base, options or GRID_OPTIONS)
+    else:
+        trials = random_trials(base, args.trials, options, seed=args.seed)
+    if base not in trials:
+        trials.insert(0, base)
+    
+    recordings = load_recordings(args)
+    try:
+        frames = sum(count for _, count, _, _, _ in recordings)
+        print(f"Evaluating {len(trials)} trials on {frames} frames with {args.workers} workers", file=sys.stderr)
+        start = time.perf_counter()
+        results = run_trials(trials, args, recordings, args.workers, args.match_distance)
+        elapsed = time.perf_counter() - start
+    finally:
+        for shared, *_ in recordings:
+            shared.unlink()
+    
+    baseline = results[trials.index(base)]
+    best = best_trial(results, args.cost_weight)
+    front = pareto_front(results)
+    print(f"Finished in {elapsed:.1f}s ({len(trials) * frames / elapsed:.0f} frames/s)", file=sys.stderr)
+    for name, result in (("Baseline", baseline), ("Best", best)):
+        print(f"{name}: F1 {result['f1']:.3f} (precision {result['precision']:.3f}, recall {result['recall']:.3f}), "
+              f"{result['ms_per_frame']:.2f} ms/frame", file=sys.stderr)
+    print(f"Best options: {option_flags(best['options'])}", file=sys.stderr)
+    
+    output = {
+        "options": {k: v for k, v in vars(args).items() if k != "output"},
+        "seconds": elapsed,
+        "baseline": baseline,
+        "best": best,
+        "pareto_front": front,
+        "trials": sorted(results, key=lambda r: -r["f1"]),
+    }
+    if args.output == "-":
+        json.dump(output, sys.stdout, indent=2)
+    else:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2)
+        print(f"Results written to {args.output}", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,94 +1,179 @@
+import itertools
+import time
+from collections import deque, namedtuple
+
 import cv2
 import numpy as np
+from utils.history import PositionHistory, as_xy
+from utils.overlay import draw_gradient_polyline
+from utils.profiler import NULL_PROFILER
+
+# A motion-blurred ball: the centers where its sweep starts and ends (in no
+# particular order until it is oriented) and its radius
+Streak = namedtuple("Streak", ["start", "end", "radius"])
+
+# Detection thresholds. Blobs are cleaned up by erode/dilate iterations and a
+# blur_size Gaussian blur (0 for none); balls have a radius strictly between
+# min_radius and max_radius and a circularity above min_circularity, or above
+# small_circularity when their radius is below small_radius. A missed ball is
+# looked for within search_radius pixels of the Kalman prediction, and
+# process_noise scales the filter's process noise covariance.
+DetectionParams = namedtuple(
+    "DetectionParams",
+    ["erode_iterations", "dilate_iterations", "blur_size", "min_radius", "max_radius",
+     "min_circularity", "small_circularity", "small_radius", "search_radius", "process_noise"],
+    defaults=(1, 2, 5, 3, 50, 0.65, 0.5, 10, 30, 0.03),
+)
 
 class BallTracker:
-    def __init__(self, lower_color=(20, 100, 100), upper_color=(35, 255, 255)):
+    def __init__(self, lower_color=(20, 100, 100), upper_color=(35, 255, 255), max_positions=10,
+                 roi_tracking=False, roi_max_misses=3, reacquire_interval=30, pyramid_levels=0,
+                 buffers=None, profiler=None, motion=None, streak_detection=False, exposure_ratio=1.0,
+                 min_streak_elongation=1.5, static_streak_frames=5, detection=None):
         """
         Initialize the ball tracker with color range for a yellow ping pong ball.
         Adjust the color ranges as needed for your specific ball color.
+        detection holds the DetectionParams thresholds (default: DetectionParams()).
+        
+        With roi_tracking=True, once the Kalman filter is locked only a window around
+        its prediction is searched. A full-frame scan is done again after
+        roi_max_misses consecutive misses, or every reacquire_interval frames.
+        
+        pyramid_levels > 0 searches for candidate blobs on a frame downscaled by
+        2**pyramid_levels and refines them on full-resolution patches.
+        
+        buffers is an optional BufferPool; when given, all intermediate images are
+        written into its preallocated arrays instead of being allocated per frame.
+        
+        profiler is an optional StageProfiler that records per-stage timings.
+        
+        motion is an optional MotionMask; when given, only ball-colored pixels that
+        moved are passed on to the contour search.
+        
+        With streak_detection=True, elongated blobs (at least min_streak_elongation
+        times longer than wide) are treated as a ball motion-blurred over the
+        exposure: the start and end of the sweep are both added to the history and
+        the sweep, divided by exposure_ratio (exposure time / frame interval), is
+        used as a velocity measurement by the Kalman filter. Streaks that one of the
+        last static_streak_frames frames already had in the same place are static
+        ball-colored objects, not a ball, and are ignored.
         """
         self.lower_color = lower_color
         self.upper_color = upper_color
-        self.positions = []  # Store recent ball positions for trajectory calculation
-        self.max_positions = 10  # Maximum number of positions to store
+        self.detection = detection or DetectionParams()
+        self.positions = PositionHistory(max_positions)  # Recent ball samples for trajectory calculation
+        self.max_positions = max_positions  # Maximum number of positions to store
         self.last_pos = None  # Last detected position
         self.kalman = cv2.KalmanFilter(4, 2)  # Kalman filter for tracking
         self.kalman.measurementMatrix = np.array([[1, 0, 0, 0], [0, 1, 0, 0]], np.float32)
         self.kalman.transitionMatrix = np.array([[1, 0, 1, 0], [0, 1, 0, 1], [0, 0, 1, 0], [0, 0, 0, 1]], np.float32)
-        self.kalman.processNoiseCov = np.array([[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 1, 0], [0, 0, 0, 1]], np.float32) * 0.03
+        self.kalman.processNoiseCov = np.array([[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 1, 0], [0, 0, 0, 1]], np.float32) * self.detection.process_noise
         self.kalman_initialized = False
-
-    def detect_ball(self, frame):
+        
+        # ROI-gated tracking
+        self.roi_tracking = roi_tracking
+        self.roi_max_misses = roi_max_misses
+        self.reacquire_interval = reacquire_interval
+        self.misses = 0  # Consecutive frames without a measured detection
+        self.frames_since_full_scan = 0
+        self.search_window = None  # (x_min, y_min, x_max, y_max) searched in the last frame, None for full frame
+        
+        # Coarse-to-fine detection
+        self.pyramid_levels = pyramid_levels
+        
+        # Preallocated intermediate images
+        self.buffers = buffers
+        
+        # Per-stage timing instrumentation
+        self.profiler = profiler or NULL_PROFILER
+        
+        # Motion gating of the color mask
+        self.motion = motion
+        
+        # Motion-blur streak localization
+        self.streak_detection = streak_detection
+        self.exposure_ratio = exposure_ratio
+        self.min_streak_elongation = min_streak_elongation
+        self.last_streak = None  # Oriented Streak of the last detection, None if it was not blurred
+        self._frame_streaks = []  # Streaks fitted in this frame
+        # And in the last few, to tell static blobs (even when the ball passed over them) from moving balls
+        self._recent_streaks = deque(maxlen=static_streak_frames)
+        self._last_timestamp = None
+        self._frame_interval = 1 / 30  # Seconds between the last two frames
+    
+    def detect_ball(self, frame, timestamp=None):
         """
         Detect the ping pong ball in the given frame.
+        timestamp (seconds) is stored with the position in the history; it defaults to now.
         Returns: (x, y, radius) if ball is found, None otherwise
         """
+        if timestamp is None:
+            timestamp = time.perf_counter()
+        if self._last_timestamp is not None and timestamp > self._last_timestamp:
+            self._frame_interval = timestamp - self._last_timestamp
+        self._last_timestamp = timestamp
+        self._recent_streaks.append(self._frame_streaks)
+        self._frame_streaks = []
         try:
-            # Convert to HSV color space
-            hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+            self._update_motion(frame)
             
-            # Create a mask for the specified color range
-            mask = cv2.inRange(hsv, self.lower_color, self.upper_color)
-            
-            # Apply morphological operations to remove noise
-            mask = cv2.erode(mask, None, iterations=1)  # Less erosion to preserve small balls
-            mask = cv2.dilate(mask, None, iterations=2)
-            
-            # Apply Gaussian blur to reduce noise further
-            blurred_mask = cv2.GaussianBlur(mask, (5, 5), 0)
+            # Predict where the ball should be in this frame
+            prediction = None
+            if self.kalman_initialized:
+                with self.profiler.stage("kalman_predict"):
+                    prediction = self.kalman.predict()
             
-            # Find contours in the mask
-            contours, _ = cv2.findContours(blurred_mask.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            # Restrict the search to a window around the prediction when locked
+            window = None
+            if prediction is not None and self._roi_locked():
+                window = self._search_window(frame.shape, prediction)
+            self.search_window = window
             
-            # Initialize ball position
-            ball_pos = None
+            if window is None:
+                x_offset, y_offset = 0, 0
+                region = frame
+                self.frames_since_full_scan = 0
+            else:
+                x_offset, y_offset = window[0], window[1]
+                region = frame[window[1]:window[3], window[0]:window[2]]
+                self.frames_since_full_scan += 1
             
-            # Only proceed if at least one contour was found
-            if len(contours) > 0:
-                # Sort contours by area, largest first
-                sorted_contours = sorted(contours, key=cv2.contourArea, reverse=True)
+            region_h, region_w = region.shape[:2]
+            scale = 2 ** self.pyramid_levels
+            if scale > 1 and min(region_h, region_w) >= 32 * scale:
+                # Find candidates on a downscaled copy, then refine them at full resolution
+                mask = None
+                ball_pos = self._find_ball_pyramid(region, (x_offset, y_offset), scale)
+            else:
+                mask, blurred_mask = self._segment(region, frame_rect=(x_offset, y_offset, region_w, region_h))
                 
-                # Try to find a circular contour
-                for c in sorted_contours[:min(5, len(sorted_contours))]:  # Check the 5 largest contours
-                    # Calculate circularity
-                    area = cv2.contourArea(c)
-                    perimeter = cv2.arcLength(c, True)
-                    circularity = 0
-                    if perimeter > 0:
-                        circularity = 4 * np.pi * area / (perimeter * perimeter)
-                    
-                    # Get the minimum enclosing circle
-                    ((x, y), radius) = cv2.minEnclosingCircle(c)
-                    
-                    # Lower circularity threshold for small balls as they appear less circular when far away
-                    min_circularity = 0.5 if radius < 10 else 0.65
-                    
-                    # Only consider it a ball if the radius is in appropriate range and it's circular enough
-                    # Allow smaller radius for distant balls
-                    if 3 < radius < 50 and circularity > min_circularity:
-                        ball_pos = (int(x), int(y), int(radius))
-                        break
+                # Contour coordinates are shifted back into full-frame coordinates
+                ball_pos = self._find_ball(blurred_mask, (x_offset, y_offset))
             
             # If no ball is found through contour detection but we have a previous position,
             # use Kalman prediction to estimate where it might be
-            if ball_pos is None and self.kalman_initialized:
-                # Predict ball position using Kalman filter
-                prediction = self.kalman.predict()
+            if ball_pos is None and prediction is not None:
                 pred_x, pred_y = prediction[0, 0], prediction[1, 0]
                 
                 # Search in a small region around the predicted position
-                search_radius = 30
-                x_min = max(0, int(pred_x - search_radius))
-                y_min = max(0, int(pred_y - search_radius))
-                x_max = min(frame.shape[1], int(pred_x + search_radius))
-                y_max = min(frame.shape[0], int(pred_y + search_radius))
+                search_radius = self.detection.search_radius
+                x_min = max(x_offset, int(pred_x - search_radius))
+                y_min = max(y_offset, int(pred_y - search_radius))
+                x_max = min(x_offset + region_w, int(pred_x + search_radius))
+                y_max = min(y_offset + region_h, int(pred_y + search_radius))
                 
                 if x_min < x_max and y_min < y_max:
                     # Extract the region of interest
-                    roi = mask[y_min:y_max, x_min:x_max]
+                    if mask is not None:
+                        roi = mask[y_min - y_offset:y_max - y_offset, x_min - x_offset:x_max - x_offset]
+                    else:
+                        # No full-resolution mask in pyramid mode; segment just the ROI
+                        roi, _ = self._segment(frame[y_min:y_max, x_min:x_max],
+                                               frame_rect=(x_min, y_min, x_max - x_min, y_max - y_min))
                     
                     # Find contours in the ROI
-                    roi_contours, _ = cv2.findContours(roi.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+                    with self.profiler.stage("contour_search"):
+                        roi_contours, _ = cv2.findContours(roi, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
                     
                     if roi_contours:
                         # Find the largest contour in the ROI
@@ -101,31 +186,60 @@ class BallTracker:
                         if radius > 2:  # Even smaller radius threshold for predicted regions
                             ball_pos = (int(x), int(y), int(radius))
             
+            # A streak's end is where the ball is now; its sweep gives the velocity
+            streak = None
+            velocity = None
+            if isinstance(ball_pos, Streak):
+                streak = self._orient_streak(ball_pos)
+                if streak is None:
+                    # No reference to tell the start from the end, so use the middle
+                    (x0, y0), (x1, y1) = ball_pos.start, ball_pos.end
+                    ball_pos = (int((x0 + x1) / 2), int((y0 + y1) / 2), int(ball_pos.radius))
+                else:
+                    (x0, y0), (x1, y1) = streak.start, streak.end
+                    ball_pos = (int(x1), int(y1), int(streak.radius))
+                    velocity = ((x1 - x0) / self.exposure_ratio, (y1 - y0) / self.exposure_ratio)
+            self.last_streak = streak
+            
             # Update Kalman filter with measurement or prediction
             if ball_pos:
                 x, y, _ = ball_pos
+                self.misses = 0
                 
-                # Initialize Kalman filter with first detection
-                if not self.kalman_initialized:
-                    self.kalman.statePre = np.array([[x], [y], [0], [0]], np.float32)
-                    self.kalman.statePost = np.array([[x], [y], [0], [0]], np.float32)
+                # Initialize Kalman filter with first detection, or re-initialize it when
+                # a full-frame scan re-acquires the ball outside the predicted window
+                reacquired = (self.roi_tracking and window is None and prediction is not None
+                              and self.last_pos is not None
+                              and not self._in_window(ball_pos, self._search_window(frame.shape, prediction)))
+                # A streak swept much faster or in another direction than the filter
+                # expects means the ball was hit or a new one was thrown
+                reacquired = reacquired or (velocity is not None and self.kalman_initialized
+                                            and self._velocity_mismatch(*velocity))
+                if not self.kalman_initialized or reacquired:
+                    vx, vy = velocity or (0, 0)
+                    self.kalman.statePre = np.array([[x], [y], [vx], [vy]], np.float32)
+                    self.kalman.statePost = np.array([[x], [y], [vx], [vy]], np.float32)
                     self.kalman_initialized = True
                 
                 # Update Kalman filter with new measurement
-                measurement = np.array([[x], [y]], np.float32)
-                self.kalman.correct(measurement)
+                with self.profiler.stage("kalman_correct"):
+                    if velocity is None:
+                        self.kalman.correct(np.array([[x], [y]], np.float32))
+                    else:
+                        self._correct_with_velocity(x, y, *velocity)
                 
-                # Add position to history
-                self.positions.append((int(x), int(y)))
-                
-                # Keep only the most recent positions
-                if len(self.positions) > self.max_positions:
-                    self.positions.pop(0)
+                # Add position to history (the oldest one drops out when full); a streak
+                # also adds where the exposure started
+                if streak is not None:
+                    start_x, start_y = streak.start
+                    self.positions.append(int(start_x), int(start_y), ball_pos[2],
+                                          timestamp - self.exposure_ratio * self._frame_interval)
+                self.positions.append(int(x), int(y), ball_pos[2], timestamp)
                 
                 self.last_pos = ball_pos
-            elif self.kalman_initialized:
+            elif prediction is not None:
                 # If no ball detected but Kalman filter initialized, use prediction
-                prediction = self.kalman.predict()
+                self.misses += 1
                 x, y = int(prediction[0, 0]), int(prediction[1, 0])
                 
                 # Use the last known radius or a default
@@ -135,24 +249,372 @@ class BallTracker:
                 pred_ball_pos = (x, y, radius)
                 
                 # Add to positions history but mark it as a prediction
-                self.positions.append((int(x), int(y)))
-                
-                # Keep only the most recent positions
-                if len(self.positions) > self.max_positions:
-                    self.positions.pop(0)
+                self.positions.append(x, y, radius, timestamp, measured=False)
                 
                 # Return the predicted position
                 return pred_ball_pos
             
             return ball_pos
         except Exception as e:
+            self.profiler.count("detect_errors")
             print(f"Ball detection error: {e}")
             return None
     
-    def draw_ball(self, frame, ball_pos):
+    @property
+    def lower_color(self):
+        return self._lower_color
+    
+    @lower_color.setter
+    def lower_color(self, value):
+        self._lower_color = tuple(int(v) for v in value)
+        self._color_bounds = None  # Rebuilt on the next color_mask() call
+    
+    @property
+    def upper_color(self):
+        return self._upper_color
+    
+    @upper_color.setter
+    def upper_color(self, value):
+        self._upper_color = tuple(int(v) for v in value)
+        self._color_bounds = None  # Rebuilt on the next color_mask() call
+    
+    def color_mask(self, image, prefix=""):
+        """
+        Threshold a BGR image to the ball's HSV color range.
+        Returns a single-channel mask (255 inside the range, 0 outside).
+        prefix namespaces the buffers used, when a buffer pool is set.
+        """
+        # The bound arrays are only rebuilt when the color range changes
+        if self._color_bounds is None:
+            self._color_bounds = (np.array(self._lower_color, np.uint8), np.array(self._upper_color, np.uint8))
+        
+        # Convert to HSV color space
+        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV, dst=self._dst(prefix + "hsv", image.shape))
+        return cv2.inRange(hsv, *self._color_bounds, dst=self._dst(prefix + "mask", image.shape[:2]))
+    
+    def _dst(self, name, shape):
+        """
+        Return the preallocated destination array for name, or None without a buffer pool.
+        """
+        if self.buffers is None:
+            return None
+        return self.buffers.get(name, shape)
+    
+    def _update_motion(self, frame):
+        """
+        Update the motion mask with a new frame, if motion gating is enabled.
+        """
+        if self.motion is not None:
+            with self.profiler.stage("motion"):
+                self.motion.update(frame)
+    
+    def _segment(self, image, coarse=False, frame_rect=None):
+        """
+        Threshold the ball color and clean up the mask.
+        coarse=True skips the erosion so small balls survive on downscaled images.
+        frame_rect is the (x, y, width, height) of the frame the image was taken from
+        (before any downscaling), used to look up the motion mask; default: all of it.
+        Returns (mask, blurred_mask).
+        """
+        with self.profiler.stage("segmentation"):
+            # Keep coarse images in their own buffers so they never alias full-resolution ones
+            prefix = "coarse_" if coarse else ""
+            shape = image.shape[:2]
+            
+            # Create a mask for the specified color range
+            mask = self.color_mask(image, prefix)
+            
+            # Only keep the ball-colored pixels that moved
+            if self.motion is not None:
+                if frame_rect is None:
+                    frame_rect = (0, 0, shape[1], shape[0])
+                moving = self.motion.region(*frame_rect, shape, dst=self._dst(prefix + "motion", shape))
+                mask = cv2.bitwise_and(mask, moving, dst=mask)
+            
+            if coarse:
+                return mask, cv2.dilate(mask, None, dst=self._dst("coarse_hsv", shape), iterations=1)
+            
+            # Apply morphological operations to remove noise
+            # (with a buffer pool the stages ping-pong between two buffers, so the working
+            # set stays small and cache-hot)
+            detection = self.detection
+            mask = cv2.erode(mask, None, dst=self._dst("eroded", shape),
+                             iterations=detection.erode_iterations)  # Less erosion to preserve small balls
+            mask = cv2.dilate(mask, None, dst=self._dst("mask", shape), iterations=detection.dilate_iterations)
+            
+            # Apply Gaussian blur to reduce noise further
+            if detection.blur_size == 0:
+                return mask, mask
+            size = (detection.blur_size, detection.blur_size)
+            blurred_mask = cv2.GaussianBlur(mask, size, 0, dst=self._dst("eroded", shape))
+            
+            return mask, blurred_mask
+    
+    def _find_ball(self, blurred_mask, offset=(0, 0)):
+        """
+        Find the first sufficiently circular contour among the largest ones.
+        offset is added to the contour coordinates.
+        Returns (x, y, radius), a Streak in streak detection mode, or None.
+        """
+        balls = self._find_balls(blurred_mask, offset, max_balls=1, streaks=self.streak_detection)
+        return balls[0] if balls else None
+    
+    def _find_balls(self, blurred_mask, offset=(0, 0), candidates=5, max_balls=None, streaks=False):
+        """
+        Return the (x, y, radius) of the sufficiently circular contours among the
+        `candidates` largest ones, largest first, stopping after max_balls.
+        With streaks=True, elongated contours that fit a motion-blurred ball are
+        returned as a Streak instead. Streaks that did not move since the last frame
+        are ball-colored objects and skipped, and without a last detection, when
+        static ones cannot be told apart yet, streaks only come after the round
+        contours.
+        offset is added to the contour coordinates.
+        """
+        balls = []
+        unplaced = []  # Streaks with no last detection to tell whether they moved
+        detection = self.detection
+        with self.profiler.stage("contour_search"):
+            # Find contours in the mask
+            contours, _ = cv2.findContours(blurred_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=offset)
+            
+            # Only proceed if at least one contour was found
+            if len(contours) == 0:
+                return balls
+            
+            # Sort contours by area, largest first
+            sorted_contours = sorted(contours, key=cv2.contourArea, reverse=True)
+            
+            # Try to find circular contours
+            for c in sorted_contours[:min(candidates, len(sorted_contours))]:  # Check the largest contours
+                # Elongated blobs are motion-blurred balls rather than round ones
+                if streaks:
+                    streak = self._fit_streak(c)
+                    if streak is not None:
+                        self._frame_streaks.append(streak)
+                        moves = self._streak_moves(streak)
+                        if moves is None:
+                            unplaced.append(streak)
+                        elif moves:
+                            balls.append(streak)
+                            if max_balls is not None and len(balls) >= max_balls:
+                                break
+                        continue
+                
+                # Calculate circularity
+                area = cv2.contourArea(c)
+                perimeter = cv2.arcLength(c, True)
+                circularity = 0
+                if perimeter > 0:
+                    circularity = 4 * np.pi * area / (perimeter * perimeter)
+                
+                # Get the minimum enclosing circle
+                ((x, y), radius) = cv2.minEnclosingCircle(c)
+                
+                # Lower circularity threshold for small balls as they appear less circular when far away
+                if radius < detection.small_radius:
+                    min_circularity = detection.small_circularity
+                else:
+                    min_circularity = detection.min_circularity
+                
+                # Only consider it a ball if the radius is in appropriate range and it's circular enough
+                # Allow smaller radius for distant balls
+                if detection.min_radius < radius < detection.max_radius and circularity > min_circularity:
+                    balls.append((int(x), int(y), int(radius)))
+                    if max_balls is not None and len(balls) >= max_balls:
+                        break
+            
+            balls.extend(unplaced[:None if max_balls is None else max(0, max_balls - len(balls))])
+            return balls
+    
+    def _fit_streak(self, contour):
+        """
+        Fit a motion-blurred ball (a disc swept along a line) to a contour: the
+        major axis of its moment ellipse, its width across the axis (the ball's
+        diameter) and its extent along it. Returns a Streak whose start and end are
+        the two ends of the sweep, or None if the contour is not elongated enough,
+        too thin or too wide for a ball, or does not fill the fitted shape.
+        """
+        # The area moments weigh the whole blob; a line fit to the sparse contour
+        # points would be pulled towards the rounded ends
+        moments = cv2.moments(contour)
+        if moments["m00"] <= 0:
+            return None
+        cx, cy = moments["m10"] / moments["m00"], moments["m01"] / moments["m00"]
+        angle = 0.5 * np.arctan2(2 * moments["mu11"], moments["mu20"] - moments["mu02"])
+        dx, dy = np.cos(angle), np.sin(angle)
+        offsets = contour.reshape(-1, 2) - (cx, cy)
+        along = offsets @ (dx, dy)
+        across = offsets @ (-dy, dx)
+        length = float(along.max() - along.min())
+        radius = float(across.max() - across.min()) / 2
+        if (not self.detection.min_radius < radius < self.detection.max_radius
+                or length < self.min_streak_elongation * 2 * radius):
+            return None
+        
+        # A capsule: the swept rectangle plus the ball's two halves
+        capsule_area = 2 * radius * (length - 2 * radius) + np.pi * radius * radius
+        if moments["m00"] < 0.75 * capsule_area:
+            return None
+        
+        first, last = float(along.min()) + radius, float(along.max()) - radius
+        return Streak((cx + first * dx, cy + first * dy), (cx + last * dx, cy + last * dy), radius)
+    
+    def _streak_moves(self, streak):
+        """
+        Return whether a streak is moving, i.e. no streak fitted in the last
+        static_streak_frames frames lies on it (its ends within half a ball radius,
+        in either order), as one would for a static ball-colored blob. Returns None
+        without a last detection, when the tracker is starting.
+        """
+        start, end = np.array(streak.start), np.array(streak.end)
+        tolerance = streak.radius / 2
+        for previous in itertools.chain.from_iterable(self._recent_streaks):
+            same = max(np.hypot(*(start - previous.start)), np.hypot(*(end - previous.end)))
+            swapped = max(np.hypot(*(start - previous.end)), np.hypot(*(end - previous.start)))
+            if min(same, swapped) <= tolerance:
+                return False
+        return None if self.last_pos is None else True
+    
+    def _orient_streak(self, streak):
+        """
+        Order a streak's ends so it starts at the end nearest the last detection.
+        Returns None without a last detection.
+        """
+        if self.last_pos is None:
+            return None
+        last = np.array(self.last_pos[:2], np.float64)
+        if np.hypot(*(np.subtract(streak.end, last))) < np.hypot(*(np.subtract(streak.start, last))):
+            return Streak(streak.end, streak.start, streak.radius)
+        return streak
+    
+    def _velocity_noise(self):
+        """
+        Variance of a streak's velocity measurement: it is the difference of two
+        positions (twice their variance) divided by the exposure ratio.
+        """
+        return 2 * float(self.kalman.measurementNoiseCov[0, 0]) / (self.exposure_ratio * self.exposure_ratio)
+    
+    def _velocity_mismatch(self, vx, vy, max_sigmas=4):
+        """
+        Return True if a measured velocity is more than max_sigmas standard deviations
+        (filter and measurement uncertainty combined) from the predicted one.
+        """
+        kalman = self.kalman
+        noise = self._velocity_noise()
+        dvx, dvy = vx - kalman.statePre[2, 0], vy - kalman.statePre[3, 0]
+        return (dvx * dvx / (kalman.errorCovPre[2, 2] + noise)
+                + dvy * dvy / (kalman.errorCovPre[3, 3] + noise)) > max_sigmas * max_sigmas
+    
+    def _correct_with_velocity(self, x, y, vx, vy):
+        """
+        Kalman correction with a full (x, y, vx, vy) measurement, as from a streak.
+        """
+        kalman = self.kalman
+        position_noise = float(kalman.measurementNoiseCov[0, 0])
+        velocity_noise = self._velocity_noise()
+        noise = np.diag([position_noise, position_noise, velocity_noise, velocity_noise]).astype(np.float32)
+        
+        state, covariance = kalman.statePre, kalman.errorCovPre
+        gain = covariance @ np.linalg.inv(covariance + noise)
+        measurement = np.array([[x], [y], [vx], [vy]], np.float32)
+        kalman.statePost = (state + gain @ (measurement - state)).astype(np.float32)
+        kalman.errorCovPost = ((np.eye(4, dtype=np.float32) - gain) @ covariance).astype(np.float32)
+    
+    def _find_ball_pyramid(self, image, offset, scale):
+        """
+        Coarse-to-fine search: find ball-colored blobs on image downscaled by scale,
+        then run the full-resolution detection on a patch around each candidate.
+        Returns (x, y, radius) in frame coordinates, or None.
+        """
+        small_shape = (image.shape[0] // scale, image.shape[1] // scale)
+        with self.profiler.stage("segmentation"):
+            small = cv2.resize(image, (small_shape[1], small_shape[0]),
+                               dst=self._dst("coarse_frame", small_shape + image.shape[2:]),
+                               interpolation=cv2.INTER_LINEAR)
+        _, blurred_small = self._segment(small, coarse=True,
+                                         frame_rect=(offset[0], offset[1], image.shape[1], image.shape[0]))
+        with self.profiler.stage("contour_search"):
+            contours, _ = cv2.findContours(blurred_small, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        if not contours:
+            return None
+        
+        height, width = image.shape[:2]
+        sorted_contours = sorted(contours, key=cv2.contourArea, reverse=True)
+        for c in sorted_contours[:min(5, len(sorted_contours))]:  # Check the 5 largest candidates
+            ((x, y), radius) = cv2.minEnclosingCircle(c)
+            
+            # Radius limits scaled to this level, with one coarse pixel of slack for
+            # rounding; circularity is checked at full resolution because small blobs
+            # are too coarse to measure it here
+            if not (self.detection.min_radius < (radius + 1) * scale
+                    and (radius - 1) * scale < self.detection.max_radius):
+                continue
+            
+            # Full-resolution patch around the candidate, with room for the morphology border
+            margin = int((radius + 2) * scale) + 8
+            cx, cy = int(x * scale), int(y * scale)
+            x_min, y_min = max(0, cx - margin), max(0, cy - margin)
+            x_max, y_max = min(width, cx + margin), min(height, cy + margin)
+            
+            _, blurred_patch = self._segment(image[y_min:y_max, x_min:x_max],
+                                             frame_rect=(offset[0] + x_min, offset[1] + y_min,
+                                                         x_max - x_min, y_max - y_min))
+            ball_pos = self._find_ball(blurred_patch, (offset[0] + x_min, offset[1] + y_min))
+            if ball_pos is not None:
+                return ball_pos
+        
+        return None
+    
+    def _roi_locked(self):
+        """
+        Return True if this frame may be searched in a window around the prediction.
+        """
+        return (self.roi_tracking
+                and self.last_pos is not None
+                and self.misses < self.roi_max_misses
+                and self.frames_since_full_scan < self.reacquire_interval)
+    
+    def _in_window(self, ball_pos, window):
+        """
+        Return True if ball_pos lies inside the (x_min, y_min, x_max, y_max) window.
+        """
+        if window is None:
+            return False
+        return window[0] <= ball_pos[0] < window[2] and window[1] <= ball_pos[1] < window[3]
+    
+    def _search_window(self, frame_shape, prediction):
+        """
+        Return the (x_min, y_min, x_max, y_max) window around the Kalman prediction.
+        The window grows with the ball's speed, the filter's position uncertainty
+        and the number of frames missed since the last detection.
+        """
+        pred_x, pred_y = prediction[0, 0], prediction[1, 0]
+        vx, vy = abs(self.kalman.statePost[2, 0]), abs(self.kalman.statePost[3, 0])
+        sigma_x = np.sqrt(max(self.kalman.errorCovPre[0, 0], 0))
+        sigma_y = np.sqrt(max(self.kalman.errorCovPre[1, 1], 0))
+        
+        # Margin for the ball itself, the blur/morphology border and one search radius
+        base = self.last_pos[2] * 2 + self.detection.search_radius
+        scale = 1 + self.misses
+        half_w = int(base + scale * (2 * vx + 3 * sigma_x))
+        half_h = int(base + scale * (2 * vy + 3 * sigma_y))
+        
+        x_min = max(0, int(pred_x) - half_w)
+        y_min = max(0, int(pred_y) - half_h)
+        x_max = min(frame_shape[1], int(pred_x) + half_w)
+        y_max = min(frame_shape[0], int(pred_y) + half_h)
+        if x_min >= x_max or y_min >= y_max:
+            return None
+        return x_min, y_min, x_max, y_max
+    
+    def draw_ball(self, frame, ball_pos, positions=None):
         """
         Draw the detected ball on the frame.
+        positions overrides the trail history (e.g. a snapshot taken on another thread).
         """
+        if positions is None:
+            positions = self.positions
+        
         if ball_pos:
             x, y, radius = ball_pos
             
@@ -162,22 +624,28 @@ class BallTracker:
             # Draw the ball center
             cv2.circle(frame, (x, y), 5, (0, 0, 255), -1)
             
-            # Draw ball trail from recent positions
-            if len(self.positions) > 1:
-                # Draw lines connecting recent positions
-                for i in range(1, len(self.positions)):
-                    # Calculate color based on position in trail (green to blue)
-                    g = int(255 * (1 - i / len(self.positions)))
-                    r = 0
-                    b = int(255 * (i / len(self.positions)))
-                    
-                    # Draw line between consecutive positions
-                    cv2.line(frame, self.positions[i-1], self.positions[i], (r, g, b), 2)
+            # Draw ball trail from recent positions, fading from green to red, in a few
+            # batched polyline calls
+            draw_gradient_polyline(frame, as_xy(positions).astype(np.int32), (0, 255, 0), (0, 0, 255), 2)
         
         return frame
     
     def get_positions(self):
         """
-        Return the list of recent positions for trajectory calculation.
+        Return the PositionHistory of recent positions for trajectory calculation.
         """
         return self.positions
+    
+    def kalman_state(self):
+        """
+        Return the Kalman filter's (x, y, vx, vy) estimate, or None before the first detection.
+        """
+        if not self.kalman_initialized:
+            return None
+        return self.kalman.statePost[:, 0]
+    
+    def get_tracks(self):
+        """
+        Return the Track of every ball followed in multi-ball mode; the single-ball tracker has none.
+        """
+        return ()
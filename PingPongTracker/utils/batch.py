@@ -0,0 +1,122 @@
+import csv
+import json
+import sys
+import time
+
+import cv2
+
+from utils.frame_source import frame_time
+
+# Columns written for every processed frame
+TRACK_FIELDS = [
+    "frame", "detected", "x", "y", "radius", "predicted_x", "time_to_intersection_ms",
+    "figure_x", "score", "misses", "event",
+]
+
+
+def result_to_record(frame_index, result):
+    """
+    Flatten a FrameResult into a dict with the TRACK_FIELDS keys.
+    """
+    x = y = radius = None
+    if result.ball_pos:
+        x, y, radius = result.ball_pos
+    
+    predicted_x = time_to_intersection = None
+    if result.intersection:
+        predicted_x = int(result.intersection[0])
+        time_to_intersection = round(float(result.intersection[1]), 1)
+    
+    return {
+        "frame": frame_index,
+        "detected": result.ball_pos is not None,
+        "x": x,
+        "y": y,
+        "radius": radius,
+        "predicted_x": predicted_x,
+        "time_to_intersection_ms": time_to_intersection,
+        "figure_x": int(result.figure_x),
+        "score": result.score,
+        "misses": result.misses,
+        "event": result.event,
+    }
+
+
+class TrackWriter:
+    def __init__(self, path, fields=TRACK_FIELDS):
+        """
+        Stream per-frame track records to a JSONL or CSV file, chosen by the file
+        extension. "-" writes JSONL to stdout. fields are the CSV columns.
+        """
+        self.path = path
+        self.format = "csv" if path.lower().endswith(".csv") else "jsonl"
+        self._file = sys.stdout if path == "-" else open(path, "w", newline="")
+        self._csv = None
+        if self.format == "csv":
+            self._csv = csv.DictWriter(self._file, fieldnames=fields)
+            self._csv.writeheader()
+    
+    def write(self, record):
+        if self._csv is not None:
+            self._csv.writerow(record)
+        else:
+            self._file.write(json.dumps(record) + "\n")
+    
+    def close(self):
+        if self._file is not sys.stdout:
+            self._file.close()
+        else:
+            self._file.flush()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+
+def process_source(source, session, writer=None, flip=False, start_frame=0, max_frames=None,
+                   progress_interval=0):
+    """
+    Run the game logic over every frame of source without any GUI.
+    Each frame's record is passed to writer.write() if a writer is given.
+    Returns a dict of throughput statistics.
+    """
+    frames = 0
+    start = time.perf_counter()
+    last_progress = start
+    
+    buffers = session.ball_tracker.buffers
+    profiler = session.profiler
+    frame = None
+    while max_frames is None or frames < max_frames:
+        # Decode into the previous frame's array when reusing buffers
+        with profiler.stage("capture"):
+            success, frame = source.read(frame if buffers is not None else None)
+        if not success:
+            break
+        
+        if flip:
+            with profiler.stage("flip"):
+                frame = cv2.flip(frame, 1, dst=frame)
+        
+        # Timestamps come from the recording's frame rate, not from how fast we process it
+        result = session.update(frame, frame_time(source, start_frame + frames))
+        profiler.end_frame()
+        if writer is not None:
+            writer.write(result_to_record(start_frame + frames, result))
+        frames += 1
+        
+        now = time.perf_counter()
+        if progress_interval > 0 and now - last_progress >= progress_interval:
+            print(f"{frames} frames, {frames / (now - start):.1f} FPS", file=sys.stderr)
+            last_progress = now
+    
+    elapsed = time.perf_counter() - start
+    return {
+        "frames": frames,
+        "seconds": elapsed,
+        "fps": frames / elapsed if elapsed > 0 else 0.0,
+        "score": session.score,
+        "misses": session.misses,
+    }
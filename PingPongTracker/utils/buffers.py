@@ -0,0 +1,32 @@
+import numpy as np
+
+class BufferPool:
+    def __init__(self):
+        """
+        Named, preallocated arrays reused from frame to frame.
+        Buffers are allocated at the first requested size; smaller requests (e.g. ROI
+        windows) get a contiguous view into the existing buffer, so in steady state
+        nothing is allocated. Pass the returned arrays as the dst= argument of OpenCV calls.
+        """
+        self._buffers = {}
+        self.allocations = 0  # Number of arrays allocated so far
+    
+    def get(self, name, shape, dtype=np.uint8):
+        """
+        Return a contiguous array of the given shape backed by the buffer called name.
+        The contents are whatever was written last.
+        """
+        size = int(np.prod(shape))
+        buf = self._buffers.get(name)
+        if buf is None or buf.dtype != dtype or buf.size < size:
+            # Flat storage, so any shape up to the largest seen fits without reallocating
+            buf = np.empty(size, dtype)
+            self._buffers[name] = buf
+            self.allocations += 1
+        return buf[:size].reshape(shape)
+    
+    def nbytes(self):
+        """
+        Return the total size of all buffers in bytes.
+        """
+        return sum(buf.nbytes for buf in self._buffers.values())
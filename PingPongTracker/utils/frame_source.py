@@ -0,0 +1,326 @@
+import os
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+
+# Frame rate assumed for recordings that do not report one
+DEFAULT_FPS = 30.0
+
+
+class VideoFileSource:
+    def __init__(self, path):
+        """
+        Read frames from a video file. read() behaves like cv2.VideoCapture.read().
+        """
+        self.path = path
+        self.cap = cv2.VideoCapture(path)
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 0.0
+        self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.timestamp = None  # perf_counter() time the last frame was read
+    
+    def isOpened(self):
+        return self.cap.isOpened()
+    
+    def read(self, image=None):
+        """
+        Return (success, frame); the frame is decoded into image if given.
+        """
+        result = self.cap.read(image)
+        self.timestamp = time.perf_counter()
+        return result
+    
+    def seek(self, frame_index):
+        """
+        Position the source so the next read() returns frame frame_index.
+        """
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+    
+    def release(self):
+        self.cap.release()
+
+
+class ImageSequenceSource:
+    def __init__(self, directory, fps=30.0):
+        """
+        Read frames from the images in a directory, in file name order.
+        """
+        self.path = directory
+        self.fps = fps
+        self.files = sorted(
+            os.path.join(directory, name) for name in os.listdir(directory)
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        self.frame_count = len(self.files)
+        self.index = 0
+        self.timestamp = None  # perf_counter() time the last frame was read
+    
+    def isOpened(self):
+        return self.frame_count > 0
+    
+    def read(self, image=None):
+        """
+        Return (success, frame). image is accepted for compatibility with
+        VideoFileSource but not used, since cv2.imread always allocates.
+        """
+        while self.index < self.frame_count:
+            frame = cv2.imread(self.files[self.index])
+            self.index += 1
+            self.timestamp = time.perf_counter()
+            if frame is not None:
+                return True, frame
+            print(f"Warning: Could not read image {self.files[self.index - 1]}")
+        return False, None
+    
+    def seek(self, frame_index):
+        """
+        Position the source so the next read() returns frame frame_index.
+        """
+        self.index = max(0, min(frame_index, self.frame_count))
+    
+    def release(self):
+        self.index = self.frame_count
+
+
+class CaptureLatency:
+    def __init__(self, window=300):
+        """
+        Rolling statistics of how long read() waited for a frame and how old the
+        frame was when it was handed over (time since it was captured), in ms. The
+        age is left out for frames whose capture time is unknown.
+        """
+        self.read_ms = deque(maxlen=window)
+        self.age_ms = deque(maxlen=window)
+        self.skipped = 0  # Grabbed frames that were replaced before anyone read them
+    
+    def add(self, read_ms, age_ms=None):
+        self.read_ms.append(read_ms)
+        if age_ms is not None:
+            self.age_ms.append(age_ms)
+    
+    def summary(self):
+        """
+        Return {"read": (p50, p95), "age": (p50, p95) or None when unknown, "skipped": n}.
+        """
+        summary = {"skipped": self.skipped}
+        summary["read"] = tuple(np.percentile(self.read_ms, (50, 95))) if self.read_ms else (0.0, 0.0)
+        summary["age"] = tuple(np.percentile(self.age_ms, (50, 95))) if self.age_ms else None
+        return summary
+    
+    def report(self):
+        """
+        Return a one-line summary of the capture latency.
+        """
+        summary = self.summary()
+        age = "p50={:.1f} p95={:.1f} ms".format(*summary["age"]) if summary["age"] else "unknown"
+        return "Capture latency: read p50={:.1f} p95={:.1f} ms | frame age {} | skipped {}".format(
+            *summary["read"], age, summary["skipped"])
+
+
+class CameraSource:
+    def __init__(self, device=0, width=None, height=None, fps=None, fourcc=None, buffer_size=None):
+        """
+        Read frames from a camera, requesting a capture mode: resolution, frame rate,
+        FOURCC pixel format (e.g. "MJPG", which most USB cameras need for high frame
+        rates at high resolutions) and the number of frames the backend may buffer.
+        Cameras silently fall back to a supported mode, so check settings().
+        
+        A buffer_size of 1 keeps the backend from queueing stale frames where it is
+        supported (V4L2, DirectShow); otherwise use LatestFrameGrabber.
+        """
+        self.path = device
+        self.cap = cv2.VideoCapture(device)
+        # The pixel format has to be set first, since it limits the available sizes and rates
+        if fourcc:
+            self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+        if width:
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        if height:
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        if fps:
+            self.cap.set(cv2.CAP_PROP_FPS, fps)
+        if buffer_size:
+            self.cap.set(cv2.CAP_PROP_BUFFERSIZE, buffer_size)
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 0.0
+        self.frame_count = 0  # Live source
+        self.timestamp = None  # perf_counter() time the last frame was captured
+        self.latency = CaptureLatency()
+    
+    def isOpened(self):
+        return self.cap.isOpened()
+    
+    def frame_age(self):
+        """
+        Return how long ago (ms) the driver captured the last frame read, from its
+        CAP_PROP_POS_MSEC timestamp, or None if that is not on the monotonic
+        clock (V4L2 stamps buffers with it; other backends count from the start
+        of the stream or report nothing).
+        """
+        captured = self.cap.get(cv2.CAP_PROP_POS_MSEC)
+        age = time.monotonic() * 1e3 - captured
+        # Frames older than a second are not waiting in a driver queue: a different clock
+        return age if captured > 0 and 0 <= age < 1000 else None
+    
+    def settings(self):
+        """
+        Return the capture mode the camera actually applied.
+        """
+        fourcc = int(self.cap.get(cv2.CAP_PROP_FOURCC))
+        return {
+            "width": int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            "height": int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            "fps": self.cap.get(cv2.CAP_PROP_FPS),
+            "fourcc": "".join(chr((fourcc >> 8 * i) & 0xFF) for i in range(4)),
+            "buffer_size": int(self.cap.get(cv2.CAP_PROP_BUFFERSIZE)),
+        }
+    
+    def read(self, image=None):
+        """
+        Return (success, frame); the frame is decoded into image if given.
+        """
+        start = time.perf_counter()
+        result = self.cap.read(image)
+        end = time.perf_counter()
+        age = self.frame_age() if result[0] else None
+        # Without a driver timestamp, the end of the read is the best capture time there is
+        self.timestamp = end if age is None else end - age / 1e3
+        # A read that returns at once got a frame the backend had already buffered
+        self.latency.add((end - start) * 1e3, age)
+        return result
+    
+    def release(self):
+        self.cap.release()
+
+
+class LatestFrameGrabber:
+    def __init__(self, source, realtime=None):
+        """
+        Read a source continuously on a background thread and only keep the newest
+        frame, so read() never returns a frame that queued up while the tracker was
+        busy. Frames grabbed and replaced before they were read are counted in
+        latency.skipped.
+        
+        With realtime (the default for recorded sources), frames are grabbed at the
+        source's frame rate as a camera would deliver them, which makes the grabber
+        testable with a video file.
+        """
+        self.source = source
+        self.path = source.path
+        self.fps = source.fps
+        self.frame_count = source.frame_count
+        self.realtime = bool(source.frame_count) if realtime is None else realtime
+        self.timestamp = None  # perf_counter() time the last returned frame was grabbed
+        self.latency = CaptureLatency()
+        
+        self._frame = None
+        self._grabbed_at = None
+        self._done = False
+        self._stop = threading.Event()
+        self._ready = threading.Condition()
+        self._thread = threading.Thread(target=self._grab_loop, name="frame-grabber", daemon=True)
+        self._thread.start()
+    
+    def isOpened(self):
+        return self.source.isOpened()
+    
+    def read(self, image=None):
+        """
+        Return (success, frame) with the newest frame not returned yet, waiting for
+        one if needed. The frame belongs to the caller; image is accepted for
+        compatibility but not used.
+        """
+        start = time.perf_counter()
+        with self._ready:
+            while self._frame is None and not self._done:
+                self._ready.wait()
+            frame, self._frame = self._frame, None
+            grabbed_at = self._grabbed_at
+        if frame is None:
+            return False, None
+        now = time.perf_counter()
+        self.timestamp = grabbed_at
+        self.latency.add((now - start) * 1e3, (now - grabbed_at) * 1e3)
+        return True, frame
+    
+    def release(self):
+        self._stop.set()
+        self._thread.join()
+        self.source.release()
+    
+    def _grab_loop(self):
+        interval = 1.0 / (self.fps or DEFAULT_FPS)
+        next_grab = time.perf_counter()
+        try:
+            while not self._stop.is_set():
+                if self.realtime:
+                    delay = next_grab - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    next_grab += interval
+                # A new array every time, since the previous frame may still be in use
+                success, frame = self.source.read()
+                if not success:
+                    break
+                with self._ready:
+                    if self._frame is not None:
+                        self.latency.skipped += 1
+                    self._frame = frame
+                    self._grabbed_at = self.source.timestamp
+                    self._ready.notify()
+        finally:
+            with self._ready:
+                self._done = True
+                self._ready.notify()
+
+
+def frame_time(source, frame_index):
+    """
+    Return the timestamp (seconds) of frame frame_index of a recorded source,
+    from its nominal frame rate.
+    """
+    return frame_index / (source.fps or DEFAULT_FPS)
+
+
+def open_source(path):
+    """
+    Open a recorded source: a directory of images or a video file.
+    """
+    if os.path.isdir(path):
+        return ImageSequenceSource(path)
+    return VideoFileSource(path)
+
+
+def add_capture_arguments(parser):
+    """
+    Add the frame source options shared by the live tools.
+    """
+    parser.add_argument("--source", default="0",
+                        help="Camera index, video file or image directory")
+    parser.add_argument("--width", type=int, default=None, help="Requested camera frame width")
+    parser.add_argument("--height", type=int, default=None, help="Requested camera frame height")
+    parser.add_argument("--fps", type=float, default=None, help="Requested camera frame rate")
+    parser.add_argument("--fourcc", default=None,
+                        help="Requested camera pixel format, e.g. MJPG for high frame rates")
+    parser.add_argument("--buffer-size", type=int, default=None,
+                        help="Frames the camera backend may buffer (1 for the lowest latency)")
+    parser.add_argument("--grab-latest", action="store_true",
+                        help="Grab frames on a background thread and always process the newest one")
+
+
+def open_capture(args):
+    """
+    Open the frame source selected by add_capture_arguments() options: a camera
+    if --source is a number, a recording otherwise.
+    """
+    if args.source.isdigit():
+        source = CameraSource(int(args.source), args.width, args.height, args.fps, args.fourcc,
+                              args.buffer_size)
+    else:
+        source = open_source(args.source)
+    if args.grab_latest and source.isOpened():
+        source = LatestFrameGrabber(source)
+    return source
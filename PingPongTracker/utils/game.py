@@ -0,0 +1,332 @@
+import time
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+from utils.ball_tracker import BallTracker, DetectionParams
+from utils.multi_tracker import MultiBallTracker
+from utils.buffers import BufferPool
+from utils.motion import MotionMask, MOTION_METHODS
+from utils.overlay import TextCache
+from utils.physics import PhysicsTrajectoryPredictor, TableGeometry, parse_table
+from utils.profiler import NULL_PROFILER, StageProfiler
+from utils.trajectory import TrajectoryPredictor, RecursiveTrajectoryPredictor, FITTERS
+from utils.stick_figure import StickFigure
+
+# Snapshot of everything needed to render one frame. Rendering only reads from
+# this, so it can run on a different thread than detection.
+FrameResult = namedtuple(
+    "FrameResult",
+    ["ball_pos", "trail", "figure_x", "prediction_point", "intersection", "score", "misses", "event", "tracks", "arc"],
+)
+
+
+class GameSession:
+    def __init__(self, ball_tracker, trajectory_predictor, stick_figure, profiler=None, max_lookahead_ms=500,
+                 arc_points=0):
+        """
+        Hold the game state (score, misses) and run the per-frame game logic:
+        ball detection, trajectory prediction, moving the stick figure and scoring.
+        The stick figure only moves to a predicted intercept less than
+        max_lookahead_ms away; for later ones it follows the ball.
+        arc_points > 0 samples the predicted path over the same lookahead for drawing.
+        """
+        self.ball_tracker = ball_tracker
+        self.trajectory_predictor = trajectory_predictor
+        self.stick_figure = stick_figure
+        self.profiler = profiler or NULL_PROFILER
+        self.max_lookahead_ms = max_lookahead_ms
+        self.arc_times = np.linspace(0, max_lookahead_ms / 1000, arc_points) if arc_points > 0 else None
+        
+        # Game state variables
+        self.score = 0
+        self.misses = 0
+        self.ball_caught = False
+        self.prediction_point = None
+        
+        # Score labels, rendered once per value
+        self._text = TextCache()
+    
+    def update(self, frame, timestamp=None):
+        """
+        Run detection, trajectory prediction and scoring on a frame captured at
+        timestamp (seconds, default: now).
+        Returns a FrameResult snapshot of the state after this frame.
+        """
+        if timestamp is None:
+            timestamp = time.perf_counter()
+        ball_tracker = self.ball_tracker
+        stick_figure = self.stick_figure
+        if not stick_figure.sized:
+            # Sized from the first frame when the session was created before the camera opened
+            height, width = frame.shape[:2]
+            stick_figure.resize(width, height)
+            self.trajectory_predictor.resize(width, height)
+        width = stick_figure.screen_width
+        event = None
+        intersection = None
+        arc = None
+        
+        # Detect the ball
+        with self.profiler.stage("detect"):
+            ball_pos = ball_tracker.detect_ball(frame, timestamp)
+        
+        if ball_pos:
+            # Get ball positions for trajectory prediction
+            positions = ball_tracker.get_positions()
+            
+            # Get current ball x-position for stick figure
+            current_x = ball_pos[0]
+            
+            # If we have enough positions, try to predict the trajectory
+            if len(positions) >= 5:
+                with self.profiler.stage("fit"):
+                    fitted = self.trajectory_predictor.fit_trajectory(positions)
+                if fitted:
+                    # Sample the predicted path in one call
+                    if self.arc_times is not None:
+                        arc = self.trajectory_predictor.predict_positions(self.arc_times).astype(np.int32)
+                    
+                    # Get the paddle y-level
+                    _, _, paddle_y = stick_figure.get_paddle_bounds()
+                    
+                    # Predict where the ball will intersect with the paddle y-level
+                    with self.profiler.stage("intersection"):
+                        intersection = self.trajectory_predictor.predict_intersection(paddle_y)
+                    
+                    if intersection:
+                        predicted_x, time_to_intersection = intersection
+                        self.prediction_point = (predicted_x, paddle_y)
+                        
+                        # Only use prediction if it's a reasonable time away
+                        # and not too far from current position
+                        if time_to_intersection < self.max_lookahead_ms and abs(predicted_x - current_x) < width / 2:
+                            # Move stick figure to predicted position
+                            stick_figure.move_to(predicted_x, timestamp)
+                        else:
+                            # If prediction is too far in the future, just follow the ball
+                            stick_figure.move_to(current_x, timestamp)
+                        
+                        # Check if ball is near the paddle level
+                        if paddle_y - 10 <= ball_pos[1] <= paddle_y + 10:
+                            # Get paddle bounds
+                            paddle_left, paddle_right, _ = stick_figure.get_paddle_bounds()
+                            
+                            # Check if ball is within paddle horizontal bounds
+                            if not self.ball_caught:
+                                if paddle_left <= ball_pos[0] <= paddle_right:
+                                    self.score += 1
+                                    event = "catch"
+                                else:
+                                    self.misses += 1
+                                    event = "miss"
+                                self.ball_caught = True
+                    else:
+                        # If no valid intersection is predicted, follow the current ball position
+                        stick_figure.move_to(current_x, timestamp)
+                else:
+                    # If trajectory prediction fails, just follow the ball
+                    stick_figure.move_to(current_x, timestamp)
+            else:
+                # Not enough positions for prediction, just follow the ball
+                stick_figure.move_to(current_x, timestamp)
+        else:
+            # Reset ball_caught when no ball is detected
+            self.ball_caught = False
+        
+        return FrameResult(
+            ball_pos=ball_pos,
+            trail=ball_tracker.get_positions().xy().copy(),
+            figure_x=stick_figure.x,
+            prediction_point=self.prediction_point,
+            intersection=intersection,
+            score=self.score,
+            misses=self.misses,
+            event=event,
+            tracks=ball_tracker.get_tracks(),
+            arc=arc,
+        )
+    
+    def draw(self, frame, result):
+        """
+        Draw the ball, trail, stick figure, prediction point and score on the frame.
+        """
+        if result.ball_pos:
+            frame = self.ball_tracker.draw_ball(frame, result.ball_pos, result.trail)
+        
+        # Draw the other balls followed in multi-ball mode
+        if result.tracks:
+            frame = self.ball_tracker.draw_tracks(frame, result.tracks)
+        
+        # Draw the stick figure
+        frame = self.stick_figure.draw(frame, result.figure_x)
+        
+        # Draw the predicted path
+        if result.arc is not None:
+            cv2.polylines(frame, [result.arc], False, (0, 200, 255), 1)
+        
+        # Draw prediction point
+        prediction_point = result.prediction_point
+        if prediction_point and isinstance(prediction_point, tuple) and len(prediction_point) == 2 and isinstance(prediction_point[0], int) and isinstance(prediction_point[1], int):
+            cv2.circle(frame, prediction_point, 5, (0, 255, 255), -1)
+        
+        # Draw score
+        self._text.draw(frame, f"Score: {result.score}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+        self._text.draw(frame, f"Misses: {result.misses}", (10, 70), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+        
+        return frame
+
+
+def parse_hsv(value):
+    """
+    Parse an "H,S,V" command line value into a tuple of ints in OpenCV's ranges
+    (H 0-179, S and V 0-255). Raises ValueError for a malformed value, so it can
+    serve as an argparse type.
+    """
+    try:
+        hsv = tuple(int(v) for v in value.split(","))
+    except ValueError:
+        raise ValueError(f"expected a color as H,S,V, got {value!r}") from None
+    if len(hsv) != 3 or not (0 <= hsv[0] <= 179 and 0 <= hsv[1] <= 255 and 0 <= hsv[2] <= 255):
+        raise ValueError(f"expected a color as H,S,V within 0-179,0-255,0-255, got {value!r}")
+    return hsv
+
+
+def add_session_arguments(parser):
+    """
+    Add the command line options that configure the tracker and predictor.
+    """
+    parser.add_argument("--predictor", choices=("batch", "recursive", "physics"), default="batch",
+                        help="Refit the whole history every frame, update a recursive model per detection, "
+                             "or simulate the flight through bounces")
+    parser.add_argument("--forgetting-factor", type=float, default=0.9,
+                        help="Per-sample forgetting factor of the recursive predictor")
+    parser.add_argument("--table", type=parse_table, default=None,
+                        help="Table surface the physics predictor bounces the ball off, as Y,LEFT,RIGHT "
+                             "fractions of the frame (e.g. 0.6,0.2,0.8)")
+    parser.add_argument("--restitution", type=float, default=0.8,
+                        help="Initial fraction of vertical speed kept in a bounce (refined from observed bounces)")
+    parser.add_argument("--rollouts", type=int, default=64,
+                        help="Candidate futures simulated per physics prediction")
+    parser.add_argument("--figure-size", type=int, default=80,
+                        help="Stick figure size in pixels; sets the paddle width and height above the bottom")
+    parser.add_argument("--history", type=int, default=10,
+                        help="Number of recent ball positions kept by the tracker")
+    parser.add_argument("--max-balls", type=int, default=1,
+                        help="Track up to this many balls at once; the stick figure follows the longest-tracked one")
+    parser.add_argument("--roi-tracking", action="store_true",
+                        help="Once locked, only search a window around the Kalman prediction")
+    parser.add_argument("--reacquire-interval", type=int, default=30,
+                        help="Frames between forced full-frame scans in ROI tracking mode")
+    parser.add_argument("--pyramid-levels", type=int, default=0,
+                        help="Find candidates on a frame downscaled by 2**levels, then refine at full resolution")
+    parser.add_argument("--motion-mask", choices=("none",) + MOTION_METHODS, default="none",
+                        help="Only look for the ball among moving pixels (frame differencing or MOG2)")
+    parser.add_argument("--motion-scale", type=int, default=4,
+                        help="Downscale factor of the frames the motion mask is computed on")
+    parser.add_argument("--streaks", action="store_true",
+                        help="Locate motion-blurred balls from their streaks and measure their velocity")
+    parser.add_argument("--exposure-ratio", type=float, default=1.0,
+                        help="Exposure time divided by the frame interval, for --streaks")
+    parser.add_argument("--hsv-lower", type=parse_hsv, default="20,100,100",
+                        help="Lower bound of the ball color as H,S,V (OpenCV ranges: H 0-179, S and V 0-255)")
+    parser.add_argument("--hsv-upper", type=parse_hsv, default="35,255,255",
+                        help="Upper bound of the ball color as H,S,V")
+    parser.add_argument("--erode", type=int, default=1, help="Erosion iterations applied to the color mask")
+    parser.add_argument("--dilate", type=int, default=2, help="Dilation iterations applied after the erosion")
+    parser.add_argument("--blur", type=int, default=5, help="Gaussian blur kernel size for the mask (odd, 0 for none)")
+    parser.add_argument("--min-radius", type=float, default=3, help="Smallest ball radius in pixels (exclusive)")
+    parser.add_argument("--max-radius", type=float, default=50, help="Largest ball radius in pixels (exclusive)")
+    parser.add_argument("--min-circularity", type=float, default=0.65,
+                        help="Circularity a blob needs to count as a ball")
+    parser.add_argument("--small-circularity", type=float, default=0.5,
+                        help="Circularity needed by balls under 10 pixels in radius, which look less round")
+    parser.add_argument("--search-radius", type=int, default=30,
+                        help="Pixels around the Kalman prediction searched when the ball was missed")
+    parser.add_argument("--process-noise", type=float, default=0.03,
+                        help="Process noise of the Kalman filter; higher follows sudden changes faster")
+    parser.add_argument("--reuse-buffers", action="store_true",
+                        help="Write frames and intermediate images into preallocated buffers")
+    parser.add_argument("--profile", action="store_true",
+                        help="Record per-stage timings and print their percentiles")
+    parser.add_argument("--profile-export", default=None,
+                        help="Append per-stage percentiles to this JSONL file (implies --profile)")
+    parser.add_argument("--profile-interval", type=float, default=10.0,
+                        help="Seconds between profile reports/exports")
+    parser.add_argument("--max-lookahead-ms", type=float, default=500,
+                        help="Only move to predicted intercepts less than this many milliseconds away")
+    parser.add_argument("--arc-points", type=int, default=0,
+                        help="Draw the predicted path over the lookahead with this many points")
+    parser.add_argument("--fitter", choices=FITTERS, default="lstsq",
+                        help="Trajectory fitting backend (curve_fit requires SciPy)")
+
+
+def check_session_arguments(parser, args):
+    """
+    Reject values and combinations of the options of add_session_arguments()
+    that cannot work, as a usage error of parser.
+    """
+    if args.blur < 0 or args.blur % 2 == 0 and args.blur != 0:
+        parser.error(f"--blur must be an odd kernel size or 0, got {args.blur}")
+    if args.max_balls > 1:
+        single = [flag for flag, used in (("--roi-tracking", args.roi_tracking),
+                                           ("--pyramid-levels", args.pyramid_levels > 0),
+                                           ("--streaks", args.streaks)) if used]
+        if single:
+            parser.error(f"{', '.join(single)} cannot be combined with --max-balls above 1")
+
+
+def detection_options(args):
+    """
+    Return the (lower_color, upper_color, DetectionParams) selected by the
+    detection options of add_session_arguments().
+    """
+    # A replayed session's options hold the bounds as lists
+    lower, upper = tuple(args.hsv_lower), tuple(args.hsv_upper)
+    detection = DetectionParams(
+        erode_iterations=args.erode, dilate_iterations=args.dilate, blur_size=args.blur,
+        min_radius=args.min_radius, max_radius=args.max_radius, min_circularity=args.min_circularity,
+        small_circularity=args.small_circularity, search_radius=args.search_radius,
+        process_noise=args.process_noise,
+    )
+    return lower, upper, detection
+
+
+def create_session(args, width=None, height=None):
+    """
+    Build a GameSession for frames of the given size from parsed command line options.
+    Without a size, the stick figure and predictor are sized from the first frame.
+    """
+    profiler = None
+    if args.profile or args.profile_export:
+        profiler = StageProfiler(export_path=args.profile_export, export_interval=args.profile_interval)
+    
+    buffers = BufferPool() if args.reuse_buffers else None
+    motion = None
+    if args.motion_mask != "none":
+        motion = MotionMask(args.motion_mask, scale=args.motion_scale)
+    lower, upper, detection = detection_options(args)
+    if args.max_balls > 1:
+        ball_tracker = MultiBallTracker(lower, upper, max_positions=args.history, max_tracks=args.max_balls,
+                                        buffers=buffers, profiler=profiler, motion=motion, detection=detection)
+    else:
+        ball_tracker = BallTracker(lower, upper, max_positions=args.history, roi_tracking=args.roi_tracking,
+                                   reacquire_interval=args.reacquire_interval,
+                                   pyramid_levels=args.pyramid_levels,
+                                   buffers=buffers, profiler=profiler, motion=motion,
+                                   streak_detection=args.streaks, exposure_ratio=args.exposure_ratio,
+                                   detection=detection)
+    if args.predictor == "recursive":
+        trajectory_predictor = RecursiveTrajectoryPredictor(args.forgetting_factor, frame_width=width)
+    elif args.predictor == "physics":
+        # A replayed session's options hold the table as a list
+        table = TableGeometry(*args.table) if args.table else None
+        trajectory_predictor = PhysicsTrajectoryPredictor(table=table, restitution=args.restitution,
+                                                          rollouts=args.rollouts, frame_width=width,
+                                                          frame_height=height)
+    else:
+        trajectory_predictor = TrajectoryPredictor(fitter=args.fitter, frame_width=width)
+    stick_figure = StickFigure(width, height, size=args.figure_size)
+    return GameSession(ball_tracker, trajectory_predictor, stick_figure, profiler,
+                       max_lookahead_ms=args.max_lookahead_ms, arc_points=args.arc_points)
@@ -0,0 +1,100 @@
+import numpy as np
+
+# Columns of a PositionHistory sample
+X, Y, RADIUS, TIME, MEASURED = range(5)
+
+class PositionHistory:
+    def __init__(self, capacity):
+        """
+        Fixed-capacity ring buffer of the most recent ball samples:
+        x, y, radius, timestamp and whether the sample was measured (True) or
+        only predicted by the Kalman filter (False).
+        
+        Every sample is written twice, at slot i and i + capacity, so the samples
+        in order (oldest first) are always one contiguous slice of the storage and
+        the accessors below return views without copying. Appending is O(1)
+        regardless of the capacity.
+        """
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self._data = np.zeros((2 * capacity, 5))
+        self._head = 0  # Slot the next sample is written to, in [0, capacity)
+        self._length = 0
+        self.appended = 0  # Number of samples appended since creation
+        self.epoch = 0  # Incremented by clear(), so consumers can tell the history restarted
+    
+    def append(self, x, y, radius=0, timestamp=0.0, measured=True):
+        """
+        Add a sample, overwriting the oldest one when full.
+        """
+        head = self._head
+        self._data[head] = self._data[head + self.capacity] = (x, y, radius, timestamp, measured)
+        self._head = head + 1 if head + 1 < self.capacity else 0
+        if self._length < self.capacity:
+            self._length += 1
+        self.appended += 1
+    
+    def clear(self):
+        """
+        Remove all samples.
+        """
+        self._length = 0
+        self.epoch += 1
+    
+    def __len__(self):
+        return self._length
+    
+    def samples(self):
+        """
+        Return an (n, 5) view of the samples, oldest first.
+        """
+        end = self._head + self.capacity
+        return self._data[end - self._length:end]
+    
+    def xy(self):
+        """
+        Return an (n, 2) view of the positions, oldest first.
+        """
+        return self.samples()[:, X:Y + 1]
+    
+    def radii(self):
+        return self.samples()[:, RADIUS]
+    
+    def times(self):
+        return self.samples()[:, TIME]
+    
+    def measured(self):
+        """
+        Return a boolean array marking the measured (not predicted) samples.
+        """
+        return self.samples()[:, MEASURED] != 0
+    
+    def last(self):
+        """
+        Return the newest (x, y) as ints, or None if empty.
+        """
+        if not self._length:
+            return None
+        head = self._head + self.capacity - 1
+        return int(self._data[head, X]), int(self._data[head, Y])
+
+
+def as_xy(positions):
+    """
+    Return an (n, 2) float array of positions from a PositionHistory (as a view)
+    or from any sequence of (x, y, ...) tuples.
+    """
+    if isinstance(positions, PositionHistory):
+        return positions.xy()
+    return np.asarray(positions, dtype=np.float64).reshape(len(positions), -1)[:, :2]
+
+
+def as_times(positions):
+    """
+    Return the sample timestamps of a PositionHistory (as a view), or 0..n-1
+    (one unit per sample) for any other sequence of positions.
+    """
+    if isinstance(positions, PositionHistory):
+        return positions.times()
+    return np.arange(len(positions), dtype=np.float64)
@@ -0,0 +1,72 @@
+import cv2
+import numpy as np
+
+MOTION_METHODS = ("diff", "mog2")
+
+
+class MotionMask:
+    def __init__(self, method="diff", scale=4, threshold=15, dilate_iterations=2, history=120):
+        """
+        Mask of the moving parts of the frame, computed on a copy downscaled by scale.
+        
+        method "diff" thresholds the difference between consecutive frames (cheap,
+        no warm-up); "mog2" uses OpenCV's Gaussian-mixture background subtractor,
+        which adapts to lighting changes and camera noise over `history` frames.
+        The mask is dilated by dilate_iterations (downscaled) pixels so a ball moving
+        less than its own size per frame is still covered entirely.
+        
+        ANDed with the color mask, it keeps static ball-colored objects (shirts,
+        signs, cones) out of the contour search; a ball held perfectly still is
+        masked out too.
+        """
+        if method not in MOTION_METHODS:
+            raise ValueError(f"Unknown motion method: {method}")
+        self.method = method
+        self.scale = scale
+        self.threshold = threshold
+        self.dilate_iterations = dilate_iterations
+        self.mask = None  # Motion mask of the last frame, at the downscaled size
+        
+        self._previous = None
+        self._subtractor = None
+        if method == "mog2":
+            self._subtractor = cv2.createBackgroundSubtractorMOG2(history=history, detectShadows=False)
+    
+    def update(self, frame):
+        """
+        Compute the motion mask of a new frame.
+        """
+        height, width = frame.shape[:2]
+        small_size = (max(1, width // self.scale), max(1, height // self.scale))
+        # Bilinear sampling is several times faster than area averaging here, and
+        # the dilation below hides the aliasing
+        small = cv2.resize(frame, small_size, interpolation=cv2.INTER_LINEAR)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+        
+        if self._subtractor is not None:
+            mask = self._subtractor.apply(gray)
+        elif self._previous is None or self._previous.shape != gray.shape:
+            # Nothing to compare against yet, so do not mask anything out
+            mask = np.full(gray.shape, 255, np.uint8)
+        else:
+            diff = cv2.absdiff(gray, self._previous)
+            _, mask = cv2.threshold(diff, self.threshold, 255, cv2.THRESH_BINARY)
+        self._previous = gray
+        
+        if self.dilate_iterations:
+            mask = cv2.dilate(mask, None, iterations=self.dilate_iterations)
+        self.mask = mask
+        return mask
+    
+    def region(self, x, y, width, height, shape, dst=None):
+        """
+        Return the motion mask over the frame rectangle (x, y, width, height),
+        resized to shape (height, width), e.g. the full-resolution or downscaled
+        size of the image being segmented.
+        """
+        scale = self.scale
+        x_min, y_min = x // scale, y // scale
+        x_max = max(x_min + 1, -(-(x + width) // scale))
+        y_max = max(y_min + 1, -(-(y + height) // scale))
+        patch = self.mask[y_min:y_max, x_min:x_max]
+        return cv2.resize(patch, (shape[1], shape[0]), dst=dst, interpolation=cv2.INTER_NEAREST)
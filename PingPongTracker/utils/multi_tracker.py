@@ -0,0 +1,405 @@
+import time
+
+import cv2
+import numpy as np
+from collections import namedtuple
+
+from utils.ball_tracker import BallTracker
+
+# One followed ball. trail is an (n, 2) array of its recent positions, oldest first.
+Track = namedtuple("Track", ["id", "x", "y", "radius", "hits", "misses", "primary", "trail"])
+
+# Cost of an assignment outside the gate; large enough never to be preferred
+_GATED_COST = 1e9
+
+
+def assign(cost, gate):
+    """
+    Gated minimum-cost assignment of tracks (rows) to detections (columns).
+    gate holds the largest acceptable cost for each row.
+    Returns (rows, cols) index arrays of the accepted pairs.
+    """
+    if cost.size == 0:
+        return np.empty(0, int), np.empty(0, int)
+    gated = np.where(cost <= gate[:, None], cost, _GATED_COST)
+    rows, cols = _hungarian(gated)
+    keep = gated[rows, cols] < _GATED_COST
+    return rows[keep], cols[keep]
+
+
+def _hungarian(cost):
+    """
+    Solve the rectangular linear assignment problem with the Hungarian algorithm
+    (shortest augmenting paths with potentials, O(n^2 m)).
+    The inner loop over columns is vectorized, so small problems stay cheap.
+    Returns (rows, cols) of the optimal assignment, sorted by row.
+    """
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+    
+    u = np.zeros(n + 1)  # Row potentials
+    v = np.zeros(m + 1)  # Column potentials
+    match = np.zeros(m + 1, int)  # Row (1-based) assigned to each column, 0 if free
+    way = np.zeros(m + 1, int)  # Previous column on the augmenting path
+    for i in range(1, n + 1):
+        match[0] = i
+        j0 = 0
+        min_slack = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, bool)
+        while True:
+            used[j0] = True
+            i0 = match[j0]
+            free = ~used
+            free[0] = False
+            
+            # Relax the slack of every free column through row i0
+            slack = cost[i0 - 1] - u[i0] - v[1:]
+            better = free[1:] & (slack < min_slack[1:])
+            min_slack[1:][better] = slack[better]
+            way[1:][better] = j0
+            
+            j1 = int(np.argmin(np.where(free, min_slack, np.inf)))
+            delta = min_slack[j1]
+            u[match[used]] += delta
+            v[used] -= delta
+            min_slack[free] -= delta
+            j0 = j1
+            if match[j0] == 0:
+                break
+        
+        # Flip the augmenting path
+        while j0:
+            j1 = way[j0]
+            match[j0] = match[j1]
+            j0 = j1
+    
+    cols = np.nonzero(match[1:])[0]
+    rows = match[1:][cols] - 1
+    if transposed:
+        rows, cols = cols, rows
+    order = np.argsort(rows)
+    return rows[order], cols[order]
+
+
+class MultiBallTracker(BallTracker):
+    def __init__(self, lower_color=(20, 100, 100), upper_color=(35, 255, 255), max_positions=10,
+                 max_tracks=8, gate_distance=50, max_misses=5, min_hits=3, velocity_variance=100.0,
+                 min_speed=1.0, buffers=None, profiler=None, motion=None, detection=None):
+        """
+        Track up to max_tracks balls at once.
+        
+        The Kalman states of all tracks live in stacked arrays and are predicted and
+        corrected together. Each frame's detections are matched to the predicted
+        positions by gated Hungarian assignment: a pair is only accepted if it is
+        closer than gate_distance pixels plus three standard deviations of the
+        track's position uncertainty, widened while the track is coasting.
+        
+        Unmatched detections start new tracks; a track is reported once it has been
+        detected min_hits times, and deleted after max_misses consecutive misses or
+        when it coasts out of the frame. New tracks start at rest with a velocity
+        variance of velocity_variance (pixels/frame)^2.
+        
+        The BallTracker interface (detect_ball, positions, get_positions, misses)
+        follows the primary track: the longest-lived track moving at least min_speed
+        pixels/frame, kept while it moves so the game does not flicker between balls.
+        """
+        super().__init__(lower_color, upper_color, max_positions, buffers=buffers, profiler=profiler,
+                         motion=motion, detection=detection)
+        self.max_tracks = max_tracks
+        self.gate_distance = gate_distance
+        self.max_misses = max_misses
+        self.min_hits = min_hits
+        self.velocity_variance = velocity_variance
+        self.min_speed = min_speed
+        
+        # Constant-velocity model shared by all tracks, same noise as the single-ball filter
+        self._F = self.kalman.transitionMatrix.astype(np.float64)
+        self._Q = self.kalman.processNoiseCov.astype(np.float64)
+        self._R = np.eye(2)
+        
+        # Stacked track state, one row per track
+        self._ids = np.empty(0, np.int64)
+        self._state = np.empty((0, 4))  # x, y, vx, vy
+        self._cov = np.empty((0, 4, 4))
+        self._radius = np.empty(0, np.int64)
+        self._hits = np.empty(0, np.int64)
+        self._track_misses = np.empty(0, np.int64)
+        # Ring buffer of positions shared by all tracks (each track gets one position
+        # per frame, so they share the write slot); written twice like PositionHistory
+        self._history = np.empty((0, 2 * max_positions, 2), np.int64)
+        self._measured = np.empty((0, 2 * max_positions), bool)
+        self._times = np.zeros(2 * max_positions)
+        self._lengths = np.empty(0, np.int64)  # Number of valid history entries
+        self._head = 0  # Slot the next positions are written to
+        self._next_id = 0
+        
+        self.primary_id = None
+    
+    def detect_ball(self, frame, timestamp=None):
+        """
+        Update all tracks with the given frame, taken at timestamp (seconds, default: now).
+        Returns the primary ball's (x, y, radius) (its prediction while it is missed),
+        or None if no track is confirmed yet.
+        """
+        if timestamp is None:
+            timestamp = time.perf_counter()
+        try:
+            self._update(frame, timestamp)
+        except Exception as e:
+            self.profiler.count("detect_errors")
+            print(f"Ball detection error: {e}")
+            return None
+        
+        primary = self._primary_index()
+        if primary is None:
+            return None
+        x, y = self._history[primary, self._head + self.max_positions - 1]
+        return (int(x), int(y), int(self._radius[primary]))
+    
+    def detect_balls(self, frame, timestamp=None):
+        """
+        Detect all balls in the frame and update the tracks.
+        Returns the list of confirmed Tracks.
+        """
+        if timestamp is None:
+            timestamp = time.perf_counter()
+        self._update(frame, timestamp)
+        return self.get_tracks()
+    
+    def _update(self, frame, timestamp):
+        """
+        Predict, associate, correct, then delete and create tracks for one frame.
+        """
+        # Predict every track forward one frame in one batched step
+        with self.profiler.stage("kalman_predict"):
+            self._predict()
+        
+        self._update_motion(frame)
+        _, blurred_mask = self._segment(frame)
+        detections = self._find_balls(blurred_mask, candidates=max(5, 2 * self.max_tracks))
+        detections = np.array(detections, np.int64).reshape(-1, 3)
+        
+        with self.profiler.stage("association"):
+            rows, cols = self._associate(detections)
+        
+        with self.profiler.stage("kalman_correct"):
+            self._correct(rows, detections[cols])
+        
+        # Matched tracks record their detection and coasting ones their prediction,
+        # like the single-ball tracker
+        measured = np.zeros(len(self._ids), bool)
+        measured[rows] = True
+        self._track_misses[~measured] += 1
+        positions = self._state[:, :2].astype(np.int64)
+        positions[rows] = detections[cols, :2]
+        self._push_history(positions, measured, timestamp)
+        
+        self._delete_tracks(frame.shape)
+        new = np.ones(len(detections), bool)
+        new[cols] = False
+        self._create_tracks(detections[new])
+        
+        self._update_primary(timestamp)
+    
+    def kalman_state(self):
+        """
+        Return the primary track's (x, y, vx, vy) estimate, or None without a primary track.
+        """
+        primary = self._primary_index()
+        if primary is None:
+            return None
+        return self._state[primary]
+    
+    def get_tracks(self):
+        """
+        Return a Track snapshot of every confirmed track.
+        """
+        confirmed = np.nonzero(self._hits >= self.min_hits)[0]
+        newest = self._history[:, self._head + self.max_positions - 1]
+        return [Track(int(self._ids[i]), int(newest[i, 0]), int(newest[i, 1]),
+                      int(self._radius[i]), int(self._hits[i]), int(self._track_misses[i]),
+                      bool(self._ids[i] == self.primary_id),
+                      self._trail(i).copy())
+                for i in confirmed]
+    
+    def draw_tracks(self, frame, tracks):
+        """
+        Draw every track except the primary one (drawn by draw_ball), with its id and trail.
+        """
+        others = [track for track in tracks if not track.primary]
+        if others:
+            # All trails in one call
+            cv2.polylines(frame, [track.trail.astype(np.int32) for track in others], False, (255, 128, 0), 2)
+        for track in others:
+            cv2.circle(frame, (track.x, track.y), track.radius, (255, 128, 0), 2)
+            cv2.putText(frame, str(track.id), (track.x + track.radius, track.y - track.radius),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 128, 0), 1)
+        return frame
+    
+    def _predict(self):
+        """
+        Kalman time update of all tracks: x = F x, P = F P F^T + Q.
+        """
+        self._state = self._state @ self._F.T
+        self._cov = self._F @ self._cov @ self._F.T + self._Q
+    
+    def _correct(self, rows, measurements):
+        """
+        Kalman measurement update of the tracks in rows with their (x, y, radius) detections.
+        """
+        if len(rows) == 0:
+            return
+        cov = self._cov[rows]
+        innovation = measurements[:, :2] - self._state[rows, :2]
+        
+        # With H = [I 0], H P H^T + R and P H^T are slices of P
+        S = cov[:, :2, :2] + self._R
+        PHt = cov[:, :, :2]
+        K = np.linalg.solve(S, PHt.transpose(0, 2, 1)).transpose(0, 2, 1)
+        
+        self._state[rows] += np.einsum("nij,nj->ni", K, innovation)
+        self._cov[rows] = cov - K @ cov[:, :2, :]
+        self._radius[rows] = measurements[:, 2]
+        self._hits[rows] += 1
+        self._track_misses[rows] = 0
+    
+    def _associate(self, detections):
+        """
+        Match detections to the predicted track positions.
+        Returns (rows, cols): track and detection indices of the accepted pairs.
+        """
+        predicted = self._state[:, :2]
+        distance = np.hypot(predicted[:, None, 0] - detections[None, :, 0],
+                            predicted[:, None, 1] - detections[None, :, 1])
+        
+        # Gate on the predicted position uncertainty, widened while coasting
+        sigma = np.sqrt(np.maximum(self._cov[:, 0, 0] + self._cov[:, 1, 1], 0))
+        gate = (self.gate_distance + 3 * sigma) * (1 + 0.5 * self._track_misses)
+        return assign(distance, gate)
+    
+    def _push_history(self, positions, measured, timestamp):
+        """
+        Append one position and measured flag per track, taken at timestamp, to the history arrays.
+        """
+        head = self._head
+        self._history[:, head] = self._history[:, head + self.max_positions] = positions
+        self._measured[:, head] = self._measured[:, head + self.max_positions] = measured
+        self._times[head] = self._times[head + self.max_positions] = timestamp
+        self._head = (head + 1) % self.max_positions
+        self._lengths = np.minimum(self._lengths + 1, self.max_positions)
+    
+    def _trail(self, index):
+        """
+        Return a view of the history of the track in row index, oldest first.
+        """
+        end = self._head + self.max_positions
+        return self._history[index, end - self._lengths[index]:end]
+    
+    def _delete_tracks(self, frame_shape):
+        """
+        Drop tracks that have been missed too often or coasted out of the frame.
+        Tentative tracks are dropped on their first miss.
+        """
+        x, y = self._state[:, 0], self._state[:, 1]
+        inside = (x >= 0) & (x < frame_shape[1]) & (y >= 0) & (y < frame_shape[0])
+        tentative = self._hits < self.min_hits
+        keep = inside & (self._track_misses <= np.where(tentative, 0, self.max_misses))
+        if not keep.all():
+            self._select(keep)
+    
+    def _create_tracks(self, detections):
+        """
+        Start a track at rest for each (x, y, radius) detection, up to max_tracks tracks.
+        """
+        count = min(len(detections), self.max_tracks - len(self._ids))
+        if count <= 0:
+            return
+        detections = detections[:count]
+        
+        state = np.zeros((count, 4))
+        state[:, :2] = detections[:, :2]
+        cov = np.zeros((count, 4, 4))
+        cov[:, 0, 0] = cov[:, 1, 1] = self._R[0, 0]
+        cov[:, 2, 2] = cov[:, 3, 3] = self.velocity_variance
+        # The detection goes into the slot this frame's positions were written to
+        history = np.zeros((count, 2 * self.max_positions, 2), np.int64)
+        newest = (self._head - 1) % self.max_positions
+        history[:, newest] = history[:, newest + self.max_positions] = detections[:, :2]
+        measured = np.ones((count, 2 * self.max_positions), bool)
+        
+        self._ids = np.concatenate([self._ids, np.arange(self._next_id, self._next_id + count)])
+        self._next_id += count
+        self._state = np.concatenate([self._state, state])
+        self._cov = np.concatenate([self._cov, cov])
+        self._radius = np.concatenate([self._radius, detections[:, 2]])
+        self._hits = np.concatenate([self._hits, np.ones(count, np.int64)])
+        self._track_misses = np.concatenate([self._track_misses, np.zeros(count, np.int64)])
+        self._history = np.concatenate([self._history, history])
+        self._measured = np.concatenate([self._measured, measured])
+        self._lengths = np.concatenate([self._lengths, np.ones(count, np.int64)])
+    
+    def _select(self, keep):
+        """
+        Keep only the tracks selected by the boolean mask keep.
+        """
+        self._ids = self._ids[keep]
+        self._state = self._state[keep]
+        self._cov = self._cov[keep]
+        self._radius = self._radius[keep]
+        self._hits = self._hits[keep]
+        self._track_misses = self._track_misses[keep]
+        self._history = self._history[keep]
+        self._measured = self._measured[keep]
+        self._lengths = self._lengths[keep]
+    
+    def _primary_index(self):
+        """
+        Return the row of the primary track, or None.
+        """
+        rows = np.nonzero(self._ids == self.primary_id)[0]
+        return int(rows[0]) if len(rows) else None
+    
+    def _update_primary(self, timestamp):
+        """
+        Keep the primary track while it exists and is moving; otherwise promote a
+        confirmed track, preferring moving ones (static ball-colored objects are not
+        in play), then the one with the most detections.
+        Mirrors its state into the single-ball attributes.
+        """
+        confirmed = self._hits >= self.min_hits
+        moving = confirmed & (np.hypot(self._state[:, 2], self._state[:, 3]) >= self.min_speed)
+        
+        index = self._primary_index()
+        if index is not None and not moving[index] and moving.any():
+            index = None
+        
+        if index is None:
+            candidates = moving if moving.any() else confirmed
+            if not candidates.any():
+                self.primary_id = None
+                self.positions.clear()
+                self.misses = 0
+                self.kalman_initialized = False
+                self.last_pos = None
+                return
+            
+            # Restart the history from the new primary track's trail; clearing it lets
+            # recursive predictors see the change of ball
+            index = int(np.argmax(np.where(candidates, self._hits, -1)))
+            self.primary_id = int(self._ids[index])
+            self.positions.clear()
+            end = self._head + self.max_positions
+            start = end - self._lengths[index]
+            for (x, y), sample_time, measured in zip(self._history[index, start:end], self._times[start:end],
+                                                     self._measured[index, start:end]):
+                self.positions.append(x, y, self._radius[index], sample_time, measured)
+        else:
+            x, y = self._history[index, self._head + self.max_positions - 1]
+            self.positions.append(x, y, self._radius[index], timestamp, self._track_misses[index] == 0)
+        
+        self.misses = int(self._track_misses[index])
+        self.kalman_initialized = True
+        x, y = self.positions.last()
+        self.last_pos = (x, y, int(self._radius[index]))
@@ -0,0 +1,112 @@
+import cv2
+import numpy as np
+
+
+class Sprite:
+    def __init__(self, image, inverse_alpha, anchor):
+        """
+        A pre-rendered overlay: a BGR image premultiplied by its alpha, the inverse
+        alpha (255 where the frame shows through, 0 where the sprite is opaque) and
+        the anchor, the (x, y) pixel of the image that is placed at the blit position.
+        """
+        self.image = image
+        self.inverse_alpha = inverse_alpha
+        self.anchor = anchor
+    
+    @classmethod
+    def render(cls, width, height, anchor, draw):
+        """
+        Render a sprite by calling draw(canvas) on a width x height canvas, with the
+        anchor at the given canvas pixel, and crop it to what was drawn. draw is
+        called on a black and on a white canvas; the difference gives the alpha of
+        anti-aliased edges (e.g. of cv2.putText), so blitting blends them like
+        drawing directly would.
+        """
+        black = np.zeros((height, width, 3), np.uint8)
+        white = np.full((height, width, 3), 255, np.uint8)
+        draw(black)
+        draw(white)
+        inverse_alpha = (white.astype(np.int16) - black).clip(0, 255).astype(np.uint8)
+        drawn = (inverse_alpha < 255).any(axis=2)
+        rows, cols = np.nonzero(drawn.any(axis=1))[0], np.nonzero(drawn.any(axis=0))[0]
+        if not len(rows):
+            return cls(black[:0, :0], inverse_alpha[:0, :0], (0, 0))
+        y0, y1, x0, x1 = int(rows[0]), int(rows[-1]) + 1, int(cols[0]), int(cols[-1]) + 1
+        return cls(black[y0:y1, x0:x1].copy(), inverse_alpha[y0:y1, x0:x1].copy(), (anchor[0] - x0, anchor[1] - y0))
+    
+    def blit(self, frame, x, y):
+        """
+        Blend the sprite onto frame (in place) with the anchor at (x, y), clipped to the frame.
+        """
+        height, width = self.image.shape[:2]
+        left, top = x - self.anchor[0], y - self.anchor[1]
+        x0, y0 = max(left, 0), max(top, 0)
+        x1, y1 = min(left + width, frame.shape[1]), min(top + height, frame.shape[0])
+        if x0 >= x1 or y0 >= y1:
+            return frame
+        sprite = (slice(y0 - top, y1 - top), slice(x0 - left, x1 - left))
+        
+        # frame * (1 - alpha) + premultiplied sprite, written into the frame region
+        region = frame[y0:y1, x0:x1]
+        cv2.multiply(region, self.inverse_alpha[sprite], dst=region, scale=1 / 255)
+        cv2.add(region, self.image[sprite], dst=region)
+        return frame
+
+
+class TextCache:
+    def __init__(self, max_entries=64):
+        """
+        Pre-rendered cv2.putText labels, rendered once per distinct text and style
+        and blended onto the frame afterwards.
+        """
+        self.max_entries = max_entries
+        self._sprites = {}
+    
+    def draw(self, frame, text, org, font_face, font_scale, color, thickness=1):
+        """
+        Draw text like cv2.putText(frame, text, org, font_face, font_scale, color, thickness).
+        """
+        key = (text, font_face, font_scale, color, thickness)
+        sprite = self._sprites.get(key)
+        if sprite is None:
+            if len(self._sprites) >= self.max_entries:
+                self._sprites.clear()
+            (width, height), baseline = cv2.getTextSize(text, font_face, font_scale, thickness)
+            # Margin for the stroke width, so nothing is clipped
+            margin = thickness + 2
+            anchor = (margin, height + margin)
+            sprite = Sprite.render(width + 2 * margin, height + baseline + 2 * margin, anchor,
+                                   lambda canvas: cv2.putText(canvas, text, anchor, font_face, font_scale,
+                                                              color, thickness))
+            self._sprites[key] = sprite
+        return sprite.blit(frame, *org)
+
+
+def draw_gradient_polyline(frame, points, start_color, end_color, thickness=2, bands=16):
+    """
+    Draw the polyline through points (an (n, 2) int array) with its color fading
+    from start_color to end_color. Long polylines are drawn as `bands` color bands
+    of one cv2.polylines call each, so the cost stays flat however long the trail
+    is; up to `bands` segments, each segment gets its own color and a cv2.line
+    call, which is cheaper than a cv2.polylines call for a single segment.
+    """
+    segments = len(points) - 1
+    if segments < 1:
+        return frame
+    if segments <= bands:
+        points = np.asarray(points).tolist()
+        for i in range(1, segments + 1):
+            t = i / (segments + 1)
+            color = tuple(int(s * (1 - t) + e * t) for s, e in zip(start_color, end_color))
+            cv2.line(frame, tuple(points[i - 1]), tuple(points[i]), color, thickness)
+        return frame
+    
+    points = np.ascontiguousarray(points, np.int32)
+    for band in range(bands):
+        # Segments first..last (segment i joins points i - 1 and i), colored like the first
+        first = band * segments // bands + 1
+        last = (band + 1) * segments // bands
+        t = first / (segments + 1)
+        color = tuple(int(s * (1 - t) + e * t) for s, e in zip(start_color, end_color))
+        cv2.polylines(frame, [points[first - 1:last + 1]], False, color, thickness)
+    return frame
@@ -0,0 +1,390 @@
+import statistics
+from collections import deque, namedtuple
+
+import numpy as np
+
+from utils.history import PositionHistory, as_times, as_xy
+from utils.trajectory import TrajectoryPredictor
+
+# Table surface as fractions of the frame: its height y (from the top) and its
+# left and right ends. The ball bounces when its bottom reaches it between the ends.
+TableGeometry = namedtuple("TableGeometry", ["y", "left", "right"])
+
+
+def parse_table(value):
+    """
+    Parse a "Y,LEFT,RIGHT" command line value (fractions of the frame) into a
+    TableGeometry. Raises ValueError for a malformed value, so it can serve as an
+    argparse type.
+    """
+    try:
+        y, left, right = (float(v) for v in value.split(","))
+    except ValueError:
+        raise ValueError(f"expected the table as Y,LEFT,RIGHT, got {value!r}") from None
+    if not left < right:
+        raise ValueError("the table's left end must be left of its right end")
+    return TableGeometry(y, left, right)
+
+
+class PhysicsTrajectoryPredictor(TrajectoryPredictor):
+    def __init__(self, table=None, restitution=0.8, rollouts=64, horizon=1.0, step=1 / 60,
+                 min_bounce_speed=100.0, estimates=30, frame_width=640, frame_height=480, seed=0):
+        """
+        Trajectory predictor with the same API as TrajectoryPredictor that models
+        the ball's flight instead of fitting one quadratic to the whole history.
+        
+        The history is split at bounces (the ball moving down, then up) and jumps
+        (a new ball), and only the samples since the last split are fitted. Gravity
+        (pixels/s^2) and quadratic air drag are estimated from the fits, and the
+        bounce restitution (vertical speed kept, initially `restitution`) from the
+        bounces seen; each is the median of its last `estimates` estimates.
+        Predictions forward-simulate the fitted state for up to horizon seconds,
+        sampled every `step` seconds, bouncing off the table (a TableGeometry, or
+        None for no table).
+        
+        Each prediction rolls out `rollouts` candidate futures at once, drawn from
+        the uncertainty of the fitted position, velocity and restitution; the
+        intersection is their median, and intersection_spread the standard
+        deviation of their crossing x (intersection_spreads per level for
+        predict_intersections()).
+        """
+        super().__init__(frame_width=frame_width)
+        self.frame_height = frame_height
+        self.table = table
+        self.restitution = restitution
+        self.rollouts = rollouts
+        self.horizon = horizon
+        self.step = step
+        self.min_bounce_speed = min_bounce_speed
+        
+        self.gravity = None  # Estimated gravity (pixels/s^2, downwards), None until first estimated
+        self.drag = 0.0  # Estimated drag coefficient: deceleration = drag * speed^2
+        self.bounces = 0  # Bounces seen in the history so far
+        self.state = None  # Fitted (x, y, vx, vy) at the newest sample
+        self.intersection_spread = None  # Std of the candidates' crossing x in the last prediction
+        self.intersection_spreads = None  # The same per level, from predict_intersections()
+        
+        self._gravity_estimates = deque(maxlen=estimates)
+        self._drag_estimates = deque(maxlen=estimates)
+        self._restitution_estimates = deque(maxlen=estimates)
+        self._state_std = np.zeros(4)  # Standard deviation of the fitted state
+        self._radius = 0.0  # Ball radius at the newest sample
+        self._last_bounce_time = -np.inf  # Timestamp of the newest bounce used for the restitution
+        
+        # Fixed draws for the candidate futures, so predictions are repeatable; the
+        # first candidate is the fitted state itself
+        self._draws = np.random.default_rng(seed).standard_normal((5, rollouts))
+        self._draws[:, 0] = 0
+    
+    def resize(self, frame_width, frame_height):
+        super().resize(frame_width, frame_height)
+        self.frame_height = frame_height
+    
+    def fit_trajectory(self, positions):
+        """
+        Fit the motion since the last bounce in positions and update the gravity,
+        drag and restitution estimates.
+        """
+        if len(positions) < self.min_points:
+            return False
+        
+        xy = as_xy(positions)
+        now = as_times(positions)[-1]
+        times = as_times(positions) - now
+        self._radius = float(positions.radii()[-1]) if isinstance(positions, PositionHistory) else 0.0
+        
+        bounces, starts = self._find_splits(xy, times)
+        start = starts[-1]
+        if len(bounces):
+            self._update_restitution(xy, times, bounces, starts, now)
+        
+        # Right after a bounce only a couple of samples describe the new motion; with
+        # gravity known, they are enough for the position and velocity
+        known = self.gravity is not None
+        if len(times) - start < (2 if known else 3):
+            return False
+        samples = len(times) - start
+        fit = self._fit_segment(times[start:], xy[start:], free=samples >= self.min_points or not known)
+        if fit is None:
+            return False
+        params, std = fit
+        if samples >= self.min_points:
+            self._update_gravity(times[start:], params)
+        
+        self.x_params, self.y_params = params[:, 0], params[:, 1]
+        self.trajectory_model = (self.x_params, self.y_params)
+        self.state = np.array([params[2, 0], params[2, 1], params[1, 0], params[1, 1]])
+        self._state_std = std
+        return True
+    
+    def _find_splits(self, xy, times):
+        """
+        Find the bounces, samples at which the ball stopped going down and started
+        going up (screen y grows downwards), both faster than min_bounce_speed, and
+        the jumps, steps several times longer than usual (the ball was lost and
+        another one found).
+        Returns (bounce indices, start indices of the segments between splits).
+        """
+        steps = np.diff(xy, axis=0)
+        intervals = np.diff(times)
+        vy = np.divide(steps[:, 1], intervals, out=np.zeros(len(steps)), where=intervals > 0)
+        down = vy[:-1] > self.min_bounce_speed
+        up = vy[1:] < -self.min_bounce_speed
+        lengths = np.hypot(steps[:, 0], steps[:, 1])
+        jumped = lengths > 4 * np.sort(lengths)[len(lengths) // 2] + 20
+        jumps = np.flatnonzero(jumped) + 1
+        # A jump up right after the ball went down is not a bounce
+        bounces = np.flatnonzero(down & up & ~jumped[1:]) + 1
+        split = np.zeros(len(xy), bool)
+        split[0] = True
+        split[bounces + 1] = True
+        split[jumps] = True
+        return bounces, np.flatnonzero(split)
+    
+    def _fit_segment(self, times, xy, free=True):
+        """
+        Fit a quadratic in time to x and y, with t=0 at the newest sample. With
+        free=False the acceleration is not fitted but set to the estimated gravity
+        (without drag), so two samples are enough.
+        Returns (params (3, 2) as in trajectory_model, standard deviation of the
+        fitted (x, y, vx, vy)), or None.
+        """
+        if free:
+            vander = np.vander(times, 3)
+            targets = xy
+        else:
+            vander = np.vander(times, 2)
+            targets = xy - np.outer(0.5 * self.gravity * times * times, (0, 1))
+        try:
+            params, residuals, rank, _ = np.linalg.lstsq(vander, targets, rcond=None)
+            if rank < vander.shape[1]:
+                return None
+            inverse = np.linalg.inv(vander.T @ vander)
+        except np.linalg.LinAlgError:
+            return None
+        
+        # Residual noise per axis, at least a pixel (too few samples to measure it otherwise)
+        dof = len(times) - vander.shape[1]
+        variance = residuals / dof if dof > 0 and len(residuals) else np.zeros(2)
+        variance = np.maximum(variance, 1.0)
+        # The position and velocity at t=0 are the last two parameters
+        std = np.sqrt(np.concatenate([variance * inverse[-1, -1], variance * inverse[-2, -2]]))
+        
+        if not free:
+            params = np.vstack([(0.0, 0.5 * self.gravity), params])
+        return params, std
+    
+    def _update_gravity(self, times, params):
+        """
+        Add gravity and drag estimates from a free quadratic fit: its acceleration
+        a is gravity minus drag * |v| * v at the segment's middle.
+        """
+        acceleration = 2 * params[0]
+        velocity = acceleration * times.mean() + params[1]
+        speed = np.hypot(*velocity)
+        
+        # Drag is only observable from the horizontal slowdown of a ball that moves sideways
+        drag = self.drag
+        if speed > 0 and abs(velocity[0]) > 0.25 * speed:
+            drag = min(max(-acceleration[0] / (speed * velocity[0]), 0.0), 0.01)
+        gravity = acceleration[1] + drag * speed * velocity[1]
+        
+        # Medians, as short fits right after a bounce can be far off
+        self._gravity_estimates.append(gravity)
+        self._drag_estimates.append(drag)
+        self.gravity = statistics.median(self._gravity_estimates)
+        self.drag = statistics.median(self._drag_estimates)
+    
+    def _update_restitution(self, xy, times, bounces, starts, now):
+        """
+        Add restitution estimates from the bounces with three samples on either
+        side, from the vertical speeds just before and after each. Both sides are
+        fitted with the estimated gravity, so they are parabolas of the same shape
+        and meet at a single time, the bounce. now is the timestamp of t=0, to
+        recognize the bounces already used.
+        """
+        if self.gravity is None:
+            return
+        gravity = self.gravity
+        ends = np.append(starts[1:], len(times))
+        for bounce in bounces:
+            if now + times[bounce] <= self._last_bounce_time:
+                continue
+            # The segments ending at and starting right after the bounce
+            segment = np.searchsorted(starts, bounce, side="right") - 1
+            before = slice(starts[segment], bounce + 1)
+            after = slice(bounce + 1, ends[segment + 1])
+            if before.stop - before.start < 3 or after.stop - after.start < 3:
+                continue
+            
+            # y - g/2 t^2 is linear in t on either side: (speed at t=0, height at t=0)
+            sides = [np.polyfit(times[side], xy[side, 1] - 0.5 * gravity * times[side] ** 2, 1)
+                     for side in (before, after)]
+            (b_in, c_in), (b_out, c_out) = sides
+            t = (c_out - c_in) / (b_in - b_out) if b_in != b_out else np.nan
+            if times[bounce - 1] <= t <= times[bounce + 1]:
+                speed_in, speed_out = b_in + gravity * t, b_out + gravity * t
+                if speed_in > 0 and speed_out < 0:
+                    self._restitution_estimates.append(min(-speed_out / speed_in, 1.0))
+                    self.restitution = statistics.median(self._restitution_estimates)
+            self.bounces += 1
+            self._last_bounce_time = now + times[bounce]
+    
+    def _candidates(self):
+        """
+        Return the candidate futures' initial (x, y, vx, vy) and restitution, each an
+        array over the rollouts.
+        """
+        draws = self._draws
+        x, y, vx, vy = (self.state[:, None] + self._state_std[:, None] * draws[:4]).copy()
+        restitution = np.clip(self.restitution + 0.05 * draws[4], 0.0, 1.0)
+        return x, y, vx, vy, restitution
+    
+    def _flight(self, x, y, vx, vy, tau):
+        """
+        Closed-form flight of candidates from (x, y, vx, vy) (arrays over the
+        candidates) after tau seconds (an array broadcasting with them), under
+        gravity and drag. The quadratic drag is linearized at the starting speed,
+        which holds over the fraction of a second between bounces.
+        Returns (x, y, vx, vy) at tau.
+        """
+        gravity = self.gravity if self.gravity is not None else 2 * self.y_params[0]
+        damping = self.drag * np.hypot(vx, vy)
+        if not self.drag:
+            # Plain ballistic flight
+            return x + vx * tau, y + vy * tau + 0.5 * gravity * tau * tau, vx, vy + gravity * tau
+        
+        # With dv/dt = g - c*v: F = (1 - e^(-c*tau)) / c and G = (tau - F) / c, both
+        # continued to their limits tau and tau^2 / 2 as c -> 0
+        damping = np.maximum(damping, 1e-6)
+        decay = np.exp(-damping * tau)
+        f = (1 - decay) / damping
+        g = (tau - f) / damping
+        return x + vx * f, y + vy * f + gravity * g, vx * decay, vy * decay + gravity * f
+    
+    def _simulate(self, x, y, vx, vy, restitution, y_levels=(), duration=None, max_bounces=3):
+        """
+        Roll out the candidates from their (x, y, vx, vy) (arrays over the
+        candidates) for duration seconds (default: the horizon), all at once: the
+        flight is evaluated on a grid of steps x candidates, and candidates that
+        reach the table are restarted from their bounce, up to max_bounces times.
+        Returns (times, x, y, crossing_x, crossing_t): the step times, the (steps,
+        candidates) positions and, for each level in y_levels, where and when each
+        candidate first crosses it (NaN where it does not).
+        """
+        duration = self.horizon if duration is None else duration
+        times = np.arange(int(np.ceil(duration / self.step)) + 1) * self.step
+        grid = times[:, None]
+        origin = np.zeros(len(x))  # Start time of each candidate's current flight
+        path_x, path_y, _, _ = self._flight(x, y, vx, vy, grid)
+        
+        table = self.table
+        if table is not None:
+            # Bounce when the bottom of the ball reaches the surface
+            surface = table.y * self.frame_height
+            contact = surface - self._radius
+            left, right = table.left * self.frame_width, table.right * self.frame_width
+            candidates = np.arange(len(x))
+            for _ in range(max_bounces):
+                # First step each candidate goes down to the contact height above the
+                # table (from anywhere above the surface, as the measured radius is rough)
+                through = ((path_y[:-1] < surface) & (path_y[1:] >= contact) & (path_y[1:] > path_y[:-1])
+                           & (path_x[1:] >= left) & (path_x[1:] <= right) & (grid[1:] > origin))
+                bounced = through.any(axis=0)
+                if not bounced.any():
+                    break
+                first = through.argmax(axis=0)[bounced]
+                index = candidates[bounced]
+                
+                # Bounce time within the step, then the state there, reflected
+                y0, y1 = path_y[first, index], path_y[first + 1, index]
+                t_bounce = times[first] + np.clip((contact - y0) / (y1 - y0), 0, 1) * self.step
+                bx, _, bvx, bvy = self._flight(x[index], y[index], vx[index], vy[index], t_bounce - origin[index])
+                x[index], y[index], vx[index], vy[index] = bx, contact, bvx, -restitution[index] * bvy
+                origin[index] = t_bounce
+                
+                # Re-evaluate the bounced candidates from their bounce onwards
+                after = grid >= t_bounce
+                new_x, new_y, _, _ = self._flight(x[index], y[index], vx[index], vy[index], grid - t_bounce)
+                path_x[:, index] = np.where(after, new_x, path_x[:, index])
+                path_y[:, index] = np.where(after, new_y, path_y[:, index])
+        
+        # First step through each level, interpolated within the step
+        levels = np.asarray(y_levels, np.float64).reshape(-1, 1, 1)
+        offset = path_y - levels
+        through = (offset[:, :-1] * offset[:, 1:] <= 0) & (offset[:, :-1] != offset[:, 1:])
+        crossed = through.any(axis=1)
+        first = through.argmax(axis=1)
+        rows, candidates = np.arange(len(levels))[:, None], np.arange(len(x))
+        y0, y1 = offset[rows, first, candidates], offset[rows, first + 1, candidates]
+        fraction = y0 / (y0 - np.where(crossed, y1, y0 - 1))
+        crossing_t = np.where(crossed, times[first] + fraction * self.step, np.nan)
+        crossing_x = np.where(crossed, path_x[first, candidates]
+                              + fraction * (path_x[first + 1, candidates] - path_x[first, candidates]), np.nan)
+        return times, path_x, path_y, crossing_x, crossing_t
+    
+    def predict_position(self, time_ahead):
+        positions = self.predict_positions([time_ahead])
+        if positions is None:
+            return None
+        return int(positions[0, 0]), int(positions[0, 1])
+    
+    def predict_positions(self, times_ahead):
+        """
+        Predict the ball positions at an array of times (seconds after the newest
+        sample) by simulating the fitted state through any bounces.
+        Returns an (n, 2) float array, or None without a trajectory.
+        """
+        if self.trajectory_model is None:
+            return None
+        times_ahead = np.atleast_1d(np.asarray(times_ahead, dtype=np.float64))
+        x, y, vx, vy = (np.array([v]) for v in self.state)
+        duration = max(float(times_ahead.max(initial=0.0)), self.step)
+        times, path_x, path_y, _, _ = self._simulate(x, y, vx, vy, np.array([self.restitution]), duration=duration)
+        
+        positions = np.empty((len(times_ahead), 2))
+        positions[:, 0] = np.interp(times_ahead, times, path_x[:, 0])
+        positions[:, 1] = np.interp(times_ahead, times, path_y[:, 0])
+        return positions
+    
+    def predict_intersection(self, y_level):
+        """
+        Predict where the ball will cross the horizontal line at y_level (e.g. the
+        paddle), through any table bounces on the way.
+        Returns (x_intersection, time_to_intersection in milliseconds) or None if
+        fewer than half of the candidate futures reach it within the horizon.
+        """
+        result = self.predict_intersections([y_level])
+        if result is None:
+            return None
+        self.intersection_spread = self.intersection_spreads[0]
+        x_intersection, time_to_intersection = result
+        if np.isnan(x_intersection[0]):
+            return None
+        return int(x_intersection[0]), float(time_to_intersection[0])
+    
+    def predict_intersections(self, y_levels):
+        """
+        Predict where the ball will cross each horizontal line in an array of y
+        levels, rolling out all candidate futures at once.
+        Returns (x_intersections, times_to_intersection in milliseconds) arrays, with
+        NaN for levels fewer than half of the candidates reach, or None without a
+        trajectory.
+        """
+        if self.trajectory_model is None:
+            return None
+        _, _, _, crossing_x, crossing_t = self._simulate(*self._candidates(), y_levels=y_levels)
+        
+        x_intersection = np.full(len(crossing_t), np.nan)
+        time_to_intersection = np.full(len(crossing_t), np.nan)
+        spread = np.full(len(crossing_t), np.nan)
+        for level, (xs, ts) in enumerate(zip(crossing_x, crossing_t)):
+            reached = ~np.isnan(ts)
+            if np.count_nonzero(reached) * 2 < len(ts):
+                continue
+            xs = xs[reached]
+            x_intersection[level] = min(max(np.median(xs), 0), self.frame_width)
+            time_to_intersection[level] = np.median(ts[reached]) * 1000.0
+            spread[level] = xs.std()
+        self.intersection_spreads = spread
+        return x_intersection, time_to_intersection
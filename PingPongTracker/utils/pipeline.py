@@ -0,0 +1,220 @@
+import threading
+import time
+from collections import deque
+
+import cv2
+
+
+class FrameQueue:
+    def __init__(self, maxsize=2, drop_stale=True):
+        """
+        Bounded queue linking two pipeline stages.
+        With drop_stale=True a full queue discards its oldest item on put(), so the
+        consumer always gets the newest frame. Otherwise put() blocks until there is room.
+        """
+        self.maxsize = maxsize
+        self.drop_stale = drop_stale
+        self.dropped = 0  # Number of items discarded because the queue was full
+        self._items = deque()
+        self._closed = False
+        self._cond = threading.Condition()
+    
+    def put(self, item):
+        """
+        Add an item. Returns False if the queue has been closed.
+        """
+        with self._cond:
+            while len(self._items) >= self.maxsize and not self._closed:
+                if self.drop_stale:
+                    self._items.popleft()
+                    self.dropped += 1
+                else:
+                    self._cond.wait()
+            if self._closed:
+                return False
+            self._items.append(item)
+            self._cond.notify_all()
+            return True
+    
+    def get(self, timeout=None):
+        """
+        Remove and return the oldest item.
+        Returns None if the queue is closed and empty, or on timeout.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._items or self._closed, timeout):
+                return None
+            if not self._items:
+                return None
+            item = self._items.popleft()
+            self._cond.notify_all()
+            return item
+    
+    def close(self):
+        """
+        Wake up all waiting producers and consumers; further puts are rejected.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+    
+    def qsize(self):
+        with self._cond:
+            return len(self._items)
+
+
+class StageStats:
+    def __init__(self, name):
+        """
+        Frame counter for one pipeline stage, used to report its throughput.
+        """
+        self.name = name
+        self.frames = 0
+        self._lock = threading.Lock()
+        self._last_frames = 0
+        self._last_time = time.perf_counter()
+    
+    def tick(self):
+        with self._lock:
+            self.frames += 1
+    
+    def fps(self):
+        """
+        Return the frame rate since the previous call.
+        """
+        with self._lock:
+            now = time.perf_counter()
+            elapsed = now - self._last_time
+            fps = (self.frames - self._last_frames) / elapsed if elapsed > 0 else 0.0
+            self._last_frames = self.frames
+            self._last_time = now
+            return fps
+
+
+class FramePipeline:
+    def __init__(self, cap, session, queue_size=1, drop_stale=True, flip=True, on_result=None):
+        """
+        Run capture and detection on background threads, linked to the render stage
+        by bounded queues:
+            
+            capture -> [capture_queue] -> detect -> [render_queue] -> render
+        
+        cap is an opened cv2.VideoCapture (or anything with read()), session a
+        GameSession. Rendering runs on the calling thread because cv2.imshow must.
+        on_result(frame, result, timestamp) is called on the detection thread after
+        each frame, while the session still holds that frame's state.
+        """
+        self.cap = cap
+        self.session = session
+        self.flip = flip
+        self.on_result = on_result
+        self.capture_queue = FrameQueue(queue_size, drop_stale)
+        self.render_queue = FrameQueue(queue_size, drop_stale)
+        self.stats = {name: StageStats(name) for name in ("capture", "detect", "render")}
+        self.error = None
+        self._stop = threading.Event()
+        self._threads = []
+    
+    def start(self):
+        """
+        Start the capture and detection threads.
+        """
+        self._threads = [
+            threading.Thread(target=self._capture_loop, name="capture", daemon=True),
+            threading.Thread(target=self._detect_loop, name="detect", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+    
+    def stop(self):
+        """
+        Stop all stages and wait for the background threads to finish.
+        """
+        self._stop.set()
+        self.capture_queue.close()
+        self.render_queue.close()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+    
+    def run(self, render):
+        """
+        Run the render stage on the calling thread until
+        render(frame, result, timestamp) returns False or the capture stage runs out of frames.
+        """
+        self.start()
+        try:
+            while not self._stop.is_set():
+                item = self.render_queue.get(timeout=0.1)
+                if item is None:
+                    if self._detect_done():
+                        break
+                    continue
+                frame, result, timestamp = item
+                keep_going = render(frame, result, timestamp)
+                self.stats["render"].tick()
+                if keep_going is False:
+                    break
+        finally:
+            self.stop()
+    
+    def report(self):
+        """
+        Return a one-line summary of per-stage FPS and queue depths.
+        """
+        fps = " ".join(f"{name}={stats.fps():.1f}" for name, stats in self.stats.items())
+        return (f"FPS {fps} | queues capture={self.capture_queue.qsize()} "
+                f"(dropped {self.capture_queue.dropped}) "
+                f"render={self.render_queue.qsize()} (dropped {self.render_queue.dropped})")
+    
+    def _detect_done(self):
+        return len(self._threads) > 1 and not self._threads[1].is_alive()
+    
+    def _capture_loop(self):
+        profiler = self.session.profiler
+        try:
+            while not self._stop.is_set():
+                with profiler.stage("capture"):
+                    success, frame = self.cap.read()
+                # When the frame was captured (grabbed, for a LatestFrameGrabber)
+                timestamp = self.cap.timestamp
+                if not success:
+                    print("Error: Could not read frame.")
+                    break
+                
+                # Flip the frame horizontally (in place) for a more intuitive view
+                if self.flip:
+                    with profiler.stage("flip"):
+                        frame = cv2.flip(frame, 1, dst=frame)
+                
+                profiler.end_frame()
+                self.stats["capture"].tick()
+                if not self.capture_queue.put((frame, timestamp)):
+                    break
+        except Exception as e:
+            self.error = e
+            print(f"Capture stage error: {e}")
+        finally:
+            self.capture_queue.close()
+    
+    def _detect_loop(self):
+        try:
+            while not self._stop.is_set():
+                item = self.capture_queue.get()
+                if item is None:
+                    break
+                frame, timestamp = item
+                
+                # Use the capture time, so queueing delays do not distort the trajectory
+                result = self.session.update(frame, timestamp)
+                if self.on_result is not None:
+                    self.on_result(frame, result, timestamp)
+                self.session.profiler.end_frame()
+                self.stats["detect"].tick()
+                if not self.render_queue.put((frame, result, timestamp)):
+                    break
+        except Exception as e:
+            self.error = e
+            print(f"Detection stage error: {e}")
+        finally:
+            self.render_queue.close()
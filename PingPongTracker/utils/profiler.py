@@ -0,0 +1,182 @@
+import contextlib
+import json
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+
+class _StageTimer:
+    __slots__ = ("profiler", "name", "start")
+    
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc):
+        self.profiler.add(self.name, (time.perf_counter() - self.start) * 1e3)
+        return False
+
+
+class StageProfiler:
+    enabled = True
+    
+    def __init__(self, window=300, export_path=None, export_interval=10.0):
+        """
+        Per-stage latency instrumentation.
+        
+        Wrap each stage in `with profiler.stage("name"):`. Times of repeated calls
+        within a frame are summed, and end_frame() adds the per-frame totals to a
+        rolling window of the last `window` frames, from which p50/p95/p99 are
+        computed. Each thread accumulates its own frame, so pipeline stages on
+        different threads can share one profiler. If export_path is given, the
+        summary is appended to it as a JSON line every export_interval seconds.
+        """
+        self.window = window
+        self.export_path = export_path
+        self.export_interval = export_interval
+        self._samples = {}  # Stage name -> deque of per-frame milliseconds
+        self._counters = {}  # Event name -> count
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._last_export = time.perf_counter()
+    
+    def stage(self, name):
+        """
+        Return a context manager that times the enclosed block as stage name.
+        """
+        return _StageTimer(self, name)
+    
+    def add(self, name, ms):
+        """
+        Add ms milliseconds to stage name for the current frame of this thread.
+        """
+        pending = getattr(self._local, "pending", None)
+        if pending is None:
+            pending = self._local.pending = {}
+        pending[name] = pending.get(name, 0.0) + ms
+    
+    def count(self, name, n=1):
+        """
+        Increment the event counter name (e.g. errors).
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+    
+    def end_frame(self):
+        """
+        Close this thread's current frame and, if due, export the summary.
+        """
+        pending = getattr(self._local, "pending", None)
+        if pending:
+            with self._lock:
+                for name, ms in pending.items():
+                    samples = self._samples.get(name)
+                    if samples is None:
+                        samples = self._samples[name] = deque(maxlen=self.window)
+                    samples.append(ms)
+            pending.clear()
+        
+        if self.export_path:
+            # Check and claim the export under the lock, so only one thread exports
+            now = time.perf_counter()
+            with self._lock:
+                due = now - self._last_export >= self.export_interval
+                if due:
+                    self._last_export = now
+            if due:
+                self._write_summary()
+    
+    def summary(self):
+        """
+        Return {stage: {"mean", "p50", "p95", "p99", "max", "count"}} in milliseconds,
+        plus the event counters under "counters".
+        """
+        with self._lock:
+            samples = {name: np.fromiter(values, np.float64, len(values))
+                       for name, values in self._samples.items() if values}
+            counters = dict(self._counters)
+        
+        stages = {}
+        for name, values in samples.items():
+            p50, p95, p99 = np.percentile(values, (50, 95, 99))
+            stages[name] = {
+                "mean": float(values.mean()),
+                "p50": float(p50),
+                "p95": float(p95),
+                "p99": float(p99),
+                "max": float(values.max()),
+                "count": int(values.size),
+            }
+        return {"stages": stages, "counters": counters}
+    
+    def report(self):
+        """
+        Return a multi-line text table of the per-stage percentiles.
+        """
+        summary = self.summary()
+        lines = [f"{'stage':<16}{'p50':>8}{'p95':>8}{'p99':>8}  ms"]
+        for name, stats in summary["stages"].items():
+            lines.append(f"{name:<16}{stats['p50']:8.2f}{stats['p95']:8.2f}{stats['p99']:8.2f}")
+        for name, value in summary["counters"].items():
+            lines.append(f"{name}: {value}")
+        return "\n".join(lines)
+    
+    def draw_overlay(self, frame):
+        """
+        Draw the per-stage p50/p95/p99 table in the top-right corner of the frame.
+        """
+        lines = self.report().split("\n")
+        x = max(0, frame.shape[1] - 330)
+        for i, line in enumerate(lines):
+            cv2.putText(frame, line, (x, 20 + 16 * i), cv2.FONT_HERSHEY_PLAIN, 1, (255, 255, 0), 1)
+        return frame
+    
+    def export(self):
+        """
+        Append the current summary to export_path as one JSON line.
+        """
+        with self._lock:
+            self._last_export = time.perf_counter()
+        self._write_summary()
+    
+    def _write_summary(self):
+        record = {"time": time.time(), **self.summary()}
+        try:
+            with open(self.export_path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+        except OSError as e:
+            print(f"Profile export error: {e}")
+
+
+class NullProfiler:
+    """
+    Profiler that does nothing, used when instrumentation is off.
+    """
+    enabled = False
+    _timer = contextlib.nullcontext()
+    
+    def stage(self, name):
+        return self._timer
+    
+    def add(self, name, ms):
+        pass
+    
+    def count(self, name, n=1):
+        pass
+    
+    def end_frame(self):
+        pass
+    
+    def draw_overlay(self, frame):
+        return frame
+
+
+# Shared default for components created without a profiler
+NULL_PROFILER = NullProfiler()
@@ -0,0 +1,297 @@
+import asyncio
+import base64
+import hashlib
+import json
+import threading
+from collections import deque
+
+import cv2
+
+from utils.batch import result_to_record
+
+# Magic value of the WebSocket handshake (RFC 6455)
+_WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+_MJPEG_BOUNDARY = "frame"
+
+
+class _ClientQueue:
+    def __init__(self, server, maxsize):
+        """
+        Per-client outgoing queue, only used on the event loop thread.
+        When full, the oldest message is dropped (and counted in server.dropped),
+        so a slow client never holds up the others.
+        """
+        self._server = server
+        self._items = deque()
+        self._maxsize = maxsize
+        self._ready = asyncio.Event()
+    
+    def put(self, item):
+        if len(self._items) >= self._maxsize:
+            self._items.popleft()
+            self._server.dropped += 1
+        self._items.append(item)
+        self._ready.set()
+    
+    async def get(self):
+        while not self._items:
+            self._ready.clear()
+            await self._ready.wait()
+        return self._items.popleft()
+
+
+class ResultServer:
+    def __init__(self, host="127.0.0.1", port=8765, http_port=8766, mjpeg=False, queue_size=2,
+                 jpeg_quality=80):
+        """
+        Publish per-frame tracking results to any number of local clients:
+            
+            port       raw TCP, one JSON record per line (e.g. `nc localhost 8765`)
+            http_port  WebSocket at /ws (one JSON record per text message) and,
+                       with mjpeg=True, the annotated video as MJPEG at /mjpeg
+        
+        The server runs its own asyncio event loop on a background thread. publish()
+        only hands the result over to that loop, so the tracker is never blocked by
+        the network: each client has a queue of queue_size messages, and a client
+        that falls behind loses its oldest messages instead of slowing anyone down.
+        Pass port/http_port 0 to pick free ports (see the attributes after start()),
+        or None to disable that listener.
+        """
+        self.host = host
+        self.port = port
+        self.http_port = http_port
+        self.mjpeg = mjpeg
+        self.queue_size = queue_size
+        self.jpeg_quality = jpeg_quality
+        self.published = 0  # Results handed to the server
+        self.dropped = 0  # Messages discarded because a client fell behind
+        
+        self._loop = None
+        self._thread = None
+        self._servers = []
+        self._result_clients = set()  # _ClientQueue of every TCP and WebSocket client
+        self._mjpeg_clients = set()
+        self._latest_frame = None  # Newest annotated frame waiting to be encoded
+        self._frame_ready = None
+        self._encoder = None
+        self._stopped = None
+    
+    def start(self):
+        """
+        Start listening; returns once the ports are bound.
+        """
+        ready = threading.Event()
+        errors = []
+        
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            try:
+                self._loop.run_until_complete(self._start_servers())
+            except OSError as e:
+                errors.append(e)
+                ready.set()
+                return
+            ready.set()
+            self._loop.run_until_complete(self._stopped.wait())
+            for server in self._servers:
+                server.close()
+            self._loop.run_until_complete(self._shutdown())
+            self._loop.close()
+        
+        self._thread = threading.Thread(target=run, name="result-server", daemon=True)
+        self._thread.start()
+        ready.wait()
+        if errors:
+            self._thread.join()
+            raise errors[0]
+    
+    def stop(self):
+        """
+        Close all connections and stop the event loop thread.
+        """
+        if self._thread is None:
+            return
+        self._loop.call_soon_threadsafe(self._stopped.set)
+        self._thread.join()
+        self._thread = None
+    
+    def clients(self):
+        """
+        Return the number of connected (result, MJPEG) clients.
+        """
+        return len(self._result_clients), len(self._mjpeg_clients)
+    
+    def publish(self, frame_index, result, frame=None, timestamp=None):
+        """
+        Send a FrameResult to all clients; frame is the annotated image for MJPEG clients.
+        Safe to call from any thread and never blocks on the network.
+        """
+        if self._thread is None:
+            return
+        record = result_to_record(frame_index, result)
+        record["timestamp"] = timestamp
+        message = json.dumps(record)
+        
+        # Only copy the frame when someone is watching the video
+        if frame is not None and self._mjpeg_clients:
+            frame = frame.copy()
+        else:
+            frame = None
+        self.published += 1
+        self._loop.call_soon_threadsafe(self._dispatch, message, frame)
+    
+    def _dispatch(self, message, frame):
+        for client in self._result_clients:
+            client.put(message)
+        if frame is not None:
+            # Only the newest frame is encoded; older unencoded ones are skipped
+            self._latest_frame = frame
+            self._frame_ready.set()
+    
+    async def _start_servers(self):
+        self._stopped = asyncio.Event()
+        self._frame_ready = asyncio.Event()
+        if self.port is not None:
+            server = await asyncio.start_server(self._handle_tcp, self.host, self.port)
+            self.port = server.sockets[0].getsockname()[1]
+            self._servers.append(server)
+        if self.http_port is not None:
+            server = await asyncio.start_server(self._handle_http, self.host, self.http_port)
+            self.http_port = server.sockets[0].getsockname()[1]
+            self._servers.append(server)
+        if self.mjpeg:
+            self._encoder = asyncio.ensure_future(self._encode_frames())
+    
+    async def _shutdown(self):
+        # Stop the per-client tasks first; wait_closed() waits for their connections
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for server in self._servers:
+            await server.wait_closed()
+    
+    async def _encode_frames(self):
+        """
+        Encode the newest annotated frame for the MJPEG clients, off the event loop.
+        """
+        params = [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality]
+        while True:
+            await self._frame_ready.wait()
+            self._frame_ready.clear()
+            frame, self._latest_frame = self._latest_frame, None
+            if frame is None or not self._mjpeg_clients:
+                continue
+            success, jpeg = await self._loop.run_in_executor(None, cv2.imencode, ".jpg", frame, params)
+            if not success:
+                continue
+            part = (f"--{_MJPEG_BOUNDARY}\r\nContent-Type: image/jpeg\r\n"
+                    f"Content-Length: {len(jpeg)}\r\n\r\n").encode() + jpeg.tobytes() + b"\r\n"
+            for client in self._mjpeg_clients:
+                client.put(part)
+    
+    async def _stream(self, writer, queue, clients, encode=None):
+        """
+        Write a client's queued messages until it disconnects.
+        """
+        clients.add(queue)
+        try:
+            while True:
+                message = await queue.get()
+                writer.write(encode(message) if encode else message)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            clients.discard(queue)
+            writer.close()
+    
+    async def _handle_tcp(self, reader, writer):
+        queue = _ClientQueue(self, self.queue_size)
+        stream = asyncio.ensure_future(
+            self._stream(writer, queue, self._result_clients, lambda message: message.encode() + b"\n"))
+        # The client has nothing to say; reading only detects when it goes away
+        await self._wait_closed(reader, stream)
+    
+    async def _handle_http(self, reader, writer):
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+        lines = request.decode("latin-1").split("\r\n")
+        parts = lines[0].split()
+        path = parts[1] if len(parts) > 1 else ""
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        
+        if path == "/ws" and "sec-websocket-key" in headers:
+            accept = base64.b64encode(
+                hashlib.sha1((headers["sec-websocket-key"] + _WEBSOCKET_GUID).encode()).digest()).decode()
+            writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                          f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode())
+            queue = _ClientQueue(self, self.queue_size)
+            stream = asyncio.ensure_future(self._stream(writer, queue, self._result_clients, _websocket_frame))
+            await self._wait_closed(reader, stream, websocket=True)
+        elif path == "/mjpeg" and self.mjpeg:
+            writer.write(("HTTP/1.0 200 OK\r\nCache-Control: no-cache\r\n"
+                          f"Content-Type: multipart/x-mixed-replace; boundary={_MJPEG_BOUNDARY}\r\n\r\n").encode())
+            queue = _ClientQueue(self, 1)
+            stream = asyncio.ensure_future(self._stream(writer, queue, self._mjpeg_clients))
+            await self._wait_closed(reader, stream)
+        else:
+            writer.write(b"HTTP/1.0 404 Not Found\r\nContent-Length: 0\r\n\r\n")
+            await writer.drain()
+            writer.close()
+    
+    async def _wait_closed(self, reader, stream, websocket=False):
+        """
+        Read from a client until it disconnects (or, for WebSockets, sends a close
+        frame), then stop its stream.
+        """
+        try:
+            while not stream.done():
+                if websocket:
+                    if await _read_websocket_frame(reader) == 0x8:
+                        break
+                elif not await reader.read(4096):
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            # Cancelled when the server stops; end the handler quietly
+            pass
+        finally:
+            stream.cancel()
+
+
+def _websocket_frame(message):
+    """
+    Encode a text message as an unmasked WebSocket frame.
+    """
+    payload = message.encode()
+    length = len(payload)
+    if length < 126:
+        header = bytes((0x81, length))
+    elif length < 1 << 16:
+        header = bytes((0x81, 126)) + length.to_bytes(2, "big")
+    else:
+        header = bytes((0x81, 127)) + length.to_bytes(8, "big")
+    return header + payload
+
+
+async def _read_websocket_frame(reader):
+    """
+    Read and discard one frame sent by a WebSocket client. Returns its opcode.
+    """
+    first, second = await reader.readexactly(2)
+    length = second & 0x7F
+    if length == 126:
+        length = int.from_bytes(await reader.readexactly(2), "big")
+    elif length == 127:
+        length = int.from_bytes(await reader.readexactly(8), "big")
+    if second & 0x80:
+        length += 4  # Masking key
+    await reader.readexactly(length)
+    return first & 0x0F
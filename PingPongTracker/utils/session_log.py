@@ -0,0 +1,280 @@
+import glob
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from utils.history import PositionHistory
+
+LOG_VERSION = 1
+
+# Per-frame columns: name -> (dtype, trailing shape)
+FRAME_COLUMNS = {
+    "timestamp": (np.float64, ()),
+    "detected": (np.bool_, ()),
+    "ball": (np.int32, (3,)),  # x, y, radius (zero when not detected)
+    "kalman": (np.float32, (4,)),  # x, y, vx, vy (NaN before the filter is initialized)
+    "x_params": (np.float64, (3,)),  # Fitted trajectory, NaN when there is none
+    "y_params": (np.float64, (3,)),
+    "intersection": (np.float32, (2,)),  # Predicted x and milliseconds to the paddle, NaN when none
+    "prediction_point": (np.float32, (2,)),
+    "figure_x": (np.float32, ()),
+    "score": (np.int32, ()),
+    "misses": (np.int32, ()),
+    "event": (np.int8, ()),  # Index into EVENTS
+}
+
+# Position history samples, one row per sample added to the tracker's history
+SAMPLE_COLUMNS = {
+    "frame": np.int32,
+    "x": np.float32,
+    "y": np.float32,
+    "radius": np.float32,
+    "time": np.float64,
+    "measured": np.bool_,
+    "reset": np.bool_,  # The history was cleared before this sample
+}
+
+EVENTS = (None, "catch", "miss")
+
+
+class SessionRecorder:
+    def __init__(self, path, width=None, height=None, options=None, chunk_frames=1800, video=False, fps=30.0):
+        """
+        Record a tracking session to the directory path, for later replay.
+        
+        Every frame's detection, Kalman state, fitted trajectory, intercept, stick
+        figure position, score and event is kept in fixed-type NumPy columns, and
+        each sample added to the tracker's position history in a second table, so
+        the trajectory prediction and game logic can be replayed exactly. Every
+        chunk_frames frames the columns are written to a compressed .npz chunk on a
+        background thread; a frame costs ~25 µs and an hour at 30 FPS takes
+        about 10 MB. options (e.g. vars(args)) are stored in meta.json.
+        
+        video=True also writes the raw frames to video.avi (MJPG), on the same
+        background thread. Without width and height, the frame size is taken from
+        the first frame passed to record().
+        """
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.chunk_frames = chunk_frames
+        self.frames = 0  # Frames recorded so far
+        
+        self._frames = {name: np.zeros((chunk_frames,) + shape, dtype)
+                        for name, (dtype, shape) in FRAME_COLUMNS.items()}
+        self._samples = []
+        self._length = 0  # Frames in the current chunk
+        self._chunk = 0
+        self._seen = None  # (history, epoch, appended) when the history was last recorded
+        self._writer = ThreadPoolExecutor(max_workers=1)
+        self._pending = []
+        
+        self._video = None
+        self._meta = {
+            "version": LOG_VERSION,
+            "width": width,
+            "height": height,
+            "fps": fps,
+            "video": "video.avi" if video else None,
+            "options": _jsonable(options or {}),
+        }
+        if width is not None and height is not None:
+            self._open(width, height)
+    
+    def record(self, result, session, timestamp, frame=None):
+        """
+        Record a frame's FrameResult and the tracker state of session. Call right
+        after session.update(), before the next frame is processed.
+        """
+        if self._meta["width"] is None and frame is not None:
+            self._open(frame.shape[1], frame.shape[0])
+        
+        i = self._length
+        columns = self._frames
+        columns["timestamp"][i] = timestamp
+        columns["detected"][i] = result.ball_pos is not None
+        columns["ball"][i] = result.ball_pos or 0
+        
+        ball_tracker = session.ball_tracker
+        state = ball_tracker.kalman_state()
+        columns["kalman"][i] = np.nan if state is None else state
+        model = session.trajectory_predictor.trajectory_model
+        columns["x_params"][i], columns["y_params"][i] = (np.nan, np.nan) if model is None else model
+        columns["intersection"][i] = np.nan if result.intersection is None else result.intersection
+        columns["prediction_point"][i] = np.nan if result.prediction_point is None else result.prediction_point
+        columns["figure_x"][i] = result.figure_x
+        columns["score"][i] = result.score
+        columns["misses"][i] = result.misses
+        columns["event"][i] = EVENTS.index(result.event)
+        self._record_samples(ball_tracker.get_positions())
+        
+        if self._video is not None and frame is not None:
+            # Copy now, the frame array is reused and drawn on
+            self._pending.append(self._writer.submit(self._video.write, frame.copy()))
+        
+        self.frames += 1
+        self._length += 1
+        if self._length == self.chunk_frames:
+            self._flush()
+    
+    def close(self):
+        """
+        Write the remaining frames and wait for all writes to finish.
+        """
+        if self._length or self._samples:
+            self._flush()
+        self._writer.shutdown(wait=True)
+        for future in self._pending:
+            future.result()  # Raise write errors
+        if self._video is not None:
+            self._video.release()
+        self._meta["frames"] = self.frames
+        self._write_meta()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+    
+    def _open(self, width, height):
+        """
+        Write the metadata and start the video once the frame size is known.
+        """
+        self._meta["width"], self._meta["height"] = width, height
+        if self._meta["video"]:
+            self._video = cv2.VideoWriter(os.path.join(self.path, self._meta["video"]),
+                                          cv2.VideoWriter_fourcc(*"MJPG"), self._meta["fps"], (width, height))
+        self._write_meta()
+    
+    def _record_samples(self, positions):
+        """
+        Add the history samples appended since the last frame (all of them if the
+        history was cleared) to the sample table.
+        """
+        seen = self._seen
+        if seen is not None and seen[0] is positions and seen[1] == positions.epoch:
+            new = min(positions.appended - seen[2], len(positions))
+            reset = False
+        else:
+            new = len(positions)
+            reset = True
+        self._seen = (positions, positions.epoch, positions.appended)
+        if not new:
+            return
+        for k, (x, y, radius, time, measured) in enumerate(positions.samples()[-new:]):
+            self._samples.append((self.frames, x, y, radius, time, measured, reset and k == 0))
+    
+    def _flush(self):
+        columns = {name: values[:self._length].copy() for name, values in self._frames.items()}
+        samples = np.array(self._samples, dtype=[(name, dtype) for name, dtype in SAMPLE_COLUMNS.items()])
+        for name in SAMPLE_COLUMNS:
+            columns["sample_" + name] = samples[name]
+        columns["first_frame"] = np.int64(self.frames - self._length)
+        path = os.path.join(self.path, f"chunk_{self._chunk:06d}.npz")
+        self._pending.append(self._writer.submit(np.savez_compressed, path, **columns))
+        self._pending = [future for future in self._pending if not future.done() or future.exception()]
+        self._chunk += 1
+        self._length = 0
+        self._samples = []
+    
+    def _write_meta(self):
+        with open(os.path.join(self.path, "meta.json"), "w") as f:
+            json.dump(self._meta, f, indent=2)
+
+
+class SessionLog:
+    def __init__(self, path):
+        """
+        Load a session recorded by SessionRecorder: meta (dict), frames (column name
+        -> array over all frames) and samples (column name -> array over all
+        history samples).
+        """
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        chunks = [np.load(name) for name in sorted(glob.glob(os.path.join(path, "chunk_*.npz")))]
+        self.frames = {name: np.concatenate([chunk[name] for chunk in chunks]) if chunks
+                       else np.zeros((0,) + shape, dtype)
+                       for name, (dtype, shape) in FRAME_COLUMNS.items()}
+        self.samples = {name: np.concatenate([chunk["sample_" + name] for chunk in chunks]) if chunks
+                        else np.zeros(0, dtype)
+                        for name, dtype in SAMPLE_COLUMNS.items()}
+    
+    def __len__(self):
+        return len(self.frames["timestamp"])
+    
+    def video_path(self):
+        """
+        Return the path of the recorded video, or None.
+        """
+        return os.path.join(self.path, self.meta["video"]) if self.meta.get("video") else None
+
+
+class ReplayTracker:
+    def __init__(self, log, max_positions=10):
+        """
+        Stand-in for BallTracker that plays back a SessionLog's detections and
+        position history, so a GameSession built around it re-runs the trajectory
+        prediction, stick figure and scoring without any image processing.
+        Each detect_ball() call returns the next frame's detection; frames are ignored.
+        """
+        self.log = log
+        self.positions = PositionHistory(max_positions)
+        self.misses = 0
+        self.index = 0  # Next frame to play back
+        
+        frames = log.frames
+        self._detected = frames["detected"]
+        self._ball = frames["ball"]
+        samples = log.samples
+        self._samples = np.stack([samples["x"], samples["y"], samples["radius"], samples["time"],
+                                  samples["measured"]], axis=1).astype(np.float64)
+        self._reset = samples["reset"]
+        # Start of each frame's samples in the sample table
+        self._sample_starts = np.searchsorted(samples["frame"], np.arange(len(log) + 1))
+    
+    def detect_ball(self, frame=None, timestamp=None):
+        i = self.index
+        self.index += 1
+        positions = self.positions
+        for k in range(self._sample_starts[i], self._sample_starts[i + 1]):
+            if self._reset[k]:
+                positions.clear()
+            positions.append(*self._samples[k])
+        if not self._detected[i]:
+            return None
+        x, y, radius = self._ball[i].tolist()
+        return (x, y, radius)
+    
+    def get_positions(self):
+        return self.positions
+    
+    def get_tracks(self):
+        return ()
+    
+    def kalman_state(self):
+        state = self.log.frames["kalman"][self.index - 1]
+        return None if np.isnan(state[0]) else state
+
+
+def replay(log, session):
+    """
+    Re-run session (a GameSession built around a ReplayTracker for log) over every
+    recorded frame. Yields (frame_index, FrameResult).
+    """
+    timestamps = log.frames["timestamp"]
+    for frame_index in range(len(log)):
+        yield frame_index, session.update(None, float(timestamps[frame_index]))
+
+
+def _jsonable(options):
+    """
+    Keep the options that can be stored as JSON: scalars and tuples of them (such
+    as the table geometry).
+    """
+    scalars = (str, int, float, bool, type(None))
+    return {key: value for key, value in options.items()
+            if isinstance(value, scalars) or isinstance(value, tuple) and all(isinstance(v, scalars) for v in value)}
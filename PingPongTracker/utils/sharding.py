@@ -0,0 +1,308 @@
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from utils.batch import result_to_record
+from utils.frame_source import frame_time, open_source
+from utils.game import create_session
+from utils.session_log import SAMPLE_COLUMNS, ReplayTracker, replay
+
+# Attributes of the tracker that carry state from frame to frame; the ones a
+# tracker does not have are skipped
+_TRACKER_STATE = (
+    "last_pos", "kalman_initialized", "misses", "frames_since_full_scan", "search_window", "last_streak",
+    "_last_timestamp", "_frame_streaks", "_recent_streaks",
+    # MultiBallTracker; its ring buffers are compared as trails (see _state_signature())
+    "_radius", "_hits", "_track_misses", "_lengths",
+)
+# Filter estimates, which two trackers fed the same measurements approach
+# without ever agreeing bit for bit; they match within FILTER_TOLERANCE
+_FILTER_STATE = ("_frame_interval", "_state", "_cov")
+FILTER_TOLERANCE = 1e-3
+
+
+def plan_segments(frame_count, segments, overlap):
+    """
+    Split [0, frame_count) into contiguous segments.
+    Returns (warmup_start, start, end) per segment: a worker processes
+    warmup_start..end, where the warm-up frames overlap the previous segment.
+    """
+    segments = max(1, min(segments, frame_count))
+    bounds = [frame_count * i // segments for i in range(segments + 1)]
+    return [(max(0, start - overlap), start, end) for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def _init_worker():
+    # Each worker already owns a core; keep OpenCV from spawning its own thread pool
+    cv2.setNumThreads(1)
+
+
+def _freeze(value):
+    """
+    Return a comparable copy of a state value.
+    """
+    if isinstance(value, np.ndarray):
+        return value.dtype.str, value.shape, value.tobytes()
+    if isinstance(value, (tuple, list, deque)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _state_signature(tracker):
+    """
+    Return the part of a tracker's state that determines its future output: the
+    position history, the ROI gating counters, the track state in multi-ball mode
+    and the motion mask's previous frame, followed by the filter estimates (the
+    Kalman filter's) as one float64 array, to be compared with _same_state().
+    Returns None when the state cannot be compared (a MOG2 background model).
+    """
+    motion = tracker.motion
+    if motion is not None and motion.method == "mog2":
+        return None
+    kalman = tracker.kalman
+    # Track ids only differ by how many tracks a segment has created, so compare them relatively
+    ids = primary = trails = None
+    if hasattr(tracker, "_ids"):
+        ids = tracker._ids - tracker._next_id
+        if tracker.primary_id is not None:
+            primary = tracker.primary_id - tracker._next_id
+        # Where the ring buffers' head is depends on how many frames a tracker has
+        # seen, so only compare each track's valid entries, oldest first
+        end = tracker._head + tracker.max_positions
+        trails = tuple((tracker._trail(index).tobytes(),
+                        tracker._measured[index, end - length:end].tobytes(),
+                        tracker._times[end - length:end].tobytes())
+                       for index, length in enumerate(tracker._lengths))
+    filters = [kalman.statePost, kalman.errorCovPost]
+    filters += [getattr(tracker, name) for name in _FILTER_STATE if hasattr(tracker, name)]
+    return (
+        tracker.positions.samples().tobytes(),
+        tuple(_freeze(getattr(tracker, name)) for name in _TRACKER_STATE if hasattr(tracker, name)),
+        _freeze(ids), primary, trails,
+        None if motion is None else _freeze(motion._previous),
+        np.concatenate([np.ravel(np.asarray(value, np.float64)) for value in filters]),
+    )
+
+
+def _same_state(a, b):
+    if a is None or b is None or a[:-1] != b[:-1] or a[-1].shape != b[-1].shape:
+        return False
+    return np.allclose(a[-1], b[-1], rtol=0, atol=FILTER_TOLERANCE)
+
+
+class _TrackLog:
+    def __init__(self, frames, samples):
+        """
+        In-memory stand-in for a SessionLog holding the stitched tracker output,
+        for ReplayTracker. Unlike a SessionLog it keeps the detections and samples
+        at full precision, so the replay matches processing the frames directly.
+        """
+        self.frames = {
+            "timestamp": np.array(frames["timestamp"], np.float64),
+            "detected": np.array(frames["detected"], np.bool_),
+            "ball": np.array(frames["ball"] or np.zeros((0, 3)), object).reshape(-1, 3),
+            "kalman": np.array(frames["kalman"], np.float64).reshape(-1, 4),
+        }
+        columns = list(zip(*samples)) or [()] * len(SAMPLE_COLUMNS)
+        self.samples = {name: np.array(column, np.float64 if dtype is np.float32 else dtype)
+                        for (name, dtype), column in zip(SAMPLE_COLUMNS.items(), columns)}
+    
+    def __len__(self):
+        return len(self.frames["timestamp"])
+
+
+def _process_segment(path, args, width, height, flip, warmup_start, start, end, overlap):
+    """
+    Run the ball tracker over frames warmup_start..end-1 of a recording.
+    Returns a dict with, per frame, its index, timestamp, detection, Kalman state
+    and the history samples it appended (frame, x, y, radius, time, measured,
+    reset); the tracker state signatures of the warm-up frames and of the last
+    overlap frames, which the next segment's warm-up covers; and the history
+    before frame start.
+    """
+    source = open_source(path)
+    source.seek(warmup_start)
+    tracker = create_session(args, width, height).ball_tracker
+    segment = {"frame": [], "timestamp": [], "detected": [], "ball": [], "kalman": [], "samples": [],
+               "signatures": {}, "history": np.zeros((0, 5))}
+    seen = None
+    
+    for frame_index in range(warmup_start, end):
+        if frame_index == start:
+            segment["history"] = tracker.positions.samples().copy()
+        success, frame = source.read()
+        if not success:
+            break
+        if flip:
+            frame = cv2.flip(frame, 1, dst=frame)
+        
+        timestamp = frame_time(source, frame_index)
+        ball_pos = tracker.detect_ball(frame, timestamp)
+        state = tracker.kalman_state()
+        segment["frame"].append(frame_index)
+        segment["timestamp"].append(timestamp)
+        segment["detected"].append(ball_pos is not None)
+        segment["ball"].append(ball_pos or (0, 0, 0))
+        segment["kalman"].append((np.nan,) * 4 if state is None else state)
+        
+        # The samples this frame appended to the history, as SessionRecorder records them
+        positions = tracker.get_positions()
+        if seen is not None and seen[0] == positions.epoch:
+            new = min(positions.appended - seen[1], len(positions))
+            reset = False
+        else:
+            new = len(positions)
+            reset = True
+        seen = (positions.epoch, positions.appended)
+        samples = positions.samples()[len(positions) - new:]
+        segment["samples"].extend((frame_index, *sample, reset and k == 0) for k, sample in enumerate(samples))
+        
+        if frame_index < start or frame_index >= end - overlap:
+            segment["signatures"][frame_index] = _state_signature(tracker)
+    
+    source.release()
+    return segment
+
+
+def _run_segments(pool, segment_plans, path, args, width, height, flip, overlap):
+    futures = [pool.submit(_process_segment, path, args, width, height, flip, warmup_start, start, end, overlap)
+               for warmup_start, start, end in segment_plans]
+    return [future.result() for future in futures]
+
+
+def _switch_frame(segment, previous_signatures, warmup_start, start):
+    """
+    Return the first frame from which a segment's tracker agrees with the previous
+    segment's (the frame after the first one with the same state), or None if
+    they never agree within the warm-up.
+    """
+    for frame_index in range(warmup_start, start):
+        if _same_state(segment["signatures"].get(frame_index), previous_signatures.get(frame_index)):
+            return frame_index + 1
+    return None
+
+
+def _unreconciled_seams(segments, plan):
+    """
+    Return the indices of the segments whose tracker never agrees with the
+    previous segment's within the warm-up.
+    """
+    return [k for k in range(1, len(plan))
+            if _switch_frame(segments[k], segments[k - 1]["signatures"], *plan[k][:2]) is None]
+
+
+def stitch_segments(segments, plan):
+    """
+    Join the per-segment tracker output into one track.
+    Within each overlap the previous segment stays authoritative until both
+    segments' trackers reach the same state (see _state_signature()) on the same
+    frame; from there on the newer segment detects the same, so switching to it
+    is seamless. If they never agree (see _unreconciled_seams()), the switch
+    happens at the segment boundary, and if the position histories differ there
+    the history is reset to the newer segment's.
+    Returns a _TrackLog.
+    """
+    frames = {name: [] for name in ("timestamp", "detected", "ball", "kalman")}
+    samples = []
+    previous_signatures = {}
+    for segment, (warmup_start, start, _) in zip(segments, plan):
+        switch_frame = _switch_frame(segment, previous_signatures, warmup_start, start) or start
+        
+        # Keep the previous track up to the seam, then continue with this segment
+        for values in frames.values():
+            del values[switch_frame:]
+        while samples and samples[-1][0] >= switch_frame:
+            samples.pop()
+        history = segment["history"]
+        previous = previous_signatures.get(start - 1)
+        if switch_frame == start and start > 0 and (previous is None or previous[0] != history.tobytes()):
+            # Take over this segment's history, which differs from the previous one's
+            samples.extend((start, *sample, k == 0) for k, sample in enumerate(history))
+            reset_pending = len(history) == 0
+        else:
+            reset_pending = False
+        offset = switch_frame - segment["frame"][0] if segment["frame"] else 0
+        for name, values in frames.items():
+            values.extend(segment[name][offset:])
+        for sample in segment["samples"]:
+            if sample[0] >= switch_frame:
+                if reset_pending:
+                    # An empty history to take over: clear the previous one with the next sample
+                    sample = sample[:-1] + (True,)
+                    reset_pending = False
+                samples.append(sample)
+        previous_signatures = segment["signatures"]
+    return _TrackLog(frames, samples)
+
+
+def process_sharded(path, args, width, height, workers, overlap=60, segments=None, flip=False, max_frames=None):
+    """
+    Process a recording (only its first max_frames frames, if given) in
+    overlapping segments: the ball tracking, which does the image processing,
+    runs on a process pool, and the stitched track is then replayed through one
+    GameSession so the trajectory prediction, stick figure and score carry over
+    the seams exactly. Segments whose tracker does not reach the previous one's
+    state within the overlap are rerun with a longer warm-up; seams that still
+    differ are reported on stderr and counted in stats["unreconciled_seams"].
+    Returns (records, stats).
+    """
+    source = open_source(path)
+    frame_count = source.frame_count
+    source.release()
+    if frame_count <= 0:
+        raise ValueError(f"Cannot shard {path}: unknown frame count")
+    if max_frames is not None:
+        frame_count = min(frame_count, max_frames)
+    
+    # The overlap must at least cover one full position history to reconcile the seam
+    overlap = max(overlap, args.history)
+    plan = plan_segments(frame_count, segments or workers, overlap)
+    
+    started = time.perf_counter()
+    retries = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        segment_args = (path, args, width, height, flip, overlap)
+        segment_results = _run_segments(pool, plan, *segment_args)
+        # Where the trackers never agreed, rerun the newer segment with twice the
+        # warm-up, up to the start of the recording, where it is bound to agree
+        # (unless its state cannot be compared at all, as with a MOG2 motion mask)
+        unreconciled = _unreconciled_seams(segment_results, plan)
+        while True:
+            retry = [k for k in unreconciled
+                     if plan[k][0] > 0 and segment_results[k]["signatures"].get(plan[k][0]) is not None]
+            if not retry:
+                break
+            for k in retry:
+                warmup_start, start, end = plan[k]
+                plan[k] = (max(0, start - 2 * (start - warmup_start)), start, end)
+            for k, segment in zip(retry, _run_segments(pool, [plan[k] for k in retry], *segment_args)):
+                segment_results[k] = segment
+            retries += len(retry)
+            unreconciled = _unreconciled_seams(segment_results, plan)
+    
+    if unreconciled:
+        print(f"Warning: {len(unreconciled)} of {len(plan) - 1} segment seams could not be reconciled; "
+              f"the track may differ from a single-process run around frames "
+              f"{', '.join(str(plan[k][1]) for k in unreconciled)}", file=sys.stderr)
+    log = stitch_segments(segment_results, plan)
+    
+    session = create_session(args, width, height)
+    session.ball_tracker = ReplayTracker(log, max_positions=args.history)
+    records = [result_to_record(frame_index, result) for frame_index, result in replay(log, session)]
+    elapsed = time.perf_counter() - started
+    
+    stats = {
+        "frames": len(records),
+        "seconds": elapsed,
+        "fps": len(records) / elapsed if elapsed > 0 else 0.0,
+        "score": session.score,
+        "misses": session.misses,
+        "segments": len(plan),
+        "segment_retries": retries,
+        "unreconciled_seams": len(unreconciled),
+    }
+    return records, stats
@@ -0,0 +1,540 @@
+import json
+import multiprocessing
+import queue
+import time
+from collections import deque, namedtuple
+
+import cv2
+import numpy as np
+
+from utils.frame_source import CameraSource, frame_time, open_source
+from utils.game import create_session
+
+# One triangulated ball sample: the reference camera's frame index, the time on the
+# common clock, the 3D point, its mean reprojection error in pixels and the cameras
+# that saw it
+FusedSample = namedtuple("FusedSample", ["frame", "time", "point", "error", "views"])
+
+AXES = "xyz"
+
+# Columns written for every fused sample
+FUSED_FIELDS = [
+    "frame", "time", "x", "y", "z", "views", "error_px",
+    "predicted_x", "predicted_y", "predicted_z", "time_to_intersection_ms",
+]
+
+
+class CameraCalibration:
+    def __init__(self, camera_matrix, dist_coeffs=None, rvec=None, tvec=None, time_offset=0.0, name=None):
+        """
+        Intrinsics and pose of one camera: the 3x3 camera matrix, OpenCV distortion
+        coefficients, and the rotation (Rodrigues vector) and translation taking
+        world points into the camera frame, as returned by cv2.stereoCalibrate or
+        cv2.solvePnP. time_offset (seconds) is added to the camera's timestamps to
+        put them on the common clock.
+        """
+        self.camera_matrix = np.asarray(camera_matrix, np.float64).reshape(3, 3)
+        self.dist_coeffs = np.zeros(5) if dist_coeffs is None else np.asarray(dist_coeffs, np.float64).ravel()
+        self.rvec = np.zeros(3) if rvec is None else np.asarray(rvec, np.float64).ravel()
+        self.tvec = np.zeros(3) if tvec is None else np.asarray(tvec, np.float64).ravel()
+        self.time_offset = float(time_offset)
+        self.name = name
+        # [R|t]: the projection to normalized (undistorted) image coordinates
+        self.pose = np.hstack([cv2.Rodrigues(self.rvec)[0], self.tvec[:, None]])
+    
+    def normalize(self, pixels):
+        """
+        Return the undistorted, normalized image coordinates of (n, 2) pixel positions.
+        """
+        pixels = np.asarray(pixels, np.float64).reshape(-1, 1, 2)
+        return cv2.undistortPoints(pixels, self.camera_matrix, self.dist_coeffs).reshape(-1, 2)
+    
+    def project(self, points):
+        """
+        Return the (n, 2) pixel positions of (n, 3) world points.
+        """
+        points = np.asarray(points, np.float64).reshape(-1, 1, 3)
+        pixels, _ = cv2.projectPoints(points, self.rvec, self.tvec, self.camera_matrix, self.dist_coeffs)
+        return pixels.reshape(-1, 2)
+    
+    def depth(self, points):
+        """
+        Return the distance of (n, 3) world points in front of the camera.
+        """
+        return np.asarray(points, np.float64).reshape(-1, 3) @ self.pose[2, :3] + self.pose[2, 3]
+    
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "camera_matrix": self.camera_matrix.tolist(),
+            "dist_coeffs": self.dist_coeffs.tolist(),
+            "rvec": self.rvec.tolist(),
+            "tvec": self.tvec.tolist(),
+            "time_offset": self.time_offset,
+        }
+
+
+def load_calibration(path):
+    """
+    Read the CameraCalibrations stored by save_calibration(), in camera order.
+    """
+    with open(path) as f:
+        return [CameraCalibration(**camera) for camera in json.load(f)["cameras"]]
+
+
+def save_calibration(path, calibrations):
+    """
+    Write CameraCalibrations to a JSON file.
+    """
+    with open(path, "w") as f:
+        json.dump({"cameras": [calibration.to_dict() for calibration in calibrations]}, f, indent=2)
+
+
+def parse_plane(text):
+    """
+    Parse an "AXIS=LEVEL" plane (e.g. "y=0") into (axis index, level). Raises
+    ValueError for a malformed value, so it can serve as an argparse type.
+    """
+    axis, _, level = text.partition("=")
+    axis = axis.strip().lower()
+    if axis not in AXES or not level:
+        raise ValueError(f"Expected a plane as AXIS=LEVEL with AXIS one of x, y, z, got {text!r}")
+    return AXES.index(axis), float(level)
+
+
+def triangulate(calibrations, pixels, mask):
+    """
+    Triangulate points seen by several cameras with the linear (DLT) method, in
+    normalized image coordinates so lens distortion is removed first.
+    pixels is (n, cameras, 2) and mask (n, cameras) marks the views that saw each point.
+    Returns the (n, 3) points and their mean reprojection errors in pixels; points
+    seen by fewer than two cameras are NaN.
+    """
+    n, count = mask.shape
+    # Two rows per view; the rows of missing views stay zero and do not constrain the point
+    rows = np.zeros((n, 2 * count, 4))
+    for k, calibration in enumerate(calibrations):
+        seen = mask[:, k]
+        if seen.any():
+            uv = calibration.normalize(pixels[seen, k])
+            pose = calibration.pose
+            rows[seen, 2 * k] = uv[:, :1] * pose[2] - pose[0]
+            rows[seen, 2 * k + 1] = uv[:, 1:] * pose[2] - pose[1]
+    
+    points = np.full((n, 3), np.nan)
+    errors = np.full(n, np.nan)
+    valid = mask.sum(axis=1) >= 2
+    if not valid.any():
+        return points, errors
+    
+    # The solution of each system is its right singular vector of the smallest singular value
+    homogeneous = np.linalg.svd(rows[valid])[2][:, -1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        points[valid] = homogeneous[:, :3] / homogeneous[:, 3:]
+    
+    total = np.zeros(n)
+    for k, calibration in enumerate(calibrations):
+        seen = valid & mask[:, k]
+        if seen.any():
+            total[seen] += np.hypot(*(calibration.project(points[seen]) - pixels[seen, k]).T)
+    errors[valid] = total[valid] / mask[valid].sum(axis=1)
+    return points, errors
+
+
+def interpolate_view(times, pixels, at, max_gap):
+    """
+    Linearly interpolate a camera's detections (sorted times, (n, 2) pixels) to the
+    times `at`, between two detections at most max_gap seconds apart.
+    Returns the (m, 2) pixels and a mask of the times that could be interpolated.
+    """
+    result = np.zeros((len(at), 2))
+    if len(times) == 0:
+        return result, np.zeros(len(at), bool)
+    after = np.clip(np.searchsorted(times, at), 0, len(times) - 1)
+    before = np.maximum(after - 1, 0)
+    exact = times[after] == at
+    before = np.where(exact, after, before)
+    t0, t1 = times[before], times[after]
+    valid = exact | ((t0 <= at) & (at <= t1) & (t1 - t0 <= max_gap))
+    span = np.where(t1 > t0, t1 - t0, 1.0)
+    weight = np.clip((at - t0) / span, 0, 1)[:, None]
+    result[:] = pixels[before] + weight * (pixels[after] - pixels[before])
+    return result, valid
+
+
+class ViewAligner:
+    def __init__(self, calibrations, max_gap=0.1):
+        """
+        Match the detections of several cameras in time and triangulate them.
+        The first camera is the reference: each of its detections is fused with the
+        other cameras' detections interpolated to its time (on the common clock,
+        after each camera's time_offset), between two detections at most max_gap
+        seconds apart. A detection is fused once every other camera has reported a
+        frame at or after its time, or has finished.
+        """
+        self.calibrations = calibrations
+        self.max_gap = max_gap
+        count = len(calibrations)
+        self._pending = deque()  # Reference detections not fused yet: (frame, time, x, y)
+        self._times = [[] for _ in range(count)]  # Detection times of the other cameras
+        self._pixels = [[] for _ in range(count)]
+        self._latest = [-np.inf] * count  # Time of the newest frame each camera reported
+    
+    def add(self, camera, samples):
+        """
+        Add a camera's (frame_index, timestamp, x, y, radius) samples, in frame
+        order; x is None for frames without a detection.
+        """
+        offset = self.calibrations[camera].time_offset
+        for frame_index, timestamp, x, y, _ in samples:
+            t = timestamp + offset
+            if x is not None:
+                if camera == 0:
+                    self._pending.append((frame_index, t, x, y))
+                else:
+                    self._times[camera].append(t)
+                    self._pixels[camera].append((x, y))
+            self._latest[camera] = t
+    
+    def finish(self, camera):
+        """
+        Mark a camera as finished, so detections no longer wait for it.
+        """
+        self._latest[camera] = np.inf
+    
+    def fuse(self):
+        """
+        Triangulate the reference detections that are ready.
+        Returns their FusedSamples, oldest first; detections seen by fewer than two
+        cameras are dropped.
+        """
+        ready = min(self._latest[1:], default=np.inf)
+        count = 0
+        while count < len(self._pending) and self._pending[count][1] <= ready:
+            count += 1
+        if count == 0:
+            return []
+        frames, times, xs, ys = zip(*(self._pending.popleft() for _ in range(count)))
+        times = np.array(times)
+        
+        cameras = len(self.calibrations)
+        pixels = np.zeros((count, cameras, 2))
+        mask = np.zeros((count, cameras), bool)
+        pixels[:, 0, 0] = xs
+        pixels[:, 0, 1] = ys
+        mask[:, 0] = True
+        for k in range(1, cameras):
+            view_times = np.array(self._times[k])
+            view_pixels = np.array(self._pixels[k]).reshape(-1, 2)
+            pixels[:, k], mask[:, k] = interpolate_view(view_times, view_pixels, times, self.max_gap)
+            # Keep the last detection before the newest fused time, to interpolate from
+            keep = max(int(np.searchsorted(view_times, times[-1])) - 1, 0)
+            del self._times[k][:keep], self._pixels[k][:keep]
+        
+        points, errors = triangulate(self.calibrations, pixels, mask)
+        return [
+            FusedSample(frames[i], float(times[i]), points[i], float(errors[i]),
+                        [int(k) for k in np.flatnonzero(mask[i])])
+            for i in range(count) if not np.isnan(errors[i])
+        ]
+
+
+def estimate_time_offsets(calibrations, detections, search=0.1, step=0.002, max_gap=0.1):
+    """
+    Estimate each camera's time_offset from recorded detections, by trying offsets
+    within search seconds of its calibrated one and keeping the one whose points,
+    triangulated with the reference camera, reproject best (lowest median error).
+    Offsets that match fewer than half as many detections as the best-matching one
+    are not considered. detections[k] holds camera k's (frame_index, timestamp, x,
+    y, radius) samples. Returns the offsets; the reference camera's is unchanged.
+    """
+    def measured(camera):
+        samples = [s for s in detections[camera] if s[2] is not None]
+        times = np.array([s[1] for s in samples], np.float64) + calibrations[camera].time_offset
+        return times, np.array([s[2:4] for s in samples], np.float64).reshape(-1, 2)
+    
+    reference_times, reference_pixels = measured(0)
+    offsets = [calibrations[0].time_offset]
+    for k in range(1, len(calibrations)):
+        times, pixels = measured(k)
+        candidates = np.arange(-search, search + step / 2, step)
+        scores = []
+        for shift in candidates:
+            view, seen = interpolate_view(times + shift, pixels, reference_times, max_gap)
+            pair_pixels = np.stack([reference_pixels, view], axis=1)
+            pair_mask = np.stack([np.ones(len(seen), bool), seen], axis=1)
+            _, errors = triangulate([calibrations[0], calibrations[k]], pair_pixels, pair_mask)
+            errors = errors[~np.isnan(errors)]
+            scores.append((len(errors), np.median(errors) if len(errors) else np.inf))
+        
+        matches = max(count for count, _ in scores)
+        best = min(range(len(candidates)),
+                   key=lambda i: scores[i][1] if 2 * scores[i][0] >= matches else np.inf)
+        offsets.append(calibrations[k].time_offset + float(candidates[best]))
+    return offsets
+
+
+class TrajectoryPredictor3D:
+    def __init__(self, history=10, max_jump=0.5, min_points=5):
+        """
+        Fit quadratics x(t), y(t), z(t) to the most recent `history` fused samples,
+        with t=0 at the newest one, and predict where the ball crosses a plane.
+        The history restarts when a sample is more than max_jump (world units) from
+        the previous one, i.e. on a new ball.
+        """
+        self.max_jump = max_jump
+        self.min_points = min_points
+        self.times = deque(maxlen=history)
+        self.points = deque(maxlen=history)
+        self.params = None  # (3, 3): the (a, b, c) coefficients of each axis, per column
+    
+    def add(self, time, point):
+        """
+        Add a fused sample and refit. Returns True if a trajectory was fitted.
+        """
+        if self.points and np.linalg.norm(point - self.points[-1]) > self.max_jump:
+            self.times.clear()
+            self.points.clear()
+        self.times.append(time)
+        self.points.append(point)
+        if len(self.points) < self.min_points:
+            self.params = None
+            return False
+        times = np.array(self.times)
+        self.params = np.linalg.lstsq(np.vander(times - times[-1], 3), np.array(self.points), rcond=None)[0]
+        return True
+    
+    def predict_positions(self, times_ahead):
+        """
+        Predict the (n, 3) ball positions at an array of times (seconds after the
+        newest sample), or None without a trajectory.
+        """
+        if self.params is None:
+            return None
+        return np.vander(np.asarray(times_ahead, np.float64), 3) @ self.params
+    
+    def predict_intersection(self, axis, level):
+        """
+        Predict where the ball next crosses the plane where coordinate `axis` equals level.
+        Returns (point, time in milliseconds), or None if it does not cross it.
+        """
+        if self.params is None:
+            return None
+        a, b, c = self.params[:, axis]
+        c -= level
+        if abs(a) < 1e-9:
+            roots = [-c / b] if b != 0 else []
+        else:
+            discriminant = b * b - 4 * a * c
+            if discriminant < 0:
+                return None
+            root = np.sqrt(discriminant)
+            roots = [(-b - root) / (2 * a), (-b + root) / (2 * a)]
+        future = [t for t in roots if t > 0]
+        if not future:
+            return None
+        t = min(future)
+        return self.predict_positions([t])[0], t * 1000
+
+
+def open_view(source):
+    """
+    Open a camera (given by its index) or a recording.
+    """
+    source = str(source)
+    return CameraSource(int(source)) if source.isdigit() else open_source(source)
+
+
+def camera_detections(source, args, flip=False, max_frames=None, batch=8):
+    """
+    Run detect_ball over the frames of a source (camera index, video file or image
+    directory) with a tracker configured from session options.
+    Yields lists of up to batch (frame_index, timestamp, x, y, radius) samples, with
+    x, y and radius None on frames without a measured ball. Recordings are timed
+    from their frame rate, cameras by capture time (time.perf_counter(), which is
+    the same clock in every process).
+    """
+    capture = open_view(source)
+    if not capture.isOpened():
+        raise ValueError(f"Could not open {source}")
+    tracker = create_session(args).ball_tracker
+    live = capture.frame_count == 0
+    
+    samples = []
+    frame_index = 0
+    try:
+        while max_frames is None or frame_index < max_frames:
+            success, frame = capture.read()
+            if not success:
+                break
+            if flip:
+                frame = cv2.flip(frame, 1, dst=frame)
+            timestamp = capture.timestamp if live else frame_time(capture, frame_index)
+            
+            # detect_ball also returns Kalman predictions; only triangulate measurements
+            ball_pos = tracker.detect_ball(frame, timestamp)
+            if ball_pos is not None and tracker.misses == 0:
+                x, y, radius = ball_pos
+                samples.append((frame_index, timestamp, float(x), float(y), float(radius)))
+            else:
+                samples.append((frame_index, timestamp, None, None, None))
+            frame_index += 1
+            
+            if len(samples) >= batch:
+                yield samples
+                samples = []
+        if samples:
+            yield samples
+    finally:
+        capture.release()
+
+
+def _camera_worker(camera, source, args, flip, max_frames, batch, results):
+    # Each worker already owns a core; keep OpenCV from spawning its own thread pool
+    cv2.setNumThreads(1)
+    try:
+        for samples in camera_detections(source, args, flip, max_frames, batch):
+            results.put((camera, samples, None))
+        results.put((camera, None, None))
+    except Exception as e:
+        results.put((camera, None, f"{type(e).__name__}: {e}"))
+
+
+class MultiCameraDetector:
+    def __init__(self, sources, args, flip=False, max_frames=None, batch=8, parallel=True, worker_timeout=1.0):
+        """
+        Run ball detection on several frame sources, each in its own worker process,
+        or round-robin on the calling process with parallel=False.
+        Iterating yields (camera, samples) batches as camera_detections() produces
+        them, and (camera, None) when a camera has run out of frames. frames counts
+        the frames processed per camera. A worker that dies without reporting (a
+        crash in native code, the OOM killer) raises RuntimeError within
+        worker_timeout seconds.
+        """
+        self.sources = sources
+        self.args = args
+        self.flip = flip
+        self.max_frames = max_frames
+        self.batch = batch
+        self.parallel = parallel
+        self.worker_timeout = worker_timeout
+        self.frames = [0] * len(sources)
+    
+    def __iter__(self):
+        batches = self._parallel() if self.parallel else self._serial()
+        for camera, samples in batches:
+            if samples:
+                self.frames[camera] += len(samples)
+            yield camera, samples
+    
+    def _serial(self):
+        generators = {camera: camera_detections(source, self.args, self.flip, self.max_frames, self.batch)
+                      for camera, source in enumerate(self.sources)}
+        while generators:
+            for camera in list(generators):
+                samples = next(generators[camera], None)
+                if samples is None:
+                    del generators[camera]
+                yield camera, samples
+    
+    def _parallel(self):
+        results = multiprocessing.Queue()
+        workers = [
+            multiprocessing.Process(target=_camera_worker, name=f"camera-{camera}", daemon=True,
+                                    args=(camera, source, self.args, self.flip, self.max_frames,
+                                          self.batch, results))
+            for camera, source in enumerate(self.sources)
+        ]
+        for worker in workers:
+            worker.start()
+        running = set(range(len(workers)))
+        exited = {}  # Camera -> when its worker was first seen exited while still running
+        try:
+            while running:
+                # A worker that exited normally has flushed its results into the queue,
+                # so one that stays unfinished for worker_timeout after exiting crashed
+                now = time.monotonic()
+                for camera in running:
+                    if not workers[camera].is_alive():
+                        exited.setdefault(camera, now)
+                        if now - exited[camera] > self.worker_timeout:
+                            raise RuntimeError(f"Camera {camera} ({self.sources[camera]}): worker exited "
+                                               f"with code {workers[camera].exitcode} without reporting")
+                try:
+                    camera, samples, error = results.get(timeout=self.worker_timeout)
+                except queue.Empty:
+                    continue
+                if error is not None:
+                    raise RuntimeError(f"Camera {camera} ({self.sources[camera]}): {error}")
+                if samples is None:
+                    running.discard(camera)
+                yield camera, samples
+        finally:
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+                worker.join()
+
+
+def fused_to_record(sample, intersection):
+    """
+    Flatten a FusedSample and its predicted intersection ((point, ms) or None) into
+    a dict with the FUSED_FIELDS keys.
+    """
+    # Adding 0.0 turns a rounded -0.0 into 0.0
+    x, y, z = (round(float(v), 4) + 0.0 for v in sample.point)
+    predicted = [None] * 3
+    time_to_intersection = None
+    if intersection:
+        predicted = [round(float(v), 4) + 0.0 for v in intersection[0]]
+        time_to_intersection = round(float(intersection[1]), 1)
+    return {
+        "frame": sample.frame,
+        "time": round(sample.time, 4),
+        "x": x,
+        "y": y,
+        "z": z,
+        "views": sample.views,
+        "error_px": round(sample.error, 2),
+        "predicted_x": predicted[0],
+        "predicted_y": predicted[1],
+        "predicted_z": predicted[2],
+        "time_to_intersection_ms": time_to_intersection,
+    }
+
+
+def track_multiview(detector, calibrations, plane, history=10, max_gap=0.1, max_jump=0.5,
+                    sync_search=0.0, sync_step=0.002):
+    """
+    Fuse a MultiCameraDetector's detections into 3D and predict where the ball
+    crosses plane ((axis, level), see parse_plane()). Yields a record per fused
+    sample, as soon as every camera has caught up with it.
+    
+    With sync_search > 0 the cameras' time offsets are first estimated (within
+    sync_search seconds of the calibrated ones) from all their detections, which
+    only works on recordings; the calibrations are updated in place.
+    """
+    aligner = ViewAligner(calibrations, max_gap)
+    predictor = TrajectoryPredictor3D(history, max_jump)
+    batches = iter(detector)
+    if sync_search > 0:
+        detections = [[] for _ in calibrations]
+        for camera, samples in batches:
+            if samples:
+                detections[camera].extend(samples)
+        for calibration, offset in zip(calibrations, estimate_time_offsets(calibrations, detections,
+                                                                           sync_search, sync_step, max_gap)):
+            calibration.time_offset = offset
+        batches = [(camera, samples) for camera, samples in enumerate(detections)]
+        batches += [(camera, None) for camera in range(len(calibrations))]
+    
+    for camera, samples in batches:
+        if samples is None:
+            aligner.finish(camera)
+        else:
+            aligner.add(camera, samples)
+        for sample in aligner.fuse():
+            intersection = None
+            if predictor.add(sample.time, sample.point):
+                intersection = predictor.predict_intersection(*plane)
+            yield fused_to_record(sample, intersection)
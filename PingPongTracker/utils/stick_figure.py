@@ -1,70 +1,124 @@
 import cv2
 import numpy as np
+from utils.overlay import Sprite
 
 class StickFigure:
-    def __init__(self, screen_width, screen_height, size=80):
+    def __init__(self, screen_width=None, screen_height=None, size=80, reference_fps=30.0):
         """
         Initialize the stick figure with screen dimensions and figure size.
+        The smoothing factor applies per frame at reference_fps; when move_to is
+        given timestamps it is scaled to the actual time between calls, so the
+        figure moves at the same speed whatever the frame rate.
+        
+        The screen dimensions can be left out and set with resize() once the frame
+        size is known (GameSession does this on the first frame).
         """
-        self.screen_width = screen_width
-        self.screen_height = screen_height
         self.size = size
         self.paddle_width = size * 0.8  # Paddle width as a fraction of figure size
         
+        # Movement smoothing
+        self.smoothing_factor = 0.2  # Lower value = smoother movement
+        self.reference_fps = reference_fps
+        self.max_catch_up = 5  # At most this many reference frames of movement per call
+        self.last_time = None  # Timestamp of the previous timed move_to call
+        
+        # Pre-rendered figure, see draw()
+        self._sprite = None
+        self._sprite_key = None
+        
+        self.screen_width = self.screen_height = None
+        if screen_width is not None and screen_height is not None:
+            self.resize(screen_width, screen_height)
+    
+    @property
+    def sized(self):
+        return self.screen_width is not None
+    
+    def resize(self, screen_width, screen_height):
+        """
+        Set the screen dimensions and put the figure back at the bottom center.
+        """
+        self.screen_width = screen_width
+        self.screen_height = screen_height
+        
         # Initial position (bottom center of the screen)
         self.x = screen_width // 2
-        self.y = screen_height - size // 2
+        self.y = screen_height - self.size // 2
         
         # Paddle y-position (where the ball needs to hit)
-        self.paddle_y = self.y - size // 2
-        
-        # Movement smoothing
+        self.paddle_y = self.y - self.size // 2
         self.target_x = self.x
-        self.smoothing_factor = 0.2  # Lower value = smoother movement
     
-    def move_to(self, x):
+    def move_to(self, x, timestamp=None):
         """
         Move the stick figure to the specified x-coordinate with smoothing.
+        timestamp (seconds) makes the smoothing time-based rather than per call.
         """
         # Set target position
         padding = int(self.size / 2)
         self.target_x = max(padding, min(x, self.screen_width - padding))
         
         # Apply smoothing - gradually move toward target
-        self.x = int(self.x + self.smoothing_factor * (self.target_x - self.x))
+        smoothing = self.smoothing_factor
+        if timestamp is not None:
+            if self.last_time is not None:
+                # Same decay per second as smoothing_factor per reference frame
+                frames = min(max(timestamp - self.last_time, 0.0) * self.reference_fps, self.max_catch_up)
+                smoothing = 1 - (1 - self.smoothing_factor) ** frames
+            self.last_time = timestamp
+        self.x = int(self.x + smoothing * (self.target_x - self.x))
     
-    def draw(self, frame):
+    def draw(self, frame, x=None):
         """
         Draw the stick figure on the frame.
+        x overrides the current position (e.g. a snapshot taken on another thread).
+        """
+        if x is None:
+            x = self.x
+        
+        # The figure is rendered once per size and then only copied into place
+        key = (self.size, self.paddle_width, self.y - self.paddle_y)
+        if self._sprite_key != key:
+            margin = self.size + 8  # Covers the figure, paddle and line widths around the anchor
+            self._sprite = Sprite.render(2 * margin, 2 * margin, (margin, margin),
+                                         lambda canvas: self._draw_shapes(canvas, margin, margin))
+            self._sprite_key = key
+        return self._sprite.blit(frame, x, self.y)
+    
+    def _draw_shapes(self, frame, x, y):
+        """
+        Draw the figure's lines and circles with its body anchored at (x, y).
         """
+        paddle_y = y - (self.y - self.paddle_y)
+        
         # Head
         head_radius = int(self.size / 6)
-        head_center = (self.x, self.y - int(self.size / 3))
+        head_center = (x, y - int(self.size / 3))
         cv2.circle(frame, head_center, head_radius, (255, 255, 255), 2)
         
         # Body
         body_start = head_center
-        body_end = (self.x, self.y)
+        body_end = (x, y)
         cv2.line(frame, body_start, body_end, (255, 255, 255), 2)
         
         # Arms
         arm_length = int(self.size / 3)
-        left_arm_end = (self.x - arm_length, self.y - int(self.size / 6))
-        right_arm_end = (self.x + arm_length, self.y - int(self.size / 6))
-        cv2.line(frame, (self.x, body_start[1] + head_radius), left_arm_end, (255, 255, 255), 2)
-        cv2.line(frame, (self.x, body_start[1] + head_radius), right_arm_end, (255, 255, 255), 2)
+        left_arm_end = (x - arm_length, y - int(self.size / 6))
+        right_arm_end = (x + arm_length, y - int(self.size / 6))
+        cv2.line(frame, (x, body_start[1] + head_radius), left_arm_end, (255, 255, 255), 2)
+        cv2.line(frame, (x, body_start[1] + head_radius), right_arm_end, (255, 255, 255), 2)
         
         # Legs
         leg_length = int(self.size / 3)
-        left_leg_end = (self.x - int(self.size / 4), self.y + leg_length)
-        right_leg_end = (self.x + int(self.size / 4), self.y + leg_length)
+        left_leg_end = (x - int(self.size / 4), y + leg_length)
+        right_leg_end = (x + int(self.size / 4), y + leg_length)
         cv2.line(frame, body_end, left_leg_end, (255, 255, 255), 2)
         cv2.line(frame, body_end, right_leg_end, (255, 255, 255), 2)
         
         # Paddle (held above head)
-        paddle_left = int(self.x - self.paddle_width / 2)
-        paddle_right = int(self.x + self.paddle_width / 2)
-        cv2.line(frame, (paddle_left, self.paddle_y), (paddle_right, self.paddle_y), (0, 255, 0), 4)
+        paddle_left = int(x - self.paddle_width / 2)
+        paddle_right = int(x + self.paddle_width / 2)
+        cv2.line(frame, (paddle_left, paddle_y), (paddle_right, paddle_y), (0, 255, 0), 4)
         
         return frame
     
@@ -0,0 +1,364 @@
+import os
+
+import numpy as np
+import cv2
+
+from utils.stereo import CameraCalibration, save_calibration
+
+# BGR color inside BallTracker's default HSV range (H~26, S=255, V=255)
+BALL_COLOR = (0, 220, 255)
+BACKGROUND_COLOR = (60, 60, 60)
+TABLE_COLOR = (60, 110, 30)
+
+
+class SyntheticScene:
+    def __init__(self, width=640, height=480, ball_radius=12, noise=0.0, gravity=0.5,
+                 occlusion_rate=0.0, occlusion_length=(3, 8), distractors=0, speed=1.0, motion_blur=0.0,
+                 table=None, restitution=0.8, max_bounces=10, seed=0):
+        """
+        Render frames of a ball thrown along parabolic paths, with known ground truth.
+        
+        noise is the standard deviation of per-pixel Gaussian noise, occlusion_rate the
+        per-frame probability of starting an occlusion gap of occlusion_length frames
+        (ball not drawn), and distractors the number of static ball-colored blobs.
+        gravity is in pixels per frame squared.
+        
+        speed > 1 plays the throws faster (the same paths in fewer frames), and
+        motion_blur is the fraction of the frame interval the shutter is open: the
+        ball is drawn as the streak it sweeps during the exposure, ending at its
+        true position.
+        
+        table (a TableGeometry, in fractions of the frame) adds a table the ball
+        bounces off, keeping `restitution` of its vertical speed, up to max_bounces
+        times per throw.
+        """
+        self.width = width
+        self.height = height
+        self.ball_radius = ball_radius
+        self.noise = noise
+        self.gravity = gravity
+        self.occlusion_rate = occlusion_rate
+        self.occlusion_length = occlusion_length
+        self.speed = speed
+        self.motion_blur = motion_blur
+        self.table = table
+        self.restitution = restitution
+        self.max_bounces = max_bounces
+        self.rng = np.random.default_rng(seed)
+        
+        # Static background with ball-colored distractor blobs
+        self.background = np.empty((height, width, 3), np.uint8)
+        self.background[:] = BACKGROUND_COLOR
+        for _ in range(distractors):
+            self._draw_distractor(self.background)
+        if table is not None:
+            cv2.line(self.background, (int(table.left * width), int(table.y * height)),
+                     (int(table.right * width), int(table.y * height)), TABLE_COLOR, 4)
+        
+        self._throw = None
+        self._flights = {}  # Throw -> its flight segments between bounces
+        self._occluded_frames = 0
+        self.frame_index = 0
+    
+    def new_throw(self):
+        """
+        Start a new throw from the upper part of the frame.
+        Returns the throw as (x0, y0, vx, vy, start_frame).
+        """
+        x0 = self.rng.uniform(0.1, 0.9) * self.width
+        y0 = self.rng.uniform(0.05, 0.3) * self.height
+        # Horizontal speed towards the middle, so throws stay in frame for a while
+        direction = 1 if x0 < self.width / 2 else -1
+        vx = direction * self.rng.uniform(0.003, 0.012) * self.width
+        vy = self.rng.uniform(-0.01, 0.01) * self.height
+        self._throw = (x0, y0, vx, vy, self.frame_index)
+        return self._throw
+    
+    def position_at(self, frame_index, throw=None):
+        """
+        Return the true (x, y) of the ball at frame_index for a throw.
+        """
+        throw = throw or self._throw
+        t = (frame_index - throw[4]) * self.speed
+        # The flight segment (starting time, position and velocity) the ball is in
+        for t0, x0, y0, vx, vy in reversed(self._flight(throw)):
+            if t >= t0:
+                break
+        t -= t0
+        return x0 + vx * t, y0 + vy * t + 0.5 * self.gravity * t * t
+    
+    def crossing(self, y_level, throw=None):
+        """
+        Return (x, frame_index) where a throw crosses the horizontal line y_level on
+        its way down, or None if it never does.
+        """
+        throw = throw or self._throw
+        flight = self._flight(throw)
+        for k, (t0, x0, y0, vx, vy) in enumerate(flight):
+            t = self._descent_time(y0, vy, y_level)
+            end = flight[k + 1][0] - t0 if k + 1 < len(flight) else np.inf
+            if t is not None and 0 <= t < end:
+                return x0 + vx * t, throw[4] + (t0 + t) / self.speed
+        return None
+    
+    def _descent_time(self, y0, vy, y_level):
+        """
+        Return the time at which y0 + vy*t + g/2*t^2 reaches y_level on the way
+        down, or None if it never does.
+        """
+        a, b, c = 0.5 * self.gravity, vy, y0 - y_level
+        discriminant = b * b - 4 * a * c
+        if a == 0 or discriminant < 0:
+            return None
+        return (-b + np.sqrt(discriminant)) / (2 * a)
+    
+    def _flight(self, throw):
+        """
+        Return the flight segments of a throw, (t0, x0, y0, vx, vy) from the throw
+        and from each table bounce, with times in (speed-scaled) frames since the throw.
+        """
+        flight = self._flights.get(throw)
+        if flight is not None:
+            return flight
+        x0, y0, vx, vy, _ = throw
+        flight = [(0.0, x0, y0, vx, vy)]
+        table = self.table
+        if table is not None:
+            # The ball bounces when its bottom reaches the surface
+            contact = table.y * self.height - self.ball_radius
+            for _ in range(self.max_bounces):
+                t0, x0, y0, vx, vy = flight[-1]
+                t = self._descent_time(y0, vy, contact)
+                if t is None or t <= 0 or not table.left * self.width <= x0 + vx * t <= table.right * self.width:
+                    break
+                flight.append((t0 + t, x0 + vx * t, contact, vx, -self.restitution * (vy + self.gravity * t)))
+        self._flights = {throw: flight}  # Only the current throw is kept
+        return flight
+    
+    def next_frame(self):
+        """
+        Render the next frame.
+        Returns (frame, truth) where truth is a dict with the frame index, the true
+        ball position and radius, whether the ball is visible and the current throw.
+        """
+        if self._throw is None:
+            self.new_throw()
+        x, y = self.position_at(self.frame_index)
+        
+        # Start a new throw once the ball has left the frame
+        r = self.ball_radius
+        if y - r > self.height or x + r < 0 or x - r > self.width:
+            self.new_throw()
+            x, y = self.position_at(self.frame_index)
+        
+        if self._occluded_frames > 0:
+            self._occluded_frames -= 1
+        elif self.occlusion_rate > 0 and self.rng.random() < self.occlusion_rate:
+            self._occluded_frames = int(self.rng.integers(*self.occlusion_length, endpoint=True)) - 1
+        visible = self._occluded_frames == 0 and -r < x < self.width + r and -r < y < self.height + r
+        
+        frame = self.background.copy()
+        if visible and self.motion_blur > 0:
+            # Sweep the ball over the exposure, which ends at the frame time
+            x_start, y_start = self.position_at(self.frame_index - self.motion_blur)
+            steps = int(np.hypot(x - x_start, y - y_start) / max(1.0, r / 2)) + 1
+            for k in range(steps + 1):
+                sx, sy = self.position_at(self.frame_index - self.motion_blur * (1 - k / steps))
+                cv2.circle(frame, (int(round(sx)), int(round(sy))), r, BALL_COLOR, -1, cv2.LINE_AA)
+        elif visible:
+            cv2.circle(frame, (int(round(x)), int(round(y))), r, BALL_COLOR, -1, cv2.LINE_AA)
+        if self.noise > 0:
+            noise = self.rng.normal(0, self.noise, frame.shape)
+            frame = np.clip(frame + noise, 0, 255).astype(np.uint8)
+        
+        truth = {
+            "frame": self.frame_index,
+            "x": x,
+            "y": y,
+            "radius": r,
+            "visible": visible,
+            "throw": self._throw,
+        }
+        self.frame_index += 1
+        return frame, truth
+    
+    def frames(self, count):
+        """
+        Yield (frame, truth) for count frames.
+        """
+        for _ in range(count):
+            yield self.next_frame()
+    
+    def _draw_distractor(self, image):
+        """
+        Draw a static ball-colored blob that is not round (a bar or a flat ellipse).
+        """
+        cx = int(self.rng.uniform(0, self.width))
+        cy = int(self.rng.uniform(0, self.height))
+        size = int(self.rng.uniform(2, 5) * self.ball_radius)
+        if self.rng.random() < 0.5:
+            cv2.rectangle(image, (cx, cy), (cx + size, cy + size // 4), BALL_COLOR, -1)
+        else:
+            cv2.ellipse(image, (cx, cy), (size, size // 3), float(self.rng.uniform(0, 180)),
+                        0, 360, BALL_COLOR, -1)
+
+
+def write_video(path, scene, count, fps=30.0):
+    """
+    Render count frames of scene to a video file.
+    Returns the list of ground-truth dicts.
+    """
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, (scene.width, scene.height))
+    truths = []
+    for frame, truth in scene.frames(count):
+        writer.write(frame)
+        truths.append(truth)
+    writer.release()
+    return truths
+
+
+def look_at_calibration(position, target, width, height, focal, up=(0, 1, 0)):
+    """
+    Return the CameraCalibration of an undistorted camera at position looking at
+    target, with the principal point at the image center.
+    """
+    position = np.asarray(position, np.float64)
+    forward = np.asarray(target, np.float64) - position
+    forward /= np.linalg.norm(forward)
+    right = np.cross(forward, up)
+    right /= np.linalg.norm(right)
+    down = np.cross(forward, right)
+    rotation = np.array([right, down, forward])
+    camera_matrix = [[focal, 0, width / 2], [0, focal, height / 2], [0, 0, 1]]
+    return CameraCalibration(camera_matrix, rvec=cv2.Rodrigues(rotation)[0], tvec=-rotation @ position)
+
+
+class MultiViewScene:
+    def __init__(self, cameras=2, width=640, height=480, ball_radius=0.04, noise=0.0, fps=30.0,
+                 gravity=9.81, throw_duration=0.8, distance=3.0, spread=60.0, time_offsets=None, seed=0):
+        """
+        Render the views of several cameras of a ball thrown through 3D space, with
+        known ground truth. World units are meters with y up; a new throw starts
+        every throw_duration seconds around the origin.
+        
+        The cameras stand on an arc distance from the origin, spanning spread
+        degrees, and look at it; calibrations holds their CameraCalibrations.
+        Camera k captures its frame i at i / fps + time_offsets[k] seconds, as
+        unsynchronized cameras would, and its calibration carries that offset.
+        """
+        self.width = width
+        self.height = height
+        self.ball_radius = ball_radius
+        self.noise = noise
+        self.fps = fps
+        self.gravity = gravity
+        self.throw_duration = throw_duration
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        self.time_offsets = list(time_offsets) if time_offsets is not None else [0.0] * cameras
+        
+        angles = np.radians(np.linspace(-spread / 2, spread / 2, cameras) if cameras > 1 else [0.0])
+        self.calibrations = []
+        for k, angle in enumerate(angles):
+            position = (distance * np.sin(angle), 0.3, distance * np.cos(angle))
+            calibration = look_at_calibration(position, (0, 0, 0), width, height, focal=width)
+            calibration.time_offset = self.time_offsets[k]
+            calibration.name = f"cam{k}"
+            self.calibrations.append(calibration)
+        
+        self.background = np.empty((height, width, 3), np.uint8)
+        self.background[:] = BACKGROUND_COLOR
+        self.frame_index = 0
+    
+    def throw(self, index):
+        """
+        Return throw number index as (start position, velocity); throws only depend
+        on the seed and their index.
+        """
+        rng = np.random.default_rng((self.seed, index))
+        x0 = rng.uniform(-0.6, 0.6)
+        start = np.array([x0, rng.uniform(0.5, 0.9), rng.uniform(-0.4, 0.4)])
+        velocity = np.array([-np.sign(x0) * rng.uniform(0.5, 1.2), rng.uniform(0.0, 1.5), rng.uniform(-1.0, 1.0)])
+        return start, velocity
+    
+    def position_at(self, t):
+        """
+        Return the true 3D position of the ball at time t (seconds).
+        """
+        index = int(t // self.throw_duration)
+        start, velocity = self.throw(index)
+        dt = t - index * self.throw_duration
+        return start + velocity * dt + np.array([0.0, -0.5 * self.gravity * dt * dt, 0.0])
+    
+    def crossing(self, axis, level, t):
+        """
+        Return (point, time) where the throw in flight at time t next crosses the
+        plane where coordinate axis equals level, or None if it does not before the
+        next throw.
+        """
+        index = int(t // self.throw_duration)
+        start, velocity = self.throw(index)
+        a = -0.5 * self.gravity if axis == 1 else 0.0
+        b, c = velocity[axis], start[axis] - level
+        if a == 0:
+            roots = [-c / b] if b != 0 else []
+        else:
+            discriminant = b * b - 4 * a * c
+            roots = [] if discriminant < 0 else [(-b - np.sqrt(discriminant)) / (2 * a),
+                                                 (-b + np.sqrt(discriminant)) / (2 * a)]
+        t0 = index * self.throw_duration
+        future = [t0 + dt for dt in roots if t < t0 + dt < t0 + self.throw_duration]
+        if not future:
+            return None
+        crossing_time = min(future)
+        return self.position_at(crossing_time), crossing_time
+    
+    def next_frames(self):
+        """
+        Render the next frame of every camera.
+        Returns (frames, truth) where truth is a dict with the frame index and, per
+        camera, the capture time, the true 3D position and whether the ball is visible.
+        """
+        frames = []
+        truth = {"frame": self.frame_index, "times": [], "points": [], "visible": []}
+        for calibration, offset in zip(self.calibrations, self.time_offsets):
+            t = self.frame_index / self.fps + offset
+            point = self.position_at(t)
+            (x, y), = calibration.project(point[None])
+            depth = calibration.depth(point)[0]
+            r = calibration.camera_matrix[0, 0] * self.ball_radius / depth if depth > 0 else 0
+            visible = depth > 0 and -r < x < self.width + r and -r < y < self.height + r
+            
+            frame = self.background.copy()
+            if visible:
+                cv2.circle(frame, (int(round(x)), int(round(y))), int(round(r)), BALL_COLOR, -1, cv2.LINE_AA)
+            if self.noise > 0:
+                noise = self.rng.normal(0, self.noise, frame.shape)
+                frame = np.clip(frame + noise, 0, 255).astype(np.uint8)
+            frames.append(frame)
+            truth["times"].append(t)
+            truth["points"].append(point)
+            truth["visible"].append(bool(visible))
+        self.frame_index += 1
+        return frames, truth
+
+
+def write_multiview(directory, scene, count):
+    """
+    Render count frames of every camera of a MultiViewScene to cam<k>.avi videos
+    in directory, and its calibrations to calibration.json.
+    Returns (video paths, calibration path).
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = [os.path.join(directory, f"{calibration.name}.avi") for calibration in scene.calibrations]
+    writers = [cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), scene.fps, (scene.width, scene.height))
+               for path in paths]
+    for _ in range(count):
+        frames, _ = scene.next_frames()
+        for writer, frame in zip(writers, frames):
+            writer.write(frame)
+    for writer in writers:
+        writer.release()
+    calibration_path = os.path.join(directory, "calibration.json")
+    save_calibration(calibration_path, scene.calibrations)
+    return paths, calibration_path
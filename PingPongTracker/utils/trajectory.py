@@ -1,13 +1,42 @@
 import numpy as np
-from scipy.optimize import curve_fit
+
+from utils.history import as_times, as_xy
+
+FITTERS = ("lstsq", "curve_fit")
+
+# Largest deviation of a sample interval from the mean interval, as a fraction of it,
+# for which the lstsq fitter treats samples as evenly spaced. Capture timestamps
+# jitter by a few percent; a dropped frame doubles an interval.
+EVEN_SPACING_TOLERANCE = 0.05
 
 class TrajectoryPredictor:
-    def __init__(self):
+    def __init__(self, fitter="lstsq", frame_width=640):
         """
         Initialize the trajectory predictor.
+        fitter selects the fitting backend:
+          "lstsq"     - closed-form least squares using a cached pseudo-inverse (default)
+          "curve_fit" - scipy.optimize.curve_fit, kept for comparison (needs SciPy)
+        
+        Positions are fitted against their timestamps (seconds), with t=0 at the
+        newest sample, so predictions hold when frames are dropped or the frame
+        rate varies. Times to intersection are returned in milliseconds.
+        
+        Predicted intersections are clamped to 0..frame_width.
         """
+        if fitter not in FITTERS:
+            raise ValueError(f"Unknown fitter {fitter!r}, expected one of {FITTERS}")
+        self.fitter = fitter
+        self.frame_width = frame_width
         self.trajectory_model = None
         self.min_points = 5  # Minimum points needed for prediction
+        self.current_time = 0.0  # The model is parameterized with t=0 at the newest sample
+        self._pinv_cache = {}  # Window length -> pseudo-inverse of its unit-step Vandermonde matrix
+    
+    def resize(self, frame_width, frame_height):
+        """
+        Set the frame size; predicted intersections are clamped to its width.
+        """
+        self.frame_width = frame_width
     
     def fit_trajectory(self, positions):
         """
@@ -16,20 +45,11 @@ class TrajectoryPredictor:
         if len(positions) < self.min_points:
             return False
         
-        # Extract x and y coordinates
-        x_coords = np.array([pos[0] for pos in positions])
-        y_coords = np.array([pos[1] for pos in positions])
-        
-        # Create time points (assuming constant time between frames)
-        time_points = np.arange(len(positions))
-        
-        # Fit quadratic functions for x and y coordinates
         try:
-            # x(t) = a_x*t^2 + b_x*t + c_x
-            self.x_params, _ = curve_fit(self._quadratic_func, time_points, x_coords, maxfev=10000)
-            
-            # y(t) = a_y*t^2 + b_y*t + c_y
-            self.y_params, _ = curve_fit(self._quadratic_func, time_points, y_coords, maxfev=10000)
+            if self.fitter == "curve_fit":
+                self.x_params, self.y_params = self._fit_curve_fit(positions)
+            else:
+                self.x_params, self.y_params = self._fit_lstsq(positions)
             
             self.trajectory_model = (self.x_params, self.y_params)
             return True
@@ -37,24 +57,78 @@ class TrajectoryPredictor:
             print(f"Trajectory fitting error: {e}")
             return False
     
+    def _fit_lstsq(self, positions):
+        """
+        Fit x(t) and y(t) together with a single matrix multiply.
+        When the samples are evenly spaced up to EVEN_SPACING_TOLERANCE (the usual
+        case, including capture jitter) the fit is done in mean sample steps, whose
+        Vandermonde pseudo-inverse only depends on the window length and is
+        computed once per length, and then rescaled to seconds. Unevenly spaced
+        samples (dropped frames) are solved directly.
+        """
+        xy = as_xy(positions)
+        times = as_times(positions)
+        n = len(times)
+        steps = np.diff(times)
+        step = steps.mean()
+        
+        if step > 0 and np.all(np.abs(steps - step) <= EVEN_SPACING_TOLERANCE * step):
+            pinv = self._pinv_cache.get(n)
+            if pinv is None:
+                time_points = np.arange(1 - n, 1, dtype=np.float64)
+                pinv = np.linalg.pinv(np.vander(time_points, 3))
+                self._pinv_cache[n] = pinv
+            
+            # (3, n) @ (n, 2) -> columns are the (a, b, c) parameters for x and y, per step
+            params = pinv @ xy
+            params[0] /= step * step
+            params[1] /= step
+        else:
+            params = np.linalg.lstsq(np.vander(times - times[-1], 3), xy, rcond=None)[0]
+        return params[:, 0], params[:, 1]
+    
+    def _fit_curve_fit(self, positions):
+        """
+        Fit x(t) and y(t) separately with scipy's iterative nonlinear solver.
+        """
+        # SciPy is only needed for this backend, so import it on first use
+        from scipy.optimize import curve_fit
+        
+        # Extract x and y coordinates
+        xy = as_xy(positions)
+        x_coords = xy[:, 0]
+        y_coords = xy[:, 1]
+        
+        # Time points relative to the newest sample
+        times = as_times(positions)
+        time_points = times - times[-1]
+        
+        # x(t) = a_x*t^2 + b_x*t + c_x
+        x_params, _ = curve_fit(self._quadratic_func, time_points, x_coords, maxfev=10000)
+        
+        # y(t) = a_y*t^2 + b_y*t + c_y
+        y_params, _ = curve_fit(self._quadratic_func, time_points, y_coords, maxfev=10000)
+        
+        return x_params, y_params
+    
     def _quadratic_func(self, t, a, b, c):
         """
         Quadratic function for curve fitting: f(t) = a*t^2 + b*t + c
         """
         return a * t**2 + b * t + c
     
-    def predict_position(self, time_steps_ahead):
+    def predict_position(self, time_ahead):
         """
-        Predict the ball position n time steps ahead.
+        Predict the ball position time_ahead seconds after the newest sample.
+        Use predict_positions() for many times at once.
         """
         if self.trajectory_model is None:
             return None
         
         x_params, y_params = self.trajectory_model
         
-        # Current time is the last index of the positions used for fitting
-        current_time = self.min_points - 1
-        future_time = current_time + time_steps_ahead
+        # Current time is the time of the newest position used for fitting
+        future_time = self.current_time + time_ahead
         
         # Predict future x and y coordinates
         future_x = self._quadratic_func(future_time, *x_params)
@@ -62,10 +136,31 @@ class TrajectoryPredictor:
         
         return int(future_x), int(future_y)
     
+    def predict_positions(self, times_ahead):
+        """
+        Predict the ball positions at an array of times (seconds after the newest sample),
+        e.g. to draw the predicted arc.
+        Returns an (n, 2) float array, or None without a trajectory.
+        """
+        if self.trajectory_model is None:
+            return None
+        
+        x_params, y_params = self.trajectory_model
+        
+        # Current time is the time of the newest position used for fitting
+        future_times = self.current_time + np.atleast_1d(np.asarray(times_ahead, dtype=np.float64))
+        
+        # Predict future x and y coordinates
+        positions = np.empty((len(future_times), 2))
+        positions[:, 0] = np.polyval(x_params, future_times)
+        positions[:, 1] = np.polyval(y_params, future_times)
+        return positions
+    
     def predict_intersection(self, y_level):
         """
         Predict where the ball will intersect with a horizontal line at y_level.
-        Returns (x_intersection, time_to_intersection) or None if no intersection.
+        Returns (x_intersection, time_to_intersection in milliseconds) or None if no intersection.
+        Use predict_intersections() for several levels at once.
         """
         if self.trajectory_model is None:
             return None
@@ -89,7 +184,7 @@ class TrajectoryPredictor:
             t2 = (-b - np.sqrt(discriminant)) / (2*a)
             
             # Choose the positive time that is greater than current time
-            current_time = self.min_points - 1
+            current_time = self.current_time
             valid_times = [t for t in [t1, t2] if t > current_time]
             
             if not valid_times:
@@ -102,10 +197,10 @@ class TrajectoryPredictor:
             x_intersection = self._quadratic_func(t_intersection, *x_params)
             
             # Ensure the intersection point is within screen bounds and is an integer
-            x_intersection = int(max(0, min(x_intersection, 640)))  # Assuming max width is 640
+            x_intersection = int(max(0, min(x_intersection, self.frame_width)))
             
-            # Calculate time to intersection from now
-            time_to_intersection = t_intersection - current_time
+            # Calculate time to intersection from now, in milliseconds
+            time_to_intersection = (t_intersection - current_time) * 1000.0
             
             return x_intersection, time_to_intersection
         except Exception as e:
@@ -116,3 +211,131 @@ class TrajectoryPredictor:
         time_to_intersection = t_intersection - current_time
         
         return int(x_intersection), time_to_intersection
+    
+    def predict_intersections(self, y_levels):
+        """
+        Predict where the ball will cross each horizontal line in an array of y levels
+        (e.g. several paddles, the table edge and the net) in one vectorized step.
+        Returns (x_intersections, times_to_intersection in milliseconds) arrays, with
+        NaN for levels the ball will not reach, or None without a trajectory.
+        """
+        if self.trajectory_model is None:
+            return None
+        
+        x_params, y_params = self.trajectory_model
+        y_levels = np.atleast_1d(np.asarray(y_levels, dtype=np.float64))
+        
+        # Solve the quadratic equation: a*t^2 + b*t + c = y_level
+        a, b, c = y_params
+        c_adjusted = c - y_levels
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if a == 0:
+                # Straight-line motion has a single crossing
+                t1 = t2 = -c_adjusted / b
+            else:
+                # A negative discriminant (no real solutions) gives NaN times
+                root = np.sqrt(b**2 - 4*a*c_adjusted)
+                t1 = (-b + root) / (2*a)
+                t2 = (-b - root) / (2*a)
+        
+        # Choose the earliest of the crossings after the current time
+        current_time = self.current_time
+        t1 = np.where(t1 > current_time, t1, np.inf)
+        t2 = np.where(t2 > current_time, t2, np.inf)
+        t_intersection = np.minimum(t1, t2)
+        t_intersection[~np.isfinite(t_intersection)] = np.nan
+        
+        # Calculate the x-coordinates at the intersection times, within the frame
+        x_intersection = np.clip(np.polyval(x_params, t_intersection), 0, self.frame_width)
+        
+        # Calculate times to intersection from now, in milliseconds
+        time_to_intersection = (t_intersection - current_time) * 1000.0
+        
+        return x_intersection, time_to_intersection
+
+
+class RecursiveTrajectoryPredictor(TrajectoryPredictor):
+    def __init__(self, forgetting_factor=0.9, frame_width=640):
+        """
+        Incremental trajectory predictor with the same API as TrajectoryPredictor.
+        Keeps exponentially weighted least-squares statistics for the quadratic
+        model, so each new position is absorbed in O(1) instead of refitting the
+        whole history. forgetting_factor (0 < f <= 1) sets the memory: older samples
+        are down-weighted by f per step, giving an effective window of ~1/(1-f).
+        """
+        super().__init__(frame_width=frame_width)
+        if not 0 < forgetting_factor <= 1:
+            raise ValueError("forgetting_factor must be in (0, 1]")
+        self.forgetting_factor = forgetting_factor
+        self.reset()
+    
+    def reset(self):
+        """
+        Forget all samples.
+        """
+        self.trajectory_model = None
+        self.samples = 0
+        self._last_time = None  # Timestamp of the newest sample
+        self._seen = None  # (history, epoch, appended) when positions were last consumed
+        # Weighted normal equations A @ [params_x, params_y] = B, with regressor [t^2, t, 1]
+        self._A = np.zeros((3, 3))
+        self._B = np.zeros((3, 2))
+    
+    def update(self, x, y, timestamp=None):
+        """
+        Absorb one new position taken at timestamp (seconds); without a timestamp
+        it is taken one time unit after the previous one.
+        """
+        if self.samples:
+            dt = 1.0 if timestamp is None or self._last_time is None else timestamp - self._last_time
+            
+            # Move the time origin forward by dt: t_new = t_old - dt, so the old
+            # regressor [t^2, t, 1] becomes shift @ [t^2, t, 1]
+            shift = np.array([[1.0, -2.0 * dt, dt * dt], [0.0, 1.0, -dt], [0.0, 0.0, 1.0]])
+            self._A = self.forgetting_factor * (shift @ self._A @ shift.T)
+            self._B = self.forgetting_factor * (shift @ self._B)
+        
+        # The new sample sits at t=0, where the regressor is [0, 0, 1]
+        self._A[2, 2] += 1.0
+        self._B[2, 0] += x
+        self._B[2, 1] += y
+        self._last_time = timestamp
+        self.samples += 1
+    
+    def fit_trajectory(self, positions):
+        """
+        Absorb the positions added since the last call and refresh the model.
+        positions is the tracker's PositionHistory; only the unseen tail is used.
+        """
+        for x, y, _, timestamp, _ in self._new_samples(positions):
+            self.update(x, y, timestamp)
+        
+        if self.samples < self.min_points:
+            return False
+        
+        try:
+            params = np.linalg.solve(self._A, self._B)
+        except np.linalg.LinAlgError as e:
+            print(f"Trajectory fitting error: {e}")
+            return False
+        
+        self.x_params, self.y_params = params[:, 0], params[:, 1]
+        self.trajectory_model = (self.x_params, self.y_params)
+        return True
+    
+    def _new_samples(self, positions):
+        """
+        Return the samples appended since the last call.
+        """
+        seen = self._seen
+        new = len(positions)
+        if seen is not None:
+            if seen[0] is positions and seen[1] == positions.epoch and positions.appended - seen[2] <= new:
+                new = positions.appended - seen[2]
+            else:
+                # The history is a different one, was cleared, or moved on by more than
+                # its capacity since the last call, so continuing is impossible
+                self.reset()
+        
+        self._seen = (positions, positions.epoch, positions.appended)
+        return positions.samples()[len(positions) - new:]
@@ -0,0 +1,266 @@
+import csv
+import itertools
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from utils.frame_source import DEFAULT_FPS, open_source
+from utils.game import create_session
+
+# Candidate values of the detection options, by option name (the dest of its
+# command line flag)
+SEARCH_SPACE = {
+    "hsv_lower": [(15, 100, 100), (20, 100, 100), (25, 100, 100), (20, 70, 70), (20, 130, 130)],
+    "hsv_upper": [(30, 255, 255), (35, 255, 255), (40, 255, 255)],
+    "erode": [0, 1, 2],
+    "dilate": [1, 2, 3],
+    "blur": [0, 3, 5, 7],
+    "min_radius": [2, 3, 5],
+    "max_radius": [30, 50, 80],
+    "min_circularity": [0.55, 0.65, 0.75],
+    "small_circularity": [0.4, 0.5, 0.6],
+    "search_radius": [15, 30, 45],
+    "process_noise": [0.01, 0.03, 0.1],
+}
+
+# Options varied by a grid search unless chosen otherwise
+GRID_OPTIONS = ("erode", "dilate", "blur", "min_circularity")
+
+
+class SharedFrames:
+    def __init__(self, shape, name=None):
+        """
+        A (count, height, width, 3) uint8 block of decoded frames in shared memory,
+        so worker processes read them without decoding or copying. Without a name a
+        new block is created; with one, the block of that name is attached.
+        """
+        self.shape = tuple(shape)
+        self.memory = shared_memory.SharedMemory(name=name, create=name is None,
+                                                 size=max(1, int(np.prod(self.shape))))
+        self.name = self.memory.name
+        self.frames = np.ndarray(self.shape, np.uint8, buffer=self.memory.buf)
+    
+    def close(self):
+        self.frames = None
+        self.memory.close()
+    
+    def unlink(self):
+        """
+        Close and free the block; only the process that created it should do this.
+        """
+        self.close()
+        self.memory.unlink()
+
+
+def decode_shared(path, max_frames=None):
+    """
+    Decode a recording (video file or image directory) once into SharedFrames.
+    Video frames are decoded straight into the shared block when the frame count
+    is known; otherwise the recording is read to its end first.
+    Returns (SharedFrames, number of frames read, fps).
+    """
+    source = open_source(path)
+    if not source.isOpened():
+        raise ValueError(f"Could not open {path}")
+    success, first = source.read()
+    if not success:
+        raise ValueError(f"Could not read from {path}")
+    count = source.frame_count
+    if max_frames is not None and (count <= 0 or max_frames < count):
+        count = max_frames
+    
+    if count > 0:
+        shared = SharedFrames((count,) + first.shape)
+        shared.frames[0] = first
+        read = 1
+        while read < count:
+            target = shared.frames[read]
+            success, frame = source.read(target)
+            if not success:
+                break
+            # Sources that cannot decode into the given array return a new one
+            if not np.shares_memory(frame, target):
+                target[...] = frame
+            read += 1
+    else:
+        frames = [first]
+        while True:
+            success, frame = source.read()
+            if not success:
+                break
+            frames.append(frame)
+        shared = SharedFrames((len(frames),) + first.shape)
+        for target, frame in zip(shared.frames, frames):
+            target[...] = frame
+        read = len(frames)
+    fps = source.fps or DEFAULT_FPS
+    source.release()
+    return shared, read, fps
+
+
+def load_labels(path, count):
+    """
+    Read the true ball positions of a recording from a JSONL or CSV file with
+    frame, x and y columns (x empty or null when there is no ball), like the
+    tracks written by process_recording.py.
+    Returns (visible, xy) arrays over the first count frames; unlabelled frames
+    count as having no ball.
+    """
+    if path.lower().endswith(".csv"):
+        with open(path, newline="") as f:
+            records = list(csv.DictReader(f))
+    else:
+        with open(path) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+    
+    visible = np.zeros(count, bool)
+    xy = np.zeros((count, 2))
+    for record in records:
+        frame = int(record["frame"])
+        if frame < count and record["x"] not in (None, ""):
+            visible[frame] = True
+            xy[frame] = float(record["x"]), float(record["y"])
+    return visible, xy
+
+
+def grid_trials(base, options=GRID_OPTIONS, space=SEARCH_SPACE):
+    """
+    Return every combination of the space's values for options, the other
+    detection options keeping their base values.
+    """
+    return [dict(base, **dict(zip(options, values)))
+            for values in itertools.product(*(space[option] for option in options))]
+
+
+def random_trials(base, count, options=None, space=SEARCH_SPACE, seed=0):
+    """
+    Return up to count distinct trials with each of options (default: the whole
+    space) drawn at random from its values.
+    """
+    rng = np.random.default_rng(seed)
+    options = options or list(space)
+    trials = []
+    seen = set()
+    for _ in range(count * 10):
+        trial = dict(base, **{option: space[option][rng.integers(len(space[option]))] for option in options})
+        key = tuple(sorted(trial.items()))
+        if key not in seen:
+            seen.add(key)
+            trials.append(trial)
+            if len(trials) == count:
+                break
+    return trials
+
+
+def pareto_front(results):
+    """
+    Return the results no other result beats on both F1 and CPU time per frame,
+    fastest first.
+    """
+    front = []
+    for result in sorted(results, key=lambda r: (r["ms_per_frame"], -r["f1"])):
+        if not front or result["f1"] > front[-1]["f1"]:
+            front.append(result)
+    return front
+
+
+# Worker state: the recordings attached from shared memory, and the session options
+_recordings = []
+_args = None
+
+
+def _init_worker(recordings, args):
+    global _recordings, _args
+    # Each worker already owns a core; keep OpenCV from spawning its own thread pool
+    cv2.setNumThreads(1)
+    _args = args
+    _recordings = []
+    for name, shape, count, fps, visible, xy in recordings:
+        shared = SharedFrames(shape, name)
+        # The frames are shared by all trials, so nothing may write to them
+        shared.frames.flags.writeable = False
+        _recordings.append((shared, count, fps, visible, xy))
+
+
+def _run_trial(options, match_distance):
+    return evaluate(options, _args, _recordings, match_distance)
+
+
+def evaluate(options, args, recordings, match_distance=10.0):
+    """
+    Track every recording with a fresh session configured from args with options
+    applied, and score the measured detections against the labels: a detection
+    within match_distance pixels of the labelled ball is a true positive, any
+    other one a false positive, and a labelled ball without one a miss.
+    recordings holds (SharedFrames, count, fps, visible, xy) tuples. The cost is
+    the CPU time per frame of detect_ball, which other processes running at the
+    same time do not inflate.
+    Returns a dict of the options and metrics.
+    """
+    trial_args = type(args)(**vars(args))
+    vars(trial_args).update(options)
+    true_positives = false_positives = misses = frames = 0
+    errors = []
+    cpu = 0.0
+    
+    for shared, count, fps, visible, xy in recordings:
+        tracker = create_session(trial_args, shared.shape[2], shared.shape[1]).ball_tracker
+        for i in range(count):
+            start = time.process_time()
+            ball_pos = tracker.detect_ball(shared.frames[i], i / fps)
+            cpu += time.process_time() - start
+            
+            # detect_ball also returns Kalman predictions; only score real measurements
+            measured = ball_pos is not None and tracker.misses == 0
+            error = np.hypot(ball_pos[0] - xy[i, 0], ball_pos[1] - xy[i, 1]) if measured else np.inf
+            if measured and visible[i] and error <= match_distance:
+                true_positives += 1
+                errors.append(float(error))
+            else:
+                false_positives += measured
+                misses += bool(visible[i])
+        frames += count
+    
+    precision = true_positives / (true_positives + false_positives) if true_positives + false_positives else 0.0
+    recall = true_positives / (true_positives + misses) if true_positives + misses else 0.0
+    return {
+        "options": options,
+        "f1": 2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+        "precision": precision,
+        "recall": recall,
+        "error_px": float(np.mean(errors)) if errors else None,
+        "ms_per_frame": cpu * 1000 / frames if frames else 0.0,
+    }
+
+
+def run_trials(trials, args, recordings, workers=1, match_distance=10.0):
+    """
+    Evaluate trials (dicts of option values) on a process pool. recordings holds
+    (SharedFrames, count, fps, visible, xy) tuples; the workers attach the frames
+    from shared memory by name. Returns the results in trial order.
+    """
+    specs = [(shared.name, shared.shape, count, fps, visible, xy)
+             for shared, count, fps, visible, xy in recordings]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(specs, args)) as pool:
+        return list(pool.map(_run_trial, trials, itertools.repeat(match_distance)))
+
+
+def best_trial(results, cost_weight):
+    """
+    Return the result with the best F1 less cost_weight per millisecond of CPU
+    time per frame.
+    """
+    return max(results, key=lambda r: r["f1"] - cost_weight * r["ms_per_frame"])
+
+
+def option_flags(options):
+    """
+    Format option values as the command line flags that select them.
+    """
+    return " ".join(f"--{name.replace('_', '-')} "
+                    f"{','.join(map(str, value)) if isinstance(value, (tuple, list)) else value}"
+                    for name, value in options.items())